@@ -0,0 +1,64 @@
+import io
+import os
+import time
+import tempfile
+import contextlib
+
+import telekinesis as tk
+import telekinesis_data as td
+
+def make_tree(path, dirs, files, size):
+    for d in range(dirs):
+        os.makedirs(os.path.join(path, f'dir_{d}', 'sub'), exist_ok=True)
+        for f in range(files):
+            name = os.path.join(path, f'dir_{d}', 'sub' if f % 2 else '', f'file_{f}.txt')
+            with open(name, 'wb') as fh:
+                fh.write((f'{d}/{f} ' * (size // 8 + 1)).encode()[:size])
+
+async def timed(coro):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        await coro
+        return time.perf_counter() - t0
+
+async def close(*objects):
+    for obj in objects:
+        obj._block_gc = True
+        await obj._close()
+
+async def sync_pass(path, dirs, files, size):
+    out = {}
+    data = td.TelekinesisData(tk.Session(), os.path.join(path, 'data'))
+    data.begin()
+    branch = await data.get_branch(((), None))
+    try:
+        source, target = os.path.join(path, 'source'), os.path.join(path, 'target')
+        make_tree(source, dirs, files, size)
+        os.makedirs(target)
+
+        upload = td.FileSync(branch, source, os.path.join(path, 'support_0'), interval=3600)
+        upload.stop()
+        out['file_sync.upload'] = await timed(upload.sync())
+        out['file_sync.noop'] = await timed(upload.sync())
+
+        for d in range(dirs):
+            name = os.path.join(source, f'dir_{d}', 'file_0.txt')
+            with open(name, 'ab') as fh:
+                fh.write(b'changed')
+        out['file_sync.incremental'] = await timed(upload.sync())
+
+        download = td.FileSync(branch, target, os.path.join(path, 'support_1'), interval=3600)
+        download.stop()
+        out['file_sync.download'] = await timed(download.sync())
+    finally:
+        await close(branch, data.client)
+    return out
+
+async def run(quick=False, repeat=3):
+    dirs, files, size = (4, 10, 2048) if quick else (16, 40, 8192)
+    best = {}
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as path:
+            for name, elapsed in (await sync_pass(path, dirs, files, size)).items():
+                best[name] = min(best.get(name, elapsed), elapsed)
+    return {name: elapsed / (dirs * files) * 1e6 for name, elapsed in best.items()}
@@ -0,0 +1,65 @@
+import asyncio
+import tempfile
+
+import telekinesis as tk
+import telekinesis_data as td
+
+from timing import ameasure
+
+async def start_peers(path, url, count):
+    entrypoints = []
+    for i in range(count):
+        u = await tk.Entrypoint(url, path + '/session.pem')
+        u._session.instance_id = f'{"abcd"[i] * 4}{count:04d}'
+        entrypoints.append(u)
+
+    peers = [td.TelekinesisData(u._session, path + f'/data_{i}/').client for i, u in enumerate(entrypoints)]
+    await peers[0].begin()
+    await entrypoints[0].update({'d0': peers[0]})
+    for u, peer in zip(entrypoints[1:], peers[1:]):
+        await (await u.get('d0')).add_peer(peer)
+    return peers
+
+async def bench_peers(url, count, n):
+    out = {}
+    with tempfile.TemporaryDirectory() as path:
+        peers = await start_peers(path, url, count)
+        keys = [(f'p{i % count}', f'k{i}') for i in range(n)]
+        owners = [peers[i % count] for i in range(n)]
+
+        async def set_all():
+            for key, peer in zip(keys, owners):
+                await peer.set(key, {'i': key[1]}, {'i': key[1]})
+
+        async def get_all():
+            for i, key in enumerate(keys):
+                await peers[(i + 1) % count].get(key)
+
+        async def list_all():
+            for i in range(n):
+                await peers[i % count].list((f'p{i % count}',))
+
+        async def tree_all():
+            for peer in peers:
+                await peer.tree(())
+
+        prefix = f'distributed.{count}_peers'
+        out[f'{prefix}.set'] = await ameasure(set_all, n, 1)
+        out[f'{prefix}.get'] = await ameasure(get_all, n)
+        out[f'{prefix}.list'] = await ameasure(list_all, n)
+        out[f'{prefix}.tree'] = await ameasure(tree_all, count)
+    return out
+
+async def run(quick=False, port=8890):
+    class Registry(dict): pass
+
+    url = f'ws://localhost:{port}'
+    broker = await tk.Broker().serve(port=port)
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), url)
+    out = {}
+    try:
+        for count in [1, 2, 4]:
+            out.update(await bench_peers(url, count, 40 if quick else 400))
+    finally:
+        await broker.close()
+    return out
@@ -0,0 +1,72 @@
+import os
+import tempfile
+
+from telekinesis_data.storage import STREAM_FORMATS, StreamWriter, SimpleKV
+from telekinesis_data.timetravel import TimetravelerKV
+from telekinesis_data.checkpoint import CheckpointPolicy, RecordCountPolicy
+
+from timing import measure
+
+def bench_streams(path, n):
+    out = {}
+    records = [{i: {'value': 'x' * 32, 'metadata': {'i': i}}} for i in range(n)]
+    for name, stream_type in STREAM_FORMATS.items():
+        stream = stream_type(os.path.join(path, name))
+        out[f'stream.{name}.append'] = measure(lambda: [stream.update(r) for r in records], n)
+        total = sum(1 for _ in stream)
+        out[f'stream.{name}.iterate'] = measure(lambda: sum(1 for _ in stream), total)
+
+        writer = StreamWriter()
+        batched = stream_type(os.path.join(path, name + '_batched'), writer=writer)
+        def append_batched():
+            with writer.batch():
+                for r in records:
+                    batched.update(r)
+        out[f'stream.{name}.append_batched'] = measure(append_batched, n)
+    return out
+
+def bench_simple_kv(path, n):
+    kv = SimpleKV(os.path.join(path, 'simple_kv'))
+    value = {'value': 'x' * 32, 'i': 0}
+    return {
+        'simple_kv.set': measure(lambda: [kv.set(('k', str(i)), value) for i in range(n)], n),
+        'simple_kv.get': measure(lambda: [kv.get(('k', str(i))) for i in range(n)], n),
+    }
+
+def bench_timetravel(path, lengths, gets):
+    out = {}
+    for length in lengths:
+        for name, policy in [('checkpointed', RecordCountPolicy(64)), ('raw', CheckpointPolicy())]:
+            kv = TimetravelerKV(os.path.join(path, f'tt_{name}_{length}'), policy=policy)
+            key = ('k',)
+            for i in range(length):
+                kv.set(key, [('uu', {'metadata': {str(i % 16): i}}), ('u', {'value': str(i)})])
+            versions = kv.list_versions(key)
+            middle = versions[len(versions) // 2]
+            out[f'timetravel.{name}.{length}.get_latest'] = measure(lambda: [kv.get(key) for _ in range(gets)], gets)
+            out[f'timetravel.{name}.{length}.get_past'] = \
+                measure(lambda: [kv.get(key, middle) for _ in range(gets)], gets)
+    return out
+
+def bench_replay(n):
+    kv = TimetravelerKV.__new__(TimetravelerKV)
+    changes = [
+        [('uu', {'metadata': {str(i % 32): i}}), ('u', {'value': str(i)}), ('ua', {'children': str(i % 64)})]
+        for i in range(n)]
+    def replay():
+        value = None
+        for change in changes:
+            for mode, diff in change:
+                value = kv._recursive_update(mode, value, diff)
+        return value
+    return {'timetravel.recursive_update': measure(replay, n * 3)}
+
+def run(quick=False):
+    n = 200 if quick else 2000
+    out = {}
+    with tempfile.TemporaryDirectory() as path:
+        out.update(bench_streams(path, n))
+        out.update(bench_simple_kv(path, n // 4))
+        out.update(bench_timetravel(path, [10, 100] if quick else [10, 100, 1000], 50 if quick else 200))
+        out.update(bench_replay(n))
+    return out
@@ -0,0 +1,41 @@
+import sys
+import time
+import asyncio
+import tempfile
+from types import SimpleNamespace
+
+import telekinesis as tk
+import telekinesis_data as td
+
+async def bench(peers, calls=20000):
+    session = tk.Session()
+    with tempfile.TemporaryDirectory() as path:
+        data = td.TelekinesisData(session, path)
+        data.begin()
+        for i in range(peers):
+            peer_id = f'AAAApeer{i:04d}'
+            data._peers[peer_id] = None
+            data._peer_ids[peer_id[4:]] = peer_id
+
+        serial = session.session_key.public_serial()
+        context = SimpleNamespace(
+            caller=SimpleNamespace(session=(serial, f'peer{peers - 1:04d}')),
+            reply_to=SimpleNamespace(session=(serial, 'peer0000'))
+        )
+        data._branch_infos[(data._default_branch_id, (('x',), 'b'))] = data._branches[data._default_branch_id]
+
+        out = {}
+        for name, branch in [('default branch', None), ('branch tuple', (('x',), 'b'))]:
+            t0 = time.perf_counter()
+            for _ in range(calls):
+                await data._overhead(context, branch)
+            out[name] = (time.perf_counter() - t0) / calls * 1e6
+        return out
+
+async def main(peer_counts):
+    for peers in peer_counts:
+        out = await bench(peers)
+        print(f'{peers:>5} peers', *(f'{name}: {us:.2f}us/call' for name, us in out.items()), sep='  ')
+
+if __name__ == '__main__':
+    asyncio.run(main([int(n) for n in sys.argv[1:]] or [1, 10, 100, 1000]))
@@ -0,0 +1,100 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+
+import micro
+import macro
+import file_sync
+
+SUITES = ['micro', 'macro', 'file_sync']
+
+async def run(suites, quick=False, port=8890):
+    results = {}
+    for suite in suites:
+        if suite == 'micro':
+            results.update(micro.run(quick))
+        elif suite == 'macro':
+            results.update(await macro.run(quick, port))
+        elif suite == 'file_sync':
+            results.update(await file_sync.run(quick))
+        else:
+            raise ValueError(f"Unknown suite '{suite}'")
+    return results
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': time.time(), 'commit': commit, 'python': platform.python_version(),
+        'platform': platform.platform(), 'unit': 'us/op'
+    }
+
+def compare(baseline, current, tolerance=0.1):
+    rows, regressions = [], []
+    for name in sorted(set(baseline) | set(current)):
+        before, after = baseline.get(name), current.get(name)
+        if before is None or after is None:
+            rows.append((name, before, after, None))
+            continue
+        ratio = after / before if before else float('inf')
+        rows.append((name, before, after, ratio))
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+    return rows, regressions
+
+def print_results(results):
+    width = max(map(len, results), default=0)
+    for name, value in sorted(results.items()):
+        print(f'{name:<{width}}  {value:12.2f} us/op')
+
+def print_comparison(rows, regressions):
+    width = max((len(row[0]) for row in rows), default=0)
+    for name, before, after, ratio in rows:
+        if ratio is None:
+            print(f'{name:<{width}}  {"-" if before is None else f"{before:.2f}":>12}  '
+                  f'{"-" if after is None else f"{after:.2f}":>12}')
+        else:
+            flag = '  REGRESSION' if name in regressions else ''
+            print(f'{name:<{width}}  {before:12.2f}  {after:12.2f}  {ratio:6.2f}x{flag}')
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='telekinesis_data benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help='run benchmarks and save the results as JSON')
+    run_parser.add_argument('--suite', action='append', choices=SUITES, help='suites to run (default: all)')
+    run_parser.add_argument('--quick', action='store_true', help='smaller workloads, for smoke testing')
+    run_parser.add_argument('--port', type=int, default=8890, help='port for the local broker')
+    run_parser.add_argument('-o', '--output', help='write results to this JSON file')
+
+    compare_parser = commands.add_parser('compare', help='compare results against a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--tolerance', type=float, default=0.1, help='allowed slowdown ratio (default 0.1)')
+
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        results = asyncio.run(run(args.suite or SUITES, args.quick, args.port))
+        print_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump({'environment': environment(), 'results': results}, f, indent=2, sort_keys=True)
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.current) as f:
+        current = json.load(f)['results']
+    rows, regressions = compare(baseline, current, args.tolerance)
+    print_comparison(rows, regressions)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
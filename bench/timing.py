@@ -0,0 +1,19 @@
+import time
+
+def measure(fn, ops, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best / ops * 1e6
+
+async def ameasure(fn, ops, repeat=3):
+    best = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        await fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    return best / ops * 1e6
@@ -14,6 +14,7 @@ setuptools.setup(
     url="https://github.com/telekinesis-inc/telekinesis_data",
     packages=setuptools.find_packages(),
     install_requires=["telekinesis", "bson", "ujson"],
+    extras_require={"msgpack": ["msgpack"], "zstd": ["zstandard"]},
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
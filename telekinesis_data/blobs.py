@@ -0,0 +1,288 @@
+import os
+import time
+import base64
+import asyncio
+import inspect
+import hashlib
+import threading
+from collections import deque, Counter, OrderedDict
+
+from .storage import SimpleFileContainer, LogFileContainer, Stream, KeyedExecutor
+from .compression import NONE, DEFAULT_POLICY, decompress, iter_decompress
+
+class ShardedFileContainer(SimpleFileContainer):
+    def __init__(self, path, stream=None, levels=2, width=2):
+        self._levels = levels
+        self._width = width
+        self._shards = set()
+        super().__init__(path, stream)
+        self._flat = any(len(f) >= 43 for f in os.listdir(path))
+
+    def _file(self, key, create=False):
+        digest = key[-43:]
+        shard = os.path.join(
+            self._path, *(digest[i*self._width:(i+1)*self._width] for i in range(self._levels)))
+        path = os.path.join(shard, key)
+        if create:
+            if shard not in self._shards:
+                os.makedirs(shard, exist_ok=True)
+                self._shards.add(shard)
+        elif self._flat and not os.path.exists(path) and os.path.exists(flat := os.path.join(self._path, key)):
+            return flat
+        return path
+
+CHUNK_SIZE = 2**18
+WINDOW = 8
+
+class BlobReader:
+    def __init__(self, store, key, chunk_size=CHUNK_SIZE):
+        self._store = store
+        self._key = key
+        self._chunk_size = chunk_size
+        self.codec = store.codec(key)
+
+    async def read(self, index):
+        chunk = await self._store.aread(self._key, index * self._chunk_size, self._chunk_size)
+        self._store.transferred['sent'] += len(chunk)
+        return chunk
+
+class BlobStore:
+    def __init__(self, path, stream=None, container=None, executor=None, compression=DEFAULT_POLICY, grace=0):
+        self._blobs = (container or ShardedFileContainer)(path, stream)
+        self._executor = executor
+        self._compression = compression
+        self.grace = grace
+        self._lock = threading.RLock()
+        self._touched = OrderedDict()
+        self._codecs_stream = (stream or Stream)(os.path.join(path, 'codecs'))
+        self._codecs = None
+        self._partial = os.path.join(path, 'partial')
+        self._receiving = {}
+        self.transferred = Counter()
+
+    def get(self, key):
+        if key in self._blobs:
+            return decompress(self._blobs.get(key), self.codec(key))
+
+    def set(self, key, value):
+        codec, data = self._compression.encode(value) if self._compression else (NONE, value)
+        self._touch(key)
+        self._set_codec(key, codec)
+        return self._blobs.set(key, data)
+
+    def put(self, key, data, codec=NONE):
+        value = decompress(data, codec)
+        if base64.b64encode(hashlib.blake2s(value).digest(), b'_-')[:-1].decode() != key[-43:]:
+            raise ValueError(f'Received blob does not match its hash {key}')
+        self._touch(key)
+        if key not in self._blobs:
+            self._set_codec(key, codec)
+            self._blobs.set(key, data)
+        return value
+
+    def codec(self, key):
+        with self._lock:
+            return self._load_codecs().get(key, NONE)
+
+    def read(self, key, offset, length):
+        return self._blobs.read(key, offset, length)
+
+    async def aget(self, key):
+        return await self._run(key, self.get, key)
+
+    async def aset(self, key, value):
+        return await self._run(key, self.set, key, value)
+
+    async def aput(self, key, data, codec=NONE):
+        return await self._run(key, self.put, key, data, codec)
+
+    async def aread(self, key, offset, length):
+        return await self._run(key, self.read, key, offset, length)
+
+    async def _run(self, key, fn, *args):
+        if self._executor is None:
+            self._executor = KeyedExecutor()
+        return await self._executor.run(key, fn, *args)
+
+    def reader(self, key):
+        self._touch(key)
+        return BlobReader(self, key)
+
+    async def receive(self, key, reader, window=WINDOW):
+        if key in self._blobs:
+            return
+        if key not in self._receiving:
+            self._receiving[key] = asyncio.ensure_future(self._receive(key, reader, window))
+        try:
+            await asyncio.shield(self._receiving[key])
+        finally:
+            if self._receiving.get(key) and self._receiving[key].done():
+                self._receiving.pop(key)
+
+    async def _receive(self, key, reader, window):
+        codec = getattr(reader, 'codec', NONE)
+        if inspect.isawaitable(codec):
+            try:
+                codec = await codec
+            except Exception:
+                codec = NONE
+        os.makedirs(self._partial, exist_ok=True)
+        path = os.path.join(self._partial, key)
+        digest = hashlib.blake2s()
+        index = 0
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                while len(chunk := f.read(CHUNK_SIZE)) == CHUNK_SIZE:
+                    digest.update(chunk)
+                    index += 1
+                f.truncate(index * CHUNK_SIZE)
+
+        pending = deque()
+        try:
+            with open(path, 'ab') as f:
+                while True:
+                    while len(pending) < window:
+                        pending.append(asyncio.ensure_future(reader.read(index + len(pending))))
+                    chunk = await pending.popleft()
+                    self.transferred['received'] += len(chunk)
+                    f.write(chunk)
+                    digest.update(chunk)
+                    index += 1
+                    if len(chunk) < CHUNK_SIZE:
+                        break
+        finally:
+            for task in pending:
+                task.cancel()
+
+        if codec:
+            digest = hashlib.blake2s()
+            with open(path, 'rb') as f:
+                for chunk in iter_decompress(iter(lambda: f.read(CHUNK_SIZE), b''), codec):
+                    digest.update(chunk)
+        if base64.b64encode(digest.digest(), b'_-')[:-1].decode() != key[-43:]:
+            os.remove(path)
+            raise ValueError(f'Received blob does not match its hash {key}')
+        self._touch(key)
+        self._set_codec(key, codec)
+        self._blobs.set_file(key, path)
+
+    def remove(self, key):
+        self._set_codec(key, NONE)
+        self._blobs.remove(key)
+
+    def size(self, key):
+        return self._blobs.size(key)
+
+    def keys(self):
+        return self._blobs.keys()
+
+    def __contains__(self, key):
+        return key in self._blobs
+
+    def collect(self, references, dry_run=False):
+        fresh = self._fresh()
+        garbage = [k for k in self._blobs.keys() if not references.get(k) and k not in fresh]
+        out = {'blobs': len(garbage), 'bytes': sum(self._blobs.size(k) for k in garbage)}
+        if not dry_run:
+            for key in garbage:
+                self._blobs.remove(key)
+            with self._lock:
+                self._codecs = {k: c for k, c in self._load_codecs().items() if k in self._blobs}
+                self._codecs_stream.rewrite(self._codecs)
+        return out
+
+    def _touch(self, key):
+        if self.grace:
+            now = time.time()
+            with self._lock:
+                self._touched[key] = now
+                self._touched.move_to_end(key)
+                while self._touched and next(iter(self._touched.values())) < now - self.grace:
+                    self._touched.popitem(last=False)
+
+    def _fresh(self):
+        cutoff = time.time() - self.grace
+        with self._lock:
+            return {k for k, t in self._touched.items() if t >= cutoff}
+
+    def _set_codec(self, key, codec):
+        with self._lock:
+            codecs = self._load_codecs()
+            if codecs.get(key, NONE) != codec:
+                self._codecs_stream.update({key: codec})
+                if codec:
+                    codecs[key] = codec
+                else:
+                    codecs.pop(key)
+
+    def _load_codecs(self):
+        if self._codecs is None:
+            self._codecs = {}
+            for k, codec in self._codecs_stream:
+                if codec:
+                    self._codecs[k] = codec
+                else:
+                    self._codecs.pop(k, None)
+        return self._codecs
+
+class BlobCache(BlobStore):
+    def __init__(
+        self, path, stream=None, container=None, executor=None, compression=DEFAULT_POLICY, max_bytes=2**28
+    ):
+        super().__init__(path, stream, container, executor, compression)
+        self.max_bytes = max_bytes
+        self._lru = OrderedDict((k, self._blobs.size(k)) for k in self._blobs.keys())
+        self._bytes = sum(self._lru.values())
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._lru:
+                self._misses += 1
+                return None
+            self._hits += 1
+            self._lru.move_to_end(key)
+            data, codec = self._blobs.get(key), self.codec(key)
+        return decompress(data, codec)
+
+    def put(self, key, data, codec=NONE):
+        value = super().put(key, data, codec)
+        self._admit(key)
+        return value
+
+    async def receive(self, key, reader, window=WINDOW):
+        await super().receive(key, reader, window)
+        return await self._run(key, self._admit, key, True)
+
+    def remove(self, key):
+        with self._lock:
+            if (size := self._lru.pop(key, None)) is not None:
+                self._bytes -= size
+            super().remove(key)
+
+    def cache_info(self):
+        return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._lru), 'bytes': self._bytes}
+
+    def _admit(self, key, read=False):
+        with self._lock:
+            if key not in self._blobs:
+                return
+            if key in self._lru:
+                self._lru.move_to_end(key)
+            else:
+                self._lru[key] = self._blobs.size(key)
+                self._bytes += self._lru[key]
+            while self._bytes > self.max_bytes and len(self._lru) > 1:
+                k, size = self._lru.popitem(last=False)
+                self._bytes -= size
+                super().remove(k)
+            if read:
+                data, codec = self._blobs.get(key), self.codec(key)
+        if read:
+            return decompress(data, codec)
+
+BLOB_BACKENDS = {
+    'files': ShardedFileContainer,
+    'log': LogFileContainer,
+}
@@ -0,0 +1,53 @@
+import time
+
+class CheckpointPolicy:
+    def should_checkpoint(self, stats):
+        return False
+
+class SizePolicy(CheckpointPolicy):
+    def __init__(self, max_bytes=1_000_000):
+        self.max_bytes = max_bytes
+
+    def should_checkpoint(self, stats):
+        return stats['size'] > self.max_bytes
+
+class RecordCountPolicy(CheckpointPolicy):
+    def __init__(self, max_records=1000):
+        self.max_records = max_records
+
+    def should_checkpoint(self, stats):
+        return stats['records'] >= self.max_records
+
+class ReplayCostPolicy(CheckpointPolicy):
+    def __init__(self, max_records=None, max_seconds=0.01):
+        self.max_records = max_records
+        self.max_seconds = max_seconds
+
+    def should_checkpoint(self, stats):
+        if self.max_records is not None and stats['replayed'] >= self.max_records:
+            return True
+        return self.max_seconds is not None and stats['replay_time'] >= self.max_seconds
+
+class AgePolicy(CheckpointPolicy):
+    def __init__(self, max_age=3600):
+        self.max_age = max_age
+
+    def should_checkpoint(self, stats):
+        return stats['records'] > 0 and time.time() - stats['since'] >= self.max_age
+
+class AdaptivePolicy(CheckpointPolicy):
+    def __init__(self, factor=1.0, min_records=16, default_cost=0.001):
+        self.factor = factor
+        self.min_records = min_records
+        self.default_cost = default_cost
+
+    def should_checkpoint(self, stats):
+        cost = stats['checkpoint_cost'] or self.default_cost
+        return stats['records'] >= self.min_records and stats['replay_total'] >= self.factor * cost
+
+class AnyPolicy(CheckpointPolicy):
+    def __init__(self, *policies):
+        self.policies = policies
+
+    def should_checkpoint(self, stats):
+        return any(p.should_checkpoint(stats) for p in self.policies)
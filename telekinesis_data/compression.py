@@ -0,0 +1,98 @@
+import zlib
+import lzma
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+NONE = 0
+ZLIB = 1
+LZMA = 2
+ZSTD = 3
+
+CODECS = {
+    'none': NONE,
+    'zlib': ZLIB,
+    'lzma': LZMA,
+    'zstd': ZSTD,
+}
+
+def compress(data, codec):
+    if codec == ZLIB:
+        return zlib.compress(data, 6)
+    if codec == LZMA:
+        return lzma.compress(data)
+    if codec == ZSTD:
+        if not zstandard:
+            raise ImportError('zstandard is required for zstd compression')
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+def decompress(data, codec):
+    if codec == ZLIB:
+        return zlib.decompress(data)
+    if codec == LZMA:
+        return lzma.decompress(data)
+    if codec == ZSTD:
+        if not zstandard:
+            raise ImportError('zstandard is required to read zstd compressed data')
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+class Passthrough:
+    def decompress(self, chunk):
+        return chunk
+
+def decompressor(codec):
+    if codec == NONE:
+        return Passthrough()
+    if codec == ZLIB:
+        return zlib.decompressobj()
+    if codec == LZMA:
+        return lzma.LZMADecompressor()
+    if zstandard:
+        return zstandard.ZstdDecompressor().decompressobj()
+    raise ImportError('zstandard is required to read zstd compressed data')
+
+def iter_decompress(chunks, codec):
+    stream = decompressor(codec)
+    for chunk in chunks:
+        yield stream.decompress(chunk)
+    if flush := getattr(stream, 'flush', None):
+        yield flush()
+
+class CompressionPolicy:
+    def __init__(self, codec='zlib', min_size=1024, sample_size=2**14, max_ratio=0.9):
+        if codec not in CODECS:
+            raise ValueError(f"Unknown codec '{codec}'")
+        if codec == 'zstd' and not zstandard:
+            codec = 'zlib'
+        self.codec = CODECS[codec]
+        self.min_size = min_size
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+
+    def choose(self, data):
+        if self.codec == NONE or len(data) < self.min_size:
+            return NONE
+        sample = data[:self.sample_size]
+        if len(zlib.compress(sample, 1)) > len(sample) * self.max_ratio:
+            return NONE
+        return self.codec
+
+    def encode(self, data):
+        codec = self.choose(data)
+        return codec, compress(data, codec)
+
+DEFAULT_POLICY = CompressionPolicy()
+NO_COMPRESSION = CompressionPolicy('none')
+
+def encode_tagged(data, policy=DEFAULT_POLICY):
+    codec, data = policy.encode(data)
+    return bytes([codec]) + data if codec else data
+
+def decode_tagged(data):
+    if data and data[0] < len(CODECS):
+        return decompress(data[1:], data[0])
+    return data
@@ -1,37 +1,83 @@
 import os
 import time
-import math
 import base64
 import hashlib
 import asyncio
-from collections import deque
+from bisect import bisect_left
+from functools import partial
+from contextlib import asynccontextmanager
+from collections import deque, Counter
 
 import bson
+import ujson
 import telekinesis as tk
 
 
-from .storage import SimpleKV, SimpleFileContainer
+from .storage import StreamWriter, KeyedExecutor, STREAM_FORMATS, BACKENDS
 from .timetravel import TimetravelerKV
+from .blobs import BlobStore, BlobCache, BLOB_BACKENDS
+from .retention import Compactor
+from .rebalance import Rebalancer
+from .registry import OwnershipRegistry
+from .indexes import MetadataIndexes
+from .expressions import evaluate, select
+from .subscriptions import Subscriptions, event_kind
+from .compression import CompressionPolicy
+from .metrics import Metrics, timed
 from .const import REGIONS
 from .exceptions import ConditionNotFulfilled
 
 class TelekinesisData:
-    def __init__(self, session, path, region='AAAA'):
+    def __init__(
+        self, session, path, region='AAAA', writer=None, log_format='jsonl', backend='files', checkpoint_policy=None,
+        retention=None, io_workers=4, compression='zlib', blob_cache_bytes=2**28, rebalance_interval=None,
+        commit_window=0.002, gc_grace=600
+    ):
         if region in REGIONS:
             region = REGIONS[region]
         self._region = region
         self.id = region + session.instance_id
         self._session = session
-        self._registry = SimpleKV(os.path.join(path, 'registry'))
-        self._local = TimetravelerKV(os.path.join(path, 'meta'))
-        self._data = SimpleFileContainer(os.path.join(path, 'data'))
+        self._writer = writer or StreamWriter(window=commit_window, journal=os.path.join(path, 'journal'))
+        if not isinstance(compression, CompressionPolicy):
+            compression = CompressionPolicy(compression or 'none')
+        stream = partial(STREAM_FORMATS[log_format], writer=self._writer)
+        if log_format == 'frames':
+            stream = partial(stream, compression=compression)
+        container = BACKENDS[backend]
+        self._io = KeyedExecutor(io_workers)
+        self._registry = OwnershipRegistry(os.path.join(path, 'registry'), stream, container)
+        self._local = TimetravelerKV(
+            os.path.join(path, 'meta'), stream, container, checkpoint_policy, executor=self._io,
+            compression=compression)
+        self._data = BlobStore(
+            os.path.join(path, 'data'), stream, BLOB_BACKENDS[backend], self._io, compression, gc_grace)
+        self._cache = BlobCache(
+            os.path.join(path, 'cache'), stream, BLOB_BACKENDS[backend], self._io, compression, blob_cache_bytes)
+        self._indexes = MetadataIndexes(os.path.join(path, 'indexes'), self._local, stream, container)
+        self._subscriptions = Subscriptions(self.id, self._dropped)
+        self._metrics = Metrics()
+        self._local.listeners.append(self._publish)
+        self._compactor = retention and Compactor(self._local, retention)
+        self._rebalancer = Rebalancer(self, rebalance_interval)
+        self._idle = [self._compactor] if self._compactor else []
+        rebalance_interval and self._idle.append(self._rebalancer)
+        self._start_background()
 
         self._default_branch_id = None
         self._branches = {}#Container(os.path.join(path, 'branches'))
         self._queues = {}
+        self._migrations = {}
+        self._writes = Counter()
+        self._written = asyncio.Event()
+        self._requests = Counter()
+        self.max_tracked = 2**16
+        self._requests_since = time.time()
         
         self.client = tk.Telekinesis(self, session)
         self._peers = {self.id: self.client}
+        self._peer_ids = {self.id[4:]: self.id}
+        self._branch_infos = {}
 
     def begin(self, branch_id=None):
         if branch_id is None:
@@ -44,109 +90,134 @@ class TelekinesisData:
         
     @tk.inject_first_arg
     @tk.block_arg_evaluation
+    @timed('set')
     async def set(
         self, context, key, value=None, metadata=None, clear=False, value_getter=None, branch=None
     ):
+        return await self._set(context, key, value, metadata, clear, value_getter, branch)
+
+    async def _set(self, context, key, value, metadata, clear, value_getter, branch):
         peer_id, branch_id, branch = await self._overhead(context, branch)
         
         if isinstance(value, tk.Telekinesis):
             value._block_gc = True
 
         if not value_getter:
-            if isinstance(value, bytes):
-                value_enc = value
-                prefix = '0'
-            elif isinstance(value, str):
-                value_enc = value.encode()
-                prefix = '1'
-            else:
-                value_enc = bson.dumps(tk.Telekinesis(None, self._session, block_gc=True)._encode(value))
-                prefix = ''
-
-            value_hash = prefix + self._hash(value_enc)
+            value_hash, value_enc = self._encode(value)
         else:
             value_hash = value
 
         if peer_id:
+            await self._settled((branch_id, *key))
             for i in range(len(key)+1):
                 k = key[:-i] or (i == 0 and key) or ()
                 ck = key[:-(i or 1)+1] or key
                 if owner_id := self._registry.get((branch_id, *k)):
+                    self._metrics.route(owner_id)
                     if owner_id == self.id:
                         if k == key:
-                            self._registry.set((branch_id, *key), self.id)
-                            timestamp = self._local.set((branch_id, *key), [
-                                ('u' if clear else 'uu', {'metadata': metadata or {}}),
-                                # ('l', None),
-                                ('u', {'value': value_hash} if value is not None or clear else {})
-                            ])
-                            if value is not None or clear and value_hash not in self._data:
+                            self._count((branch_id, *key))
+                            if (value is not None or clear) and value_hash not in self._data:
                                 if value_getter:
-                                    value_enc = await value_getter()
-                                    assert self._hash(value_enc) == value_hash[1:]
-                                self._data.set(value_hash, value_enc)
-                            return timestamp
+                                    await self._data.receive(value_hash, value_getter)
+                                else:
+                                    await self._data.aset(value_hash, value_enc)
+                            async with self._writing((branch_id, *key)) as moved:
+                                if not moved:
+                                    self._registry.set((branch_id, *key), self.id)
+                                    return await self._local.aset((branch_id, *key), [
+                                        ('u' if clear else 'uu', {'metadata': metadata or {}}),
+                                        # ('l', None),
+                                        ('u', {'value': value_hash} if value is not None or clear else {})
+                                    ])
+                            return await self._set(context, key, value, metadata, clear, value_getter, branch)
 
                         else:
-                            self._registry.set((branch_id, *ck), peer_id) 
-                            
-                            self._local.set((branch_id, *k), [('ua', {'children': ck[-1]})])
-                        return k, self.id
+                            async with self._writing((branch_id, *key)):
+                                self._registry.set((branch_id, *ck), peer_id) 
+                                indexes = self._indexes.export((branch_id, *ck))
+                                self._indexes.forget((branch_id, *ck))
+                                await self._local.aset((branch_id, *k), [('ua', {'children': ck[-1]})])
+                            for sub in self._subscriptions.covering((branch_id, *ck)):
+                                if sub.recursive:
+                                    asyncio.ensure_future(self._forward_subscription(
+                                        sub, (branch_id, *ck), peer_id, time.time(), branch))
+                        return k, self.id, indexes
                     else:
                         if peer := self._peers.get(owner_id):
                             return peer.set(key, value, metadata, clear, value_getter, branch)
                         else:
                             self._registry.set((branch_id, *k), None)
         else:
-            if value is not None or clear and value_hash not in self._data:
+            if (value is not None or clear) and value_hash not in self._data:
                 if value_getter:
-                    value_enc = await value_getter()
-                    assert value_hash == self._hash(value_enc)[1:]
-                self._data.set(value_hash, value_enc)
+                    await self._data.receive(value_hash, value_getter)
+                else:
+                    await self._data.aset(value_hash, value_enc)
+            await self._settled((branch_id, *key))
             for i in range(len(key)+1):
                 k = key[:-i] or (i == 0 and key) or ()
                 if owner_id := self._registry.get((branch_id, *k)):
+                    self._metrics.route(owner_id)
                     if owner_id == self.id:
                         root = k
                         root_owner_id = self.id
+                        indexes = ()
                     else:
                         if peer := self._peers.get(owner_id):
                             if not value_getter and len(value_enc) > 2**18:
                                 val = value_hash
-                                val_getter = lambda: value_enc
+                                val_getter = self._data.reader(value_hash)
                             else:
                                 val = value
                                 val_getter = value_getter
-                            root, root_owner_id = await peer.set(key, val, metadata, clear, val_getter, branch)
+                            out = await peer.set(key, val, metadata, clear, val_getter, branch)
+                            if not isinstance(out, (list, tuple)):
+                                return out
+                            root, root_owner_id, *indexes = out
                         else:
                             self._registry.set((branch_id, *k), None)
                             continue
                     
-                    self._registry.set((branch_id, *root), root_owner_id)
-                    if root != key:
-                        timestamp = self._local.set((branch_id, *key), [
-                            ('u' if clear else 'uu', {'metadata': metadata or {}}),
-                            ('u', {'value': value_hash} if value is not None or clear else {})
-                        ])
-                        self._registry.set((branch_id, *key), self.id)
-                        for j in range(len(key)):
-                            kk = key[:-j-1]
-                            ck = key[:-j] or key
-                            if kk == root:
-                                if root_owner_id == self.id:
-                                    self._local.set((branch_id, *kk), [('ua', {'children': ck[-1]})])
-                                return timestamp
-                            else:
-                                self._registry.set((branch_id, *kk), self.id)
-                                self._local.set((branch_id, *kk), [('ua', {'children': ck[-1]})])
-                    elif root_owner_id == self.id:
-                        timestamp = self._local.set((branch_id, *key), [
-                            ('u' if clear else 'uu', {'metadata': metadata or {}}),
-                            ('u', {'value': value_hash} if value is not None or clear else {})
-                        ])
-                        return timestamp
+                    return await self._write_local(
+                        branch_id, key, root, root_owner_id, metadata, clear, value, value_hash, *indexes)
+
+    async def _write_local(self, branch_id, key, root, root_owner_id, metadata, clear, value, value_hash, indexes=()):
+        async with self._writing((branch_id, *key)):
+            return await self._apply_local(
+                branch_id, key, root, root_owner_id, metadata, clear, value, value_hash, indexes)
+
+    async def _apply_local(self, branch_id, key, root, root_owner_id, metadata, clear, value, value_hash, indexes=()):
+        self._registry.set((branch_id, *root), root_owner_id)
+        for k, spec in indexes:
+            for field, kind in spec.items():
+                self._indexes.declare((branch_id, *key[:len(root)+1], *k), field, kind)
+        self._count((branch_id, *key))
+        if root != key:
+            timestamp = await self._local.aset((branch_id, *key), [
+                ('u' if clear else 'uu', {'metadata': metadata or {}}),
+                ('u', {'value': value_hash} if value is not None or clear else {})
+            ])
+            self._registry.set((branch_id, *key), self.id)
+            for j in range(len(key)):
+                kk = key[:-j-1]
+                ck = key[:-j] or key
+                if kk == root:
+                    if root_owner_id == self.id:
+                        await self._local.aset((branch_id, *kk), [('ua', {'children': ck[-1]})])
+                    return timestamp
+                else:
+                    self._registry.set((branch_id, *kk), self.id)
+                    await self._local.aset((branch_id, *kk), [('ua', {'children': ck[-1]})])
+        elif root_owner_id == self.id:
+            timestamp = await self._local.aset((branch_id, *key), [
+                ('u' if clear else 'uu', {'metadata': metadata or {}}),
+                ('u', {'value': value_hash} if value is not None or clear else {})
+            ])
+            return timestamp
 
     @tk.inject_first_arg
+    @timed('get')
     async def get(self, context, key, metadata=False, timestamp=None, branch=None):
         # t0 = time.time()
         is_peer, branch_id, branch = await self._overhead(context, branch)
@@ -156,33 +227,26 @@ class TelekinesisData:
             k = key[:-i] or (i==0 and key) or ()
             # print('if owner in registry?', time.time()-t0)
             if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
                 # print('if owner is self?', time.time()-t0)
                 if owner_id == self.id:
+                    self._count((branch_id, *key))
                     # print('if local list_versions', time.time()-t0)
-                    if self._local.list_versions((branch_id, *key), timestamp):#, ['origin']):
+                    if await self._local.alast_version((branch_id, *key), timestamp) is not None:#, ['origin']):
                         # print('getting obj metadata', time.time()-t0)
-                        obj = self._local.get((branch_id, *key), timestamp) or {}
+                        obj = await self._local.aget((branch_id, *key), timestamp) or {}
                         if metadata:
                             out = obj.get('metadata')
                             if is_peer:
                                 return ('data', out)
                             return out
-                        if value_hash := obj.get('value'):
-                            if value_enc := self._data.get(value_hash):
-                                if len(value_hash) == 43:
-                                    data = tk.Telekinesis(None, self._session)\
-                                        ._decode(bson.loads(value_enc), self._session.session_key.public_serial())
-                                elif value_hash[0] == '0':
-                                    data = value_enc
-                                
-                                elif value_hash[0] == '1':
-                                    data = value_enc.decode()
-
-                                if is_peer:
-                                    if len(value_enc) > 2**18:
-                                        return ('getter', value_hash, lambda: value_enc)
-                                    return ('data', data)
-                                return data
+                        if (value_hash := obj.get('value')) and value_hash in self._data:
+                            if is_peer:
+                                if self._data.size(value_hash) > 2**16:
+                                    return ('ref', value_hash, self.id)
+                                stored = await self._data.aread(value_hash, 0, 2**16)
+                                return ('ref', value_hash, self.id, stored, self._data.codec(value_hash))
+                            return self._decode(value_hash, await self._data.aget(value_hash))
                         return
                     elif branch['origin_id']:
                         out = self.client.get(
@@ -198,32 +262,132 @@ class TelekinesisData:
                         if is_peer:
                             return owner.get(key, metadata, timestamp, branch)
                         else:
-                            out = await owner.get(key, metadata, timestamp, branch)
-                            if not out:
-                                return
-                            if out[0] == 'data':
-                                return out[1]
-                            if out[0] == 'getter':
-                                value_hash = out[1]
-                                if data := self._data.get(value_hash):
-                                    pass
-                                else:
-                                    value_enc = await out[2]()
-                                    self._data.set(value_hash, data)
-                                    if len(value_hash) == 43:
-                                        return tk.Telekinesis(None, self._session)\
-                                            ._decode(bson.loads(value_enc), self._session.session_key.public_serial())
-                                    elif value_hash[0] == '0':
-                                        return value_enc
-                                    
-                                    elif value_hash[0] == '1':
-                                        return value_enc.decode()
+                            return await self._unwrap(await owner.get(key, metadata, timestamp, branch))
                     else:
-                        self._registry.set(k, None)
+                        self._registry.set((branch_id, *k), None)
 
     @tk.inject_first_arg
+    async def get_blob(self, context, value_hash):
+        is_peer, _, _ = await self._overhead(context, None)
+        if not is_peer:
+            raise PermissionError
+        for store in (self._data, self._cache):
+            if value_hash in store:
+                if store.size(value_hash) > 2**18:
+                    return ('getter', value_hash, store.reader(value_hash))
+                return ('blob', value_hash, await store.aread(value_hash, 0, 2**18), store.codec(value_hash))
+
+    @tk.inject_first_arg
+    async def get_reader(self, context, key, timestamp=None, branch=None):
+        is_peer, branch_id, branch = await self._overhead(context, branch)
+        key = tuple(key)
+
+        for i in range(len(key)+1):
+            k = key[:-i] or (i==0 and key) or ()
+            if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
+                if owner_id == self.id:
+                    if await self._local.alast_version((branch_id, *key), timestamp) is not None:
+                        obj = await self._local.aget((branch_id, *key), timestamp) or {}
+                        if (value_hash := obj.get('value')) and value_hash in self._data:
+                            return value_hash, self._data.reader(value_hash)
+                        return None, None
+                    elif branch['origin_id']:
+                        return await self.get_reader(
+                            None, (*branch['origin_key'], *key),
+                            min(timestamp or time.time(), branch['origin_timestamp']), branch['origin_id'])
+                    return None, None
+                else:
+                    if owner := self._peers.get(owner_id):
+                        return await owner.get_reader(key, timestamp, branch)
+                    else:
+                        self._registry.set((branch_id, *k), None)
+        return None, None
+
+    @tk.inject_first_arg
+    @timed('get_many')
+    async def get_many(self, context, keys, metadata=False, timestamp=None, branch=None):
+        is_peer, branch_id, branch = await self._overhead(context, branch)
+        keys = [tuple(key) for key in keys]
+        results = [None] * len(keys)
+
+        async def get_group(owner_id, indexes):
+            if owner_id in (None, self.id):
+                for i in indexes:
+                    results[i] = await self.get(context, keys[i], metadata, timestamp, branch)
+            else:
+                out = await self._peers[owner_id].get_many([keys[i] for i in indexes], metadata, timestamp, branch)
+                for i, o in zip(indexes, out):
+                    results[i] = o if is_peer else await self._unwrap(o)
+
+        groups = self._group_by_owner(branch_id, keys)
+        await asyncio.gather(*(get_group(owner_id, indexes) for owner_id, indexes in groups.items()))
+        return results
+
+    @tk.inject_first_arg
+    @tk.block_arg_evaluation
+    @timed('set_many')
+    async def set_many(self, context, items, branch=None):
+        peer_id, branch_id, branch = await self._overhead(context, branch)
+        items = [(tuple(key), value, *rest, *[None, False, None][len(rest):]) for key, value, *rest in items]
+        results = [None] * len(items)
+
+        async def set_local(indexes):
+            for i in indexes:
+                results[i] = await self._set(context, *items[i], branch)
+
+        async def set_group(owner_id, indexes):
+            group, encoded = [], {}
+            for i in indexes:
+                key, value, metadata, clear, value_getter = items[i]
+                if not value_getter:
+                    value_hash, value_enc = encoded[i] = self._encode(value)
+                    if value is not None and len(value_enc) > 2**18:
+                        value_hash not in self._data and await self._data.aset(value_hash, value_enc)
+                        value, value_getter = value_hash, self._data.reader(value_hash)
+                group.append((key, value, metadata, clear, value_getter))
+            out = await self._peers[owner_id].set_many(group, branch)
+            adopted = []
+            for i, o in zip(indexes, out):
+                if not isinstance(o, (list, tuple)):
+                    results[i] = o
+                    continue
+                key, value, metadata, clear, value_getter = items[i]
+                value_hash, value_enc = encoded.get(i) or (value, None)
+                if (value is not None or clear) and value_hash not in self._data:
+                    if value_getter:
+                        await self._data.receive(value_hash, value_getter)
+                    else:
+                        await self._data.aset(value_hash, value_enc)
+                adopted.append((i, value_hash, o))
+            async with self._writing(*((branch_id, *items[i][0]) for i, _, _ in adopted)):
+                for i, value_hash, (root, root_owner_id, *indexes) in adopted:
+                    key, value, metadata, clear, value_getter = items[i]
+                    results[i] = await self._apply_local(
+                        branch_id, key, root, root_owner_id, metadata, clear, value, value_hash, *indexes)
+
+        keys = {item[0] for item in items}
+        rounds = {}
+        for i, item in enumerate(items):
+            rounds.setdefault(sum(item[0][:j] in keys for j in range(len(item[0]))), []).append(i)
+        for _, indexes in sorted(rounds.items()):
+            groups = self._group_by_owner(branch_id, [items[i][0] for i in indexes])
+            chains = {}
+            for j in groups.pop(self.id, []) + groups.pop(None, []):
+                chains.setdefault(items[indexes[j]][0], []).append(indexes[j])
+            await asyncio.gather(
+                *(set_group(owner_id, [indexes[j] for j in js]) for owner_id, js in groups.items()),
+                *(set_local(chain) for chain in chains.values()))
+        return results
+
+    @tk.inject_first_arg
+    @timed('remove')
     async def remove(self, context, key, branch=None):
+        return await self._remove(context, key, branch)
+
+    async def _remove(self, context, key, branch):
         peer_id, branch_id, branch = await self._overhead(context, branch)
+        await self._settled((branch_id, *key))
         # print(peer_id, key)
 
         for i in range(0, len(key)+1):
@@ -231,16 +395,22 @@ class TelekinesisData:
             ck = key[:-(i or 1)+1] or key
             # print('for', i, k, ck)
             if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
                 # print('if', k, owner_id)
                 if owner_id == self.id:
                     if i == 0:
 
-                        children = (self._local.get((branch_id, *k)) or {}).get('children') or []
+                        children = (await self._local.aget((branch_id, *k)) or {}).get('children') or []
 
-                        await asyncio.gather(*[self.remove(context, (*key, child), branch) for child in children])
+                        await asyncio.gather(*[self._remove(context, (*key, child), branch) for child in children])
 
-                        timestamp = await self.set(context, key, None, {}, True, branch=branch)
-                        self._registry.set((branch_id, *k), None)
+                        async with self._writing((branch_id, *key)) as moved:
+                            if moved:
+                                return await self._remove(context, key, branch)
+                            timestamp = await self._local.aset((branch_id, *k), [('u', {'metadata': {}, 'value': None})])
+                            self._registry.set((branch_id, *k), None)
+                            if len(key) and self._registry.get((branch_id, *key[:-1])) == self.id:
+                                return await self._local.aset((branch_id, *key[:-1]), [('um', {'children': key[-1]})])
                         # timestamp = self._local.set((branch_id, *k), [
                         #     ('u', {'value': None}),
                         #     ('u', {'metadata': {}}),
@@ -249,10 +419,10 @@ class TelekinesisData:
                         if len(key) == 0:
                             return timestamp
                     if i == 1:
-                        timestamp = self._local.set((branch_id, *k), [
-                            ('um', {'children': ck[-1]})
-                        ])
-                        return timestamp
+                        async with self._writing((branch_id, *key)):
+                            return await self._local.aset((branch_id, *k), [
+                                ('um', {'children': ck[-1]})
+                            ])
                 else:
                     if i == 0:
                         self._registry.set((branch_id, *k), None)
@@ -300,27 +470,32 @@ class TelekinesisData:
                         self._registry.set((branch_id, *k), None)
 
     @tk.inject_first_arg
+    @timed('update')
     async def update(self, context, key, changes, condition=None, branch=None):
         _, branch_id, branch = await self._overhead(context, branch)
+        await self._settled((branch_id, *key))
 
         for i in range(0, len(key)+1):
             k = key[:-i] or (i == 0 and key) or ()
             if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
                 if owner_id == self.id:
                     if i == 0:
                         condition = [condition, {}] if isinstance(condition, str) else condition
-                        globals_obj = {**self._local.get((branch_id, *k)).get('metadata', {}), 'math': math, 'time': time}
-                        if not condition or eval(condition[0], {**globals_obj, **condition[1]}):
-                            self._local.set((branch_id, *k), [
+
+                        def apply(obj):
+                            metadata = obj.get('metadata', {})
+                            if condition and not evaluate(condition[0], metadata, condition[1]):
+                                raise ConditionNotFulfilled(f"Condition '{condition[0]}' not fulfilled")
+                            return [
                                 ('u'+c, {
                                     'metadata': {
-                                        kk: eval(vv if isinstance(vv, str) else vv[0], {**globals_obj, **({} if isinstance(vv, str) else vv[1])}) 
+                                        kk: evaluate(vv, metadata) if isinstance(vv, str) else evaluate(vv[0], metadata, vv[1])
                                             for kk, vv in v.items()
                                     }}) for c, v in changes
-                            ])
-                            return self._local.get((branch_id, *k))['metadata']
-                        else:
-                            raise ConditionNotFulfilled(f"Condition '{condition[0]}' not fulfilled")
+                            ]
+                        async with self._writing((branch_id, *key)):
+                            return (await self._local.aupdate((branch_id, *k), apply))['metadata']
                     else:
                         raise FileNotFoundError
                 else:
@@ -330,33 +505,342 @@ class TelekinesisData:
                         self._registry.set((branch_id, *k), None)
 
     @tk.inject_first_arg
-    async def tree(self, context, key, timestamp=None, branch=None):
-        key_version = (await self.list_versions(context, key, timestamp, branch))[-1]
-        children = await self.list(key, None, timestamp, branch)
-        children_out = await asyncio.gather(*[self.tree(context, key+(c,), timestamp, branch) for c in children])
+    @timed('tree')
+    async def tree(self, context, key, timestamp=None, branch=None, depth=None, prefix=None, limit=None):
+        out = {}
+        async for k, version in self.scan(key, depth, prefix, limit, timestamp, branch):
+            out[k] = version
+        return out
+
+    async def scan(self, key, depth=None, prefix=None, limit=None, timestamp=None, branch=None, page_size=1000):
+        pending = [(tuple(key), depth, prefix)]
+        count = 0
+        while pending:
+            root, root_depth, root_prefix = pending.pop()
+            cursor = None
+            while True:
+                entries, delegates, cursor = await self.scan_page(
+                    None, root, cursor, page_size, root_depth, root_prefix, timestamp, branch)
+                for k, version in entries:
+                    yield tuple(k), version
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+                for k, _ in delegates:
+                    pending.append((tuple(k), root_depth and root_depth - len(k) + len(root), None))
+                if cursor is None:
+                    break
+
+    @tk.inject_first_arg
+    @timed('scan_page')
+    async def scan_page(
+        self, context, key, cursor=None, limit=1000, depth=None, prefix=None, timestamp=None, branch=None
+    ):
+        is_peer, branch_id, branch = await self._overhead(context, branch)
+        key = tuple(key)
+
+        for i in range(len(key)+1):
+            k = key[:-i] or (i==0 and key) or ()
+            if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
+                if owner_id == self.id:
+                    return await self._io.run(
+                        (branch_id, *key), self._page, branch_id, key, cursor and tuple(cursor), limit, depth, prefix,
+                        timestamp)
+                else:
+                    if owner := self._peers.get(owner_id):
+                        out = owner.scan_page(key, cursor, limit, depth, prefix, timestamp, branch)
+                        if is_peer:
+                            return out
+                        return await out
+                    else:
+                        self._registry.set((branch_id, *k), None)
+        return [], [], None
+
+    @tk.inject_first_arg
+    async def gc(self, context, retention=None, dry_run=False):
+        if context and context.caller.session[0] != self._session.session_key.public_serial():
+            raise PermissionError
+        return await self._io.run('gc', self._gc, retention, dry_run)
 
-        return {key: key_version, **{k: v for c in children_out for k, v in c.items()}}
+    @tk.inject_first_arg
+    async def reclaimable(self, context, retention=None):
+        return (await self.gc(context, retention, True))['bytes']
+
+    def _gc(self, retention, dry_run):
+        horizon = retention and time.time() - retention
+        pins = [
+            ((b['origin_id'], *b['origin_key']), b['origin_timestamp'])
+            for b in list(self._branches.values()) if b.get('origin_id')]
+        return self._data.collect(self._local.references('value', horizon, pins), dry_run)
 
-    # async def subscribe(self, key, callback, branch=None):
-    #     pass
+    @tk.inject_first_arg
+    async def compact_history(self, context):
+        if context and context.caller.session[0] != self._session.session_key.public_serial():
+            raise PermissionError
+        return await self._compactor.arun() if self._compactor else {'keys': 0, 'versions': 0, 'bytes': 0}
 
+    async def rebalance(self):
+        return await self._rebalancer.run()
+
+    @tk.inject_first_arg
+    async def subscribe(self, context, key, callback, recursive=True, since=None, branch=None):
+        _, branch_id, branch = await self._overhead(context, branch)
+        key = tuple(key)
+
+        for i in range(len(key)+1):
+            k = key[:-i] or (i==0 and key) or ()
+            if owner_id := self._registry.get((branch_id, *k)):
+                if owner_id == self.id:
+                    sub = self._subscriptions.add((branch_id, *key), callback, recursive)
+                    owned, foreign = [sub.key], []
+                    if recursive:
+                        for sub_key, peer_id in sorted(self._registry.descendants(sub.key), key=len):
+                            if any(sub_key[:len(f)] == f for f in foreign):
+                                continue
+                            if peer_id == self.id:
+                                owned.append(sub_key)
+                            else:
+                                foreign.append(sub_key)
+                                await self._forward_subscription(sub, sub_key, peer_id, since, branch)
+                    if since is not None:
+                        for local_key in owned:
+                            async for t, changes in self._local.aiter(local_key, since):
+                                sub.push(local_key, t, event_kind(changes))
+                    return sub.id
+                else:
+                    if owner := self._peers.get(owner_id):
+                        return await owner.subscribe(key, callback, recursive, since, branch)
+                    else:
+                        self._registry.set((branch_id, *k), None)
+
+    @tk.inject_first_arg
+    async def unsubscribe(self, context, sub_id):
+        owner_id = sub_id.split(':')[0]
+        if owner_id != self.id:
+            if owner := self._peers.get(owner_id):
+                return await owner.unsubscribe(sub_id)
+            return False
+        if (sub := self._subscriptions.remove(sub_id)) is None:
+            return False
+        for peer_id, remote_id in sub.forwarded:
+            if peer := self._peers.get(peer_id):
+                await peer.unsubscribe(remote_id)
+        return True
+
+    async def _forward_subscription(self, sub, key, peer_id, since, branch, recursive=True):
+        if peer := self._peers.get(peer_id):
+            sub.forwarded.append((peer_id, await peer.subscribe(key[1:], sub.callback, recursive, since, branch)))
+
+    def _dropped(self, sub_id):
+        asyncio.ensure_future(self.unsubscribe(None, sub_id))
+
+    def _publish(self, key, timestamp, changes):
+        if self._subscriptions:
+            self._subscriptions.publish(key, timestamp, event_kind(changes))
+
+    @tk.inject_first_arg
+    async def migrate(self, context, key, target_id, branch=None):
+        _, branch_id, branch = await self._overhead(context, branch)
+        key = tuple(key)
+
+        for i in range(len(key)+1):
+            k = key[:-i] or (i==0 and key) or ()
+            if owner_id := self._registry.get((branch_id, *k)):
+                if owner_id == self.id:
+                    return await self._migrate((branch_id, *key), target_id, branch)
+                else:
+                    if owner := self._peers.get(owner_id):
+                        return await owner.migrate(key, target_id, branch)
+                    else:
+                        self._registry.set((branch_id, *k), None)
+
+    async def _migrate(self, root, target_id, branch):
+        if moving := self._migration(root):
+            await moving.wait()
+            return await self.migrate(None, root[1:], target_id, branch)
+        if target_id == self.id:
+            return 0
+        if (target := self._peers.get(target_id)) is None:
+            raise ValueError(f"Unknown peer '{target_id}'")
+        if await self._local.alast_version(root) is None:
+            raise FileNotFoundError
+
+        done = self._migrations[root] = asyncio.Event()
+        try:
+            await self._drained(root)
+            owned, foreign = [root], []
+            for k, owner_id in sorted(self._registry.descendants(root), key=len):
+                if not any(k[:len(f)] == f for f, _ in foreign):
+                    if owner_id == self.id:
+                        owned.append(k)
+                    else:
+                        foreign.append((k, owner_id))
+
+            batch, size = [], 0
+            for i in range(0, len(owned), 16):
+                keys = owned[i:i+16]
+                for k, history in zip(keys, await asyncio.gather(*(self._local.aexport(k) for k in keys))):
+                    batch.append([k[len(root):], history])
+                    size += len(ujson.dumps(history))
+                    if size >= 2**22:
+                        await target.adopt(root[1:], batch, branch)
+                        batch, size = [], 0
+            if batch:
+                await target.adopt(root[1:], batch, branch)
+            owners = [[k[len(root):], target_id] for k in owned] + [[k[len(root):], o] for k, o in foreign]
+            await target.adopt(root[1:], [], branch, owners, self._indexes.export(root))
+
+            since = time.time()
+            for k in owned:
+                self._registry.set(k, target_id)
+            parent, parent_id = self._registry.match(root[:-1]) if len(root) > 1 else (None, None)
+            if parent_id not in (None, self.id, target_id) and (peer := self._peers.get(parent_id)):
+                await peer.reassign(root[1:], target_id, branch)
+            subs = {sub.id: sub for sub in (*self._subscriptions.covering(root), *self._subscriptions.within(root))}
+            for sub in subs.values():
+                await self._forward_subscription(
+                    sub, max(sub.key, root, key=len), target_id, since, branch, sub.recursive)
+
+            self._indexes.forget(root)
+            await asyncio.gather(*(self._local.adrop(k) for k in owned))
+            return len(owned)
+        finally:
+            self._migrations.pop(root, None)
+            done.set()
+
+    @tk.inject_first_arg
+    async def adopt(self, context, key, histories, branch=None, owners=None, indexes=None):
+        peer_id, branch_id, branch = await self._overhead(context, branch)
+        if not peer_id:
+            raise PermissionError
+        root = (branch_id, *key)
+
+        missing = list({h for _, history in histories for h in history['values'] if h not in self._data})
+        for i in range(0, len(missing), 8):
+            await asyncio.gather(*(self._fetch_blob(self._peers[peer_id], h) for h in missing[i:i+8]))
+        for k, history in histories:
+            await self._local.arestore((*root, *k), history)
+        for k, owner_id in owners or []:
+            self._registry.set((*root, *k), owner_id)
+        for k, spec in indexes or []:
+            for field, kind in spec.items():
+                self._indexes.declare((*root, *k), field, kind)
+        return len(histories)
+
+    @tk.inject_first_arg
+    async def reassign(self, context, key, owner_id, branch=None):
+        peer_id, branch_id, _ = await self._overhead(context, branch)
+        if not peer_id or self._registry.get((branch_id, *key)) not in (peer_id, None):
+            raise PermissionError
+        self._registry.set((branch_id, *key), owner_id)
+
+    async def _fetch_blob(self, source, value_hash):
+        if out := await source.get_blob(value_hash):
+            if out[0] == 'blob':
+                await self._data.aput(value_hash, out[2], out[3])
+            else:
+                await self._data.receive(value_hash, out[2])
+
+    def _migration(self, key):
+        for i in range(len(key), 0, -1):
+            if (moving := self._migrations.get(key[:i])) is not None:
+                return moving
+
+    async def _settled(self, key):
+        while self._migrations and (moving := self._migration(key)):
+            await moving.wait()
+
+    @asynccontextmanager
+    async def _writing(self, *keys):
+        moved = False
+        while self._migrations and (moving := next(filter(None, map(self._migration, keys)), None)):
+            moved = True
+            await moving.wait()
+        for key in keys:
+            self._writes[key] += 1
+        try:
+            async with self._writer.abatch(self._io):
+                yield moved
+        finally:
+            for key in keys:
+                self._writes[key] -= 1
+                if not self._writes[key]:
+                    del self._writes[key]
+            self._written.set()
+
+    async def _drained(self, root):
+        while any(k[:len(root)] == root for k in self._writes):
+            self._written.clear()
+            await self._written.wait()
+
+    def _count(self, key):
+        if len(self._requests) >= self.max_tracked and key not in self._requests:
+            self.reset_load()
+        self._requests[key] += 1
+
+    @tk.inject_first_arg
+    async def load(self, context):
+        return sum(self._requests.values()) / max(time.time() - self._requests_since, 1e-3)
+
+    async def peer_loads(self):
+        return await self._from_peers('load')
+
+    @tk.inject_first_arg
+    async def stats(self, context, all_peers=False):
+        if all_peers:
+            return await self._from_peers('stats')
+        requests = max(self._metrics.requests(), 1)
+        return {
+            'id': self.id,
+            **self._metrics.snapshot(self.id),
+            'registry_lookups': {'total': self._registry.lookups, 'per_timed_call': self._registry.lookups / requests},
+            'file_opens': {'total': self._writer.file_opens, 'per_timed_call': self._writer.file_opens / requests},
+            'replay_length': self._local.replays.snapshot(),
+            'checkpoint_writes': self._local.checkpoint_writes,
+            'latest_cache': self._local.cache_info(),
+            'blob_cache': self._cache.cache_info(),
+            'getter_bytes': dict(self._data.transferred + self._cache.transferred),
+        }
+
+    async def _from_peers(self, method, *args):
+        peer_ids = list(self._peers)
+        out = await asyncio.gather(*(
+            getattr(self, method)(None, *args) if peer_id == self.id else
+            getattr(self._peers[peer_id], method)(*args)._execute() for peer_id in peer_ids), return_exceptions=True)
+        return {peer_id: o for peer_id, o in zip(peer_ids, out) if not isinstance(o, BaseException)}
+
+    def hot_subtrees(self):
+        elapsed = max(time.time() - self._requests_since, 1e-3)
+        rates = Counter()
+        for key, count in self._requests.items():
+            if key[0] != self._default_branch_id or self._registry.get(key) != self.id:
+                continue
+            root = key
+            while len(root) > 1 and self._registry.get(root[:-1]) == self.id:
+                root = root[:-1]
+            subtree = key[:len(root) + 1]
+            if len(subtree) > 1:
+                rates[subtree[1:]] += count / elapsed
+        return rates.most_common()
+
+    def reset_load(self):
+        self._requests.clear()
+        self._requests_since = time.time()
+
+    @timed('list')
     async def list(self, key, query=None, timestamp=None, branch=None):
         _, branch_id, branch = await self._overhead(None, branch)
 
         for i in range(len(key)+1):
             k = key[:-i] or (i==0 and key) or ()
             if owner_id := self._registry.get((branch_id, *k)):
+                self._metrics.route(owner_id)
                 if owner_id == self.id:
-                    children = (self._local.get((branch_id, *key), timestamp) or {}).get('children') or []
+                    children = (await self._local.aget((branch_id, *key), timestamp) or {}).get('children') or []
                     if query:
-                        children_metadata = await asyncio.gather(*[
-                            asyncio.create_task(self.client.get((*key, child), metadata=True)._execute()) for child in children
-                        ])
                         query = [query, {}] if isinstance(query, str) else query
-
-                        children = [c for i, c in enumerate(children) if eval(
-                            query[0], {**children_metadata[i], 'math': math, 'time': time}, query[1]
-                        )]
+                        children = await self._query_children(branch_id, key, children, query, timestamp)
 
                     return children                 
                 else:
@@ -365,6 +849,54 @@ class TelekinesisData:
                     else:
                         self._registry.set((branch_id, *k), None)
 
+    async def _query_children(self, branch_id, key, children, query, timestamp):
+        local, remote = [], []
+        for c in children:
+            (local if self._registry.get((branch_id, *key, c)) == self.id else remote).append(c)
+
+        matches = set()
+        candidates, exact = None, False
+        if timestamp is None:
+            candidates, exact = await self._indexes.acandidates((branch_id, *key), local, query[0], query[1])
+        if candidates is not None:
+            local = [c for c in local if c in candidates]
+        if not exact:
+            local_metadata = [(obj or {}).get('metadata') for obj in await asyncio.gather(*(
+                self._local.aget((branch_id, *key, c), timestamp) for c in local))]
+            local = [c for c, match in zip(local, select(query[0], local_metadata, query[1])) if match]
+        matches.update(local)
+
+        remote_metadata = await asyncio.gather(*[
+            asyncio.create_task(self.client.get((*key, child), metadata=True)._execute()) for child in remote
+        ])
+        matches.update(c for c, match in zip(remote, select(query[0], remote_metadata, query[1])) if match)
+        return [c for c in children if c in matches]
+
+    @tk.inject_first_arg
+    async def create_index(self, context, key, field, kind='hash', branch=None):
+        return await self._route_index(context, key, field, kind, branch)
+
+    @tk.inject_first_arg
+    async def drop_index(self, context, key, field, branch=None):
+        return await self._route_index(context, key, field, None, branch)
+
+    async def _route_index(self, context, key, field, kind, branch):
+        is_peer, branch_id, branch = await self._overhead(context, branch)
+
+        for i in range(len(key)+1):
+            k = key[:-i] or (i==0 and key) or ()
+            if owner_id := self._registry.get((branch_id, *k)):
+                if owner_id == self.id:
+                    if kind:
+                        return self._indexes.declare((branch_id, *key), field, kind)
+                    return self._indexes.drop((branch_id, *key), field)
+                else:
+                    if owner := self._peers.get(owner_id):
+                        return await (owner.create_index(key, field, kind, branch) if kind else \
+                            owner.drop_index(key, field, branch))
+                    else:
+                        self._registry.set((branch_id, *k), None)
+
     async def exists(self, key, timestamp=None, branch=None):
         return (key[-1] in await self.list(key[:-1], None, timestamp, branch)) if len(key) else True
 
@@ -376,7 +908,7 @@ class TelekinesisData:
             k = key[:-i] or (i==0 and key) or ()
             if owner_id := self._registry.get((branch_id, *k)):
                 if owner_id == self.id:
-                    return self._local.list_versions((branch_id, *key), timestamp)
+                    return await self._local.alist_versions((branch_id, *key), timestamp)
                 else:
                     if owner := self._peers.get(owner_id):
                         # if is_peer:
@@ -396,7 +928,7 @@ class TelekinesisData:
             if owner_id := self._registry.get((branch_id, *k)):
                 if owner_id == self.id:
                     return [b for b in 
-                            (self._local.get((branch_id, *key), timestamp) or {}).get('branches') or []]
+                            (await self._local.aget((branch_id, *key), timestamp) or {}).get('branches') or []]
                 else:
                     if owner := self._peers.get(owner_id):
                         return owner.list_branches(key, timestamp, branch)
@@ -421,25 +953,32 @@ class TelekinesisData:
                             'origin_timestamp': origin_timestamp or time.time(),
                             'origin_key': key
                         }
-                        self._local.set((origin_branch_id, *key), [
+                        await self._local.aset((origin_branch_id, *key), [
                             ('uu', {'branches': {name: new_branch}})
                         ])
                         self._registry.set((branch_id,), peer_id)
                         self._branches[branch_id] = new_branch
+                        await self._from_peers('forget_branch', origin_branch_id, key, name)
                         if peer_id:
                             return new_branch
-                        self._local.set((branch_id,), [('u', {'origin': new_branch})])
+                        await self._local.aset((branch_id,), [('u', {'origin': new_branch})])
                         return tk.Telekinesis(Branch(self, branch_id), self._session)
                 else:
                     if owner := self._peers.get(owner_id):
                         new_branch = await owner.create_branch(new_branch, origin_branch, origin_timestamp)
                         self._registry.set((new_branch['branch_id'],), self.id)
                         self._branches[new_branch['branch_id']] = new_branch
-                        self._local.set((new_branch['branch_id'],), [('u', {'origin': new_branch})])
+                        await self._local.aset((new_branch['branch_id'],), [('u', {'origin': new_branch})])
                         return tk.Telekinesis(Branch(self, new_branch['branch_id']), self._session)
                     else:
                         self._registry.set((origin_branch_id, *k), None)
 
+    @tk.inject_first_arg
+    async def forget_branch(self, context, branch_id, key, name):
+        if context and context.caller.session[0] != self._session.session_key.public_serial():
+            raise PermissionError
+        self._branch_infos.pop((branch_id, (tuple(key), name)), None)
+
     async def get_branch(self, branch_tup, timestamp=None):
         if branch_tup[1] is None:
             return tk.Telekinesis(Branch(self, self._default_branch_id, branch_tup[0]), self._session)
@@ -460,7 +999,7 @@ class TelekinesisData:
                 k = key[:-i] or (i==0 and key) or ()
                 if owner_id := self._registry.get((branch_id, *k)):
                     if owner_id == self.id:
-                        return ((self._local.get((branch_id, *key), timestamp) or {}).get('branches') \
+                        return ((await self._local.aget((branch_id, *key), timestamp) or {}).get('branches') \
                                 or {})[name]
                     else:
                         if owner := self._peers.get(owner_id):
@@ -489,6 +1028,7 @@ class TelekinesisData:
                 self._registry.set((branch_id, ), peer_id)
 
             self._peers[peer_id] = peer
+            self._peer_ids[peer_id[4:]] = peer_id
             
             return len(self._peers)
 
@@ -502,7 +1042,8 @@ class TelekinesisData:
                     await peer.close()
                 return
             else:
-                self._peers.pop(metadata.caller.session[1], None)
+                if peer_id := self._peer_ids.pop(metadata.caller.session[1], None):
+                    self._peers.pop(peer_id, None)
                 return None
 
         raise PermissionError
@@ -512,31 +1053,126 @@ class TelekinesisData:
     def _hash(self, data):
         return base64.b64encode(hashlib.blake2s(data).digest(), b'_-')[:-1].decode()
 
+    def _page(self, branch_id, key, after, limit, depth, prefix, timestamp):
+        entries, delegates = [], []
+        for kind, node, value in self._walk(branch_id, key, key, after, depth, prefix, timestamp):
+            (entries if kind == 'node' else delegates).append([node, value])
+            if len(entries) + len(delegates) >= limit:
+                return entries, delegates, node
+        return entries, delegates, None
+
+    def _walk(self, branch_id, root, key, after, depth, prefix, timestamp):
+        if (version := self._local.last_version((branch_id, *key), timestamp)) is None:
+            return
+        if after is None:
+            yield 'node', key, version
+        elif len(after) == len(key):
+            after = None
+        if depth is not None and len(key) - len(root) >= depth:
+            return
+
+        children = sorted((self._local.get((branch_id, *key), timestamp) or {}).get('children') or [])
+        if prefix and key == root:
+            children = [c for c in children if c.startswith(prefix)]
+        start = bisect_left(children, after[len(key)]) if after is not None else 0
+        for c in children[start:]:
+            child = (*key, c)
+            child_after = after if after is not None and after[len(key)] == c else None
+            if (owner_id := self._registry.get((branch_id, *child))) and owner_id != self.id:
+                if child_after is None:
+                    yield 'delegate', child, owner_id
+                continue
+            yield from self._walk(branch_id, root, child, child_after, depth, prefix, timestamp)
+
+    def _group_by_owner(self, branch_id, keys):
+        groups = {}
+        for i, key in enumerate(keys):
+            while True:
+                prefix, owner_id = self._registry.match((branch_id, *key))
+                if owner_id and owner_id != self.id and owner_id not in self._peers:
+                    self._registry.set(prefix, None)
+                    continue
+                break
+            groups.setdefault(owner_id, []).append(i)
+        return groups
+
+    async def _unwrap(self, out):
+        if not out:
+            return
+        if out[0] == 'data':
+            return out[1]
+        if out[0] == 'ref':
+            value_hash = out[1]
+            if value_hash in self._data:
+                return self._decode(value_hash, await self._data.aget(value_hash))
+            if (data := await self._cache.aget(value_hash)) is not None:
+                return self._decode(value_hash, data)
+            if len(out) > 3:
+                return self._decode(value_hash, await self._cache.aput(value_hash, out[3], out[4]))
+            if not (owner := self._peers.get(out[2])) or not (out := await owner.get_blob(value_hash)):
+                return
+        if out[0] == 'blob':
+            return self._decode(out[1], await self._cache.aput(out[1], out[2], out[3]))
+        if out[0] == 'getter':
+            return self._decode(out[1], await self._cache.receive(out[1], out[2]))
+
+    def _encode(self, value):
+        if isinstance(value, bytes):
+            value_enc = value
+            prefix = '0'
+        elif isinstance(value, str):
+            value_enc = value.encode()
+            prefix = '1'
+        else:
+            value_enc = bson.dumps(tk.Telekinesis(None, self._session, block_gc=True)._encode(value))
+            prefix = ''
+        return prefix + self._hash(value_enc), value_enc
+
+    def _decode(self, value_hash, value_enc):
+        if len(value_hash) == 43:
+            return tk.Telekinesis(None, self._session)\
+                ._decode(bson.loads(value_enc), self._session.session_key.public_serial())
+        elif value_hash[0] == '0':
+            return value_enc
+        elif value_hash[0] == '1':
+            return value_enc.decode()
+
+    def _start_background(self):
+        try:
+            while self._idle:
+                self._idle[-1].start()
+                self._idle.pop()
+        except RuntimeError:
+            pass
+
     async def _overhead(self, context, branch, new_peer=False):
+        self._idle and self._start_background()
         caller = context and context.caller.session or ['','']
-        is_peer = caller[0] == self._session.session_key.public_serial() \
-            and caller[1] in [p[4:] for p in self._peers] and caller[1] != self.id[4:]
+        serial = self._session.session_key.public_serial()
+        is_peer = caller[0] == serial and caller[1] != self.id[4:] and caller[1] in self._peer_ids
         
-        peer_id = is_peer and [p for p in self._peers if caller[1] == p[4:]][0] or \
-            new_peer and caller[0] == self._session.session_key.public_serial() and caller[1]
+        peer_id = is_peer and self._peer_ids[caller[1]] or \
+            new_peer and caller[0] == serial and caller[1]
         
         if is_peer and context.reply_to:
             reply_to = context.reply_to.session
-            reply_to_is_peer = reply_to[0] == self._session.session_key.public_serial() \
-                and reply_to[1] in [p[4:] for p in self._peers] and reply_to[1] != self.id[4:]
-        
-            reply_to_peer_id = reply_to_is_peer and [p for p in self._peers if reply_to[1] == p[4:]][0] or \
-                new_peer and reply_to[0] == self._session.session_key.public_serial() and reply_to[1]
+            reply_to_is_peer = reply_to[0] == serial \
+                and reply_to[1] != self.id[4:] and reply_to[1] in self._peer_ids
             
             if reply_to_is_peer:
-                peer_id = reply_to_peer_id
+                peer_id = self._peer_ids[reply_to[1]]
         
         
         if branch is None:
             if self._default_branch_id:
                 branch = self._branches[self._default_branch_id]
         elif not isinstance(branch, dict):
-            branch = await self.get_branch_info(branch)
+            branch_tup = (self._default_branch_id, branch if isinstance(branch, str) else (tuple(branch[0]), branch[1]))
+            if (info := self._branch_infos.get(branch_tup)) is None:
+                info = await self.get_branch_info(branch)
+                if isinstance(info, dict):
+                    self._branch_infos[branch_tup] = info
+            branch = info
         branch_id = branch and branch['branch_id']
 
         return peer_id, branch_id, branch
@@ -576,9 +1212,10 @@ class Branch:
         return await out
 
     @tk.inject_first_arg
-    async def tree(self, context, key, timestamp=None, branch=None):
+    async def tree(self, context, key, timestamp=None, branch=None, depth=None, prefix=None, limit=None):
         peer_id, _, _ = await self._parent._overhead(context, None)
-        out = await self._parent.tree(context, self._root + tuple(key), timestamp, branch or self._branch_id)
+        out = await self._parent.tree(
+            context, self._root + tuple(key), timestamp, branch or self._branch_id, depth, prefix, limit)
         return {k[len(self._root):]: v for k, v in out.items()}
 
     @tk.inject_first_arg
@@ -597,6 +1234,29 @@ class Branch:
             return out
         return await out
 
+    @tk.inject_first_arg
+    async def get_reader(self, context, key, timestamp=None, branch=None):
+        return await self._parent.get_reader(context, self._root + tuple(key), timestamp, branch or self._branch_id)
+
+    @tk.inject_first_arg
+    async def get_many(self, context, keys, metadata=False, timestamp=None, branch=None):
+        peer_id, _, _ = await self._parent._overhead(context, None)
+        out = self._parent.get_many(
+            context, [self._root + tuple(key) for key in keys], metadata, timestamp, branch or self._branch_id)
+        if peer_id:
+            return out
+        return await out
+
+    @tk.inject_first_arg
+    @tk.block_arg_evaluation
+    async def set_many(self, context, items, branch=None):
+        peer_id, _, _ = await self._parent._overhead(context, None)
+        out = self._parent.set_many(
+            context, [(self._root + tuple(item[0]), *item[1:]) for item in items], branch or self._branch_id)
+        if peer_id:
+            return out
+        return await out
+
     @tk.inject_first_arg
     async def list(self, context, key, query=None, timestamp=None, branch=None):
         peer_id, _, _ = await self._parent._overhead(context, None)
@@ -605,6 +1265,38 @@ class Branch:
             return out
         return await out
         
+    @tk.inject_first_arg
+    async def subscribe(self, context, key, callback, recursive=True, since=None, branch=None):
+        await self._parent._overhead(context, None)
+        root = self._root
+
+        def relative(events):
+            return callback([[event[0][len(root):], *event[1:]] for event in events])
+
+        return await self._parent.subscribe(
+            context, root + tuple(key), relative if root else callback, recursive, since, branch or self._branch_id)
+
+    @tk.inject_first_arg
+    async def unsubscribe(self, context, sub_id):
+        await self._parent._overhead(context, None)
+        return await self._parent.unsubscribe(context, sub_id)
+
+    @tk.inject_first_arg
+    async def create_index(self, context, key, field, kind='hash', branch=None):
+        peer_id, _, _ = await self._parent._overhead(context, None)
+        out = self._parent.create_index(context, self._root + tuple(key), field, kind, branch or self._branch_id)
+        if peer_id:
+            return out
+        return await out
+
+    @tk.inject_first_arg
+    async def drop_index(self, context, key, field, branch=None):
+        peer_id, _, _ = await self._parent._overhead(context, None)
+        out = self._parent.drop_index(context, self._root + tuple(key), field, branch or self._branch_id)
+        if peer_id:
+            return out
+        return await out
+
     @tk.inject_first_arg
     async def exists(self, context, key, timestamp=None, branch=None):
         peer_id, _, _ = await self._parent._overhead(context, None)
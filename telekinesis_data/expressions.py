@@ -0,0 +1,134 @@
+import ast
+import copy
+import math
+import time
+from functools import lru_cache, partial
+from types import SimpleNamespace
+
+ALLOWED_NODES = (
+    ast.Expression, ast.BoolOp, ast.And, ast.Or, ast.UnaryOp, ast.Not, ast.USub, ast.UAdd, ast.Invert,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.Compare, ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+    ast.IfExp, ast.Name, ast.Load, ast.Constant, ast.Attribute, ast.Call, ast.keyword,
+    ast.Subscript, ast.Slice, ast.Tuple, ast.List, ast.Set, ast.Dict,
+)
+
+SAFE_BUILTINS = {
+    f.__name__: f for f in (
+        abs, all, any, bool, dict, float, int, isinstance, len, list, max, min, round, set, sorted, str, sum, tuple
+    )
+}
+SAFE_BUILTINS.update({'True': True, 'False': False, 'None': None})
+
+BLOCKED_ATTRIBUTES = {'format', 'format_map'}
+MAX_BITS = 4096
+MAX_LENGTH = 2**16
+
+def _pow(base, exponent):
+    if isinstance(base, int) and isinstance(exponent, int) and abs(exponent) * max(base.bit_length() - 1, 0) > MAX_BITS:
+        raise ValueError('Power is too large')
+    return base ** exponent
+
+def _mult(left, right):
+    if isinstance(left, int) and isinstance(right, int):
+        if left.bit_length() + right.bit_length() > MAX_BITS:
+            raise ValueError('Product is too large')
+    elif isinstance(left, int) or isinstance(right, int):
+        count, sequence = (left, right) if isinstance(left, int) else (right, left)
+        if hasattr(sequence, '__len__') and count * len(sequence) > MAX_LENGTH:
+            raise ValueError('Product is too large')
+    return left * right
+
+def _bits(name, n=0, k=None):
+    if not isinstance(n, int) or not isinstance(k, (int, type(None))):
+        return 0
+    k = n if k is None else max(min(k, n), 0)
+    if name == 'comb':
+        k = min(k, n - k)
+    return k * n.bit_length()
+
+def _length(target, name, args, kwargs):
+    if not isinstance(target, (str, bytes)):
+        return 0
+    if name in ('ljust', 'rjust', 'center', 'zfill'):
+        width = args[0] if args else kwargs.get('width', 0)
+        return width if isinstance(width, int) else 0
+    if name == 'expandtabs':
+        tabsize = args[0] if args else kwargs.get('tabsize', 8)
+        return len(target) * tabsize if isinstance(tabsize, int) else 0
+    if name == 'replace' and len(args) >= 2 and isinstance(args[0], type(target)) and isinstance(args[1], type(target)):
+        count = target.count(args[0])
+        if len(args) > 2 and isinstance(args[2], int) and args[2] >= 0:
+            count = min(count, args[2])
+        return len(target) + count * (len(args[1]) - len(args[0]))
+    return 0
+
+def _method(obj, name):
+    getattr(obj, name)
+    return partial(_guarded, obj, name)
+
+def _guarded(obj, name, *args, **kwargs):
+    if obj is math:
+        if _bits(name, *args[:2]) > MAX_BITS:
+            raise ValueError('Result is too large')
+    else:
+        target, rest = (args[0], args[1:]) if obj in (str, bytes) and args else (obj, args)
+        if _length(target, name, rest, kwargs) > MAX_LENGTH:
+            raise ValueError('Result is too large')
+    return getattr(obj, name)(*args, **kwargs)
+
+GUARDS = {ast.Pow: '__pow', ast.Mult: '__mult'}
+GUARDED_METHODS = {'ljust', 'rjust', 'center', 'zfill', 'expandtabs', 'replace', 'factorial', 'comb', 'perm'}
+
+BASE_NAMES = {
+    'math': math, 'time': SimpleNamespace(time=time.time),
+    '__pow': _pow, '__mult': _mult, '__method': _method, '__builtins__': SAFE_BUILTINS,
+}
+
+class _Guard(ast.NodeTransformer):
+    def visit_BinOp(self, node):
+        self.generic_visit(node)
+        if (name := GUARDS.get(type(node.op))) is None:
+            return node
+        return ast.copy_location(ast.Call(ast.Name(name, ast.Load()), [node.left, node.right], []), node)
+
+    def visit_Attribute(self, node):
+        self.generic_visit(node)
+        if node.attr not in GUARDED_METHODS:
+            return node
+        return ast.copy_location(ast.Call(ast.Name('__method', ast.Load()), [node.value, ast.Constant(node.attr)], []), node)
+
+@lru_cache(maxsize=1024)
+def parse(source):
+    tree = ast.parse(source, mode='eval')
+    for node in ast.walk(tree):
+        if not isinstance(node, ALLOWED_NODES):
+            raise ValueError(f'{type(node).__name__} is not allowed in expressions: {source}')
+        if isinstance(node, ast.Attribute) and (node.attr.startswith('_') or node.attr in BLOCKED_ATTRIBUTES):
+            raise ValueError(f'Attribute {node.attr} is not allowed in expressions: {source}')
+        if isinstance(node, ast.Name) and node.id.startswith('__'):
+            raise ValueError(f'Name {node.id} is not allowed in expressions: {source}')
+    return tree
+
+@lru_cache(maxsize=1024)
+def compile_expression(source):
+    return compile(ast.fix_missing_locations(_Guard().visit(copy.deepcopy(parse(source)))), '<expression>', 'eval')
+
+def evaluate(source, metadata, names=None):
+    namespace = dict(metadata or {})
+    namespace.update(BASE_NAMES)
+    names and namespace.update(names)
+    return eval(compile_expression(source), namespace)
+
+def select(source, rows, names=None):
+    code = compile_expression(source)
+    fixed = {**BASE_NAMES, **(names or {})}
+    out = []
+    for row in rows:
+        namespace = dict(row or {})
+        namespace.update(fixed)
+        try:
+            out.append(bool(eval(code, namespace)))
+        except NameError:
+            out.append(False)
+    return out
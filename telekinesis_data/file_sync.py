@@ -1,73 +1,223 @@
-from glob import glob
 import os
-import asyncio
-import shutil
 import time
+import base64
+import shutil
+import asyncio
+import hashlib
+import inspect
+import logging
+
 from .storage import SimpleKV
+from .blobs import CHUNK_SIZE
+from .compression import decompressor
+
+logger = logging.getLogger(__name__)
+
+def file_hash(path, chunk_size=CHUNK_SIZE):
+    digest = hashlib.blake2s()
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return '0' + base64.b64encode(digest.digest(), b'_-')[:-1].decode()
+
+class FileReader:
+    def __init__(self, path, chunk_size=CHUNK_SIZE):
+        self._path = path
+        self._chunk_size = chunk_size
+
+    async def read(self, index):
+        with open(self._path, 'rb') as f:
+            f.seek(index * self._chunk_size)
+            return f.read(self._chunk_size)
 
 class FileSync:
-    def __init__(self, data_branch, target_dir, support_dir):
+    def __init__(self, data_branch, target_dir, support_dir, interval=10, concurrency=8):
         self.data = data_branch
         self.target_dir = target_dir
         self.support_dir = support_dir
         self.tracker = SimpleKV(support_dir)
+        self.interval = interval
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._changes = None
+        self._sub_id = None
+        self._wake = asyncio.Event()
         self.task = asyncio.create_task(self.keep_sync())
-        
+
         self.ftk = lambda f: tuple(f.strip('/').split('/')[len(self.target_dir.strip('/').split('/')):])
         self.ktf = lambda k: os.path.join(self.target_dir, '/'.join(k))
 
     async def keep_sync(self):
+        since = time.time()
+        await self.sync()
+        try:
+            self._changes = {}
+            self._sub_id = await self.data.subscribe((), self._changed, True, since)
+        except Exception:
+            self._changes = None
         while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
             await self.sync()
-            await asyncio.sleep(10)
+
+    def stop(self):
+        self.task.cancel()
+        if self._sub_id is not None:
+            asyncio.ensure_future(self.data.unsubscribe(self._sub_id))
+            self._sub_id = None
+        self._changes = None
+
+    def _changed(self, events):
+        if self._changes is not None:
+            for key, timestamp, kind in events:
+                if key:
+                    self._changes[tuple(key)] = (timestamp, kind)
+            self._wake.set()
 
     async def sync(self, download=True):
+        local = await asyncio.get_running_loop().run_in_executor(None, self._scan)
+        tracked = {k: self._entry(k) for k in self.tracker.keys()}
+
         if download:
-            tree = await self.data.tree(())
-            files = glob(os.path.join(self.target_dir, '**'), recursive=True)
-            for t in tree:
-                if t not in self.tracker.keys() or tree[t] > self.tracker.get(t)[1]:
-                    d = await self.data.get(t)
-                    if d:
-                        print('downloading', t)
-                        with open(self.ktf(t), 'wb') as f:
-                            data = await self.data.get(t)
-                            f.write(data if isinstance(data, bytes) else str(data).encode())
-                        self.tracker.set(t, (os.path.getmtime(self.ktf(t)), tree[t], False))
-                    elif await self.data.list(t):
-                        if not os.path.exists(self.ktf(t)):
-                            print('making dir', t)
-                            os.mkdir(self.ktf(t))
-                            self.tracker.set(t, (os.path.getmtime(self.ktf(t)), tree[t], False))
-
-        files = glob(os.path.join(self.target_dir, '**'), recursive=True)
-
-        for f in files:
-            if self.ftk(f) not in self.tracker.keys() \
-            or (os.path.getmtime(f) > self.tracker.get(self.ftk(f))[0]):
-                print('uploading', f)
-                mt = os.path.getmtime(f)
-                if os.path.isfile(f):
-                    with open(f, 'rb') as ff:
-                        ts = await self.data.set(self.ftk(f), ff.read())
-                else:
-                    ts = await self.data.set(self.ftk(f), None)
-                self.tracker.set(self.ftk(f), (mt, ts, False))
-        tree = await self.data.tree(())
+            if self._changes is None:
+                remote = await self.data.tree(())
+                removed = [k for k in tracked if k not in remote]
+            else:
+                changes, self._changes = self._changes, {}
+                remote = {k: t for k, (t, kind) in changes.items() if kind != 'remove'}
+                gone = {k for k, (_, kind) in changes.items() if kind == 'remove'}
+                removed = [k for k in tracked if any(k[:i] in gone for i in range(1, len(k) + 1))]
 
-        if download: # not delete anything if not downloading stuff, just in case
-            for k in self.tracker.keys():
-                if k not in tree and not self.tracker.get(k)[2]:
+            await asyncio.gather(*(
+                self._download(k, t, local, tracked) for k, t in remote.items()
+                if k and (k not in tracked or tracked[k][2] or t > tracked[k][1])))
+
+            for k in removed:
+                if not tracked[k][2]:
                     print('deleting (down)', k)
-                    ts = await self.data.list_versions(k)[-1]
-                    self.tracker.set(k, (time.time(), ts, True))
+                    self.tracker.set(k, (time.time(), time.time(), True, None, None))
+                    tracked[k] = self._entry(k)
+                    local.pop(k, None)
                     if os.path.exists(self.ktf(k)):
                         if os.path.isdir(self.ktf(k)):
                             shutil.rmtree(self.ktf(k))
                         else:
                             os.remove(self.ktf(k))
 
-                if self.ktf(k) not in files and not self.tracker.get(k)[2]:
+        await asyncio.gather(*(
+            self._upload(k, stat, tracked.get(k)) for k, stat in local.items()
+            if k not in tracked or tracked[k][2] or tracked[k][0] != stat[1] or tracked[k][3] != stat[2]))
+
+        if download: # not delete anything if not downloading stuff, just in case
+            deleted = [k for k in tracked if k not in local and not tracked[k][2]]
+            for k in deleted:
+                if not any(k[:i] in deleted for i in range(1, len(k))):
                     print('deleting (up)', k)
                     ts = await self.data.remove(k)
-                    self.tracker.set(k, (ts, ts, True))
+                else:
+                    ts = time.time()
+                self.tracker.set(k, (ts, ts, True, None, None))
+
+    async def _download(self, key, timestamp, local, tracked):
+        async with self._semaphore:
+            value_hash, reader = await self.data.get_reader(key)
+            path = self.ktf(key)
+            if value_hash is not None:
+                if value_hash[0] in '01':
+                    value_hash = '0' + value_hash[1:]
+                    if not (key in local and not local[key][0] and \
+                            await asyncio.get_running_loop().run_in_executor(None, file_hash, path) == value_hash):
+                        print('downloading', key)
+                        await self._fetch(reader, path, value_hash)
+                else:
+                    data = str(await self.data.get(key)).encode()
+                    value_hash = '0' + base64.b64encode(hashlib.blake2s(data).digest(), b'_-')[:-1].decode()
+                    print('downloading', key)
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    with open(path, 'wb') as f:
+                        f.write(data)
+            elif await self.data.list(key):
+                if not os.path.exists(path):
+                    print('making dir', key)
+                    os.makedirs(path)
+            else:
+                return
+            stat = os.stat(path)
+            local[key] = (value_hash is None, stat.st_mtime, None if value_hash is None else stat.st_size)
+            self.tracker.set(key, (stat.st_mtime, timestamp, False, local[key][2], value_hash))
+            tracked[key] = self._entry(key)
+
+    async def _fetch(self, reader, path, value_hash):
+        codec = reader.codec
+        if inspect.isawaitable(codec):
+            codec = await codec
+        stream = decompressor(codec)
+        os.makedirs(partial := os.path.join(self.support_dir, 'partial'), exist_ok=True)
+        part = os.path.join(partial, value_hash)
+        digest = hashlib.blake2s()
+        with open(part, 'wb') as f:
+            index = 0
+            while True:
+                chunk = await reader.read(index)
+                data = stream.decompress(chunk)
+                if len(chunk) < CHUNK_SIZE and (flush := getattr(stream, 'flush', None)):
+                    data += flush()
+                f.write(data)
+                digest.update(data)
+                index += 1
+                if len(chunk) < CHUNK_SIZE:
+                    break
+        if '0' + base64.b64encode(digest.digest(), b'_-')[:-1].decode() != value_hash:
+            os.remove(part)
+            raise ValueError(f'Downloaded file does not match its hash {value_hash}')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(part, path)
+
+    async def _upload(self, key, stat, entry):
+        is_dir, mtime, size = stat
+        path = self.ktf(key)
+        async with self._semaphore:
+            try:
+                value_hash = None
+                if is_dir:
+                    if entry and not entry[2]:
+                        ts = entry[1]
+                    else:
+                        print('uploading', path)
+                        ts = await self.data.set(key, None)
+                else:
+                    value_hash = await asyncio.get_running_loop().run_in_executor(None, file_hash, path)
+                    if entry and not entry[2] and entry[4] == value_hash:
+                        ts = entry[1]
+                    elif size > CHUNK_SIZE:
+                        print('uploading', path)
+                        ts = await self.data.set(key, value_hash, None, False, FileReader(path))
+                    else:
+                        print('uploading', path)
+                        with open(path, 'rb') as f:
+                            ts = await self.data.set(key, f.read())
+            except Exception:
+                logger.exception('Failed uploading %s', path)
+                return
+            self.tracker.set(key, (mtime, ts, False, size, value_hash))
+
+    def _entry(self, key):
+        return (*self.tracker.get(key), None, None)[:5]
+
+    def _scan(self):
+        out = {}
+        stack = [()]
+        while stack:
+            key = stack.pop()
+            with os.scandir(self.ktf(key)) as entries:
+                for entry in entries:
+                    child = (*key, entry.name)
+                    if entry.is_dir(follow_symlinks=False):
+                        out[child] = (True, entry.stat().st_mtime, None)
+                        stack.append(child)
+                    elif entry.is_file():
+                        stat = entry.stat()
+                        out[child] = (False, stat.st_mtime, stat.st_size)
+        return out
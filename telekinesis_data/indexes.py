@@ -0,0 +1,236 @@
+import ast
+import math
+import asyncio
+from itertools import count
+from bisect import bisect_left, bisect_right
+
+from .storage import SimpleKV
+from .expressions import parse
+
+class HashIndex:
+    ops = ('==', 'in')
+
+    def __init__(self):
+        self._values = {}
+        self._children = {}
+
+    def add(self, child, value):
+        try:
+            self._values.setdefault(value, set()).add(child)
+        except TypeError:
+            return
+        self._children[child] = value
+
+    def remove(self, child):
+        if child in self._children:
+            value = self._children.pop(child)
+            self._values[value].discard(child)
+            if not self._values[value]:
+                self._values.pop(value)
+
+    def lookup(self, op, value):
+        if op == '==':
+            return set(self._values.get(value, ()))
+        return set().union(*(self._values.get(v, ()) for v in value))
+
+class SortedIndex:
+    ops = ('==', '<', '<=', '>', '>=', 'prefix')
+
+    def __init__(self):
+        self._keys = []
+        self._entries = []
+        self._children = {}
+
+    def add(self, child, value):
+        if (key := _sort_key(value)) is None:
+            return
+        i = bisect_right(self._keys, key)
+        self._keys.insert(i, key)
+        self._entries.insert(i, child)
+        self._children[child] = key
+
+    def remove(self, child):
+        if (key := self._children.pop(child, None)) is not None:
+            i = bisect_left(self._keys, key)
+            i += self._entries[i:bisect_right(self._keys, key)].index(child)
+            del self._keys[i]
+            del self._entries[i]
+
+    def lookup(self, op, value):
+        if op == 'prefix':
+            lo, hi = bisect_left(self._keys, (1, value)), bisect_left(self._keys, (1, value + '\U0010ffff'))
+            return set(self._entries[lo:hi])
+        if (key := _sort_key(value)) is None:
+            return set()
+        rank = (key[0],)
+        lo, hi = bisect_left(self._keys, rank), bisect_left(self._keys, (key[0] + 1,))
+        if op == '==':
+            lo, hi = bisect_left(self._keys, key), bisect_right(self._keys, key)
+        elif op == '<':
+            hi = bisect_left(self._keys, key)
+        elif op == '<=':
+            hi = bisect_right(self._keys, key)
+        elif op == '>':
+            lo = bisect_right(self._keys, key)
+        elif op == '>=':
+            lo = bisect_left(self._keys, key)
+        return set(self._entries[lo:hi])
+
+INDEX_KINDS = {
+    'hash': HashIndex,
+    'sorted': SortedIndex,
+}
+
+def _sort_key(value):
+    if isinstance(value, (int, float)) and not (isinstance(value, float) and math.isnan(value)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+
+class MetadataIndexes:
+    def __init__(self, path, local, stream=None, container=None):
+        self._specs = SimpleKV(path, stream, container)
+        self._declared = {key: self._specs.get(key) for key in self._specs.keys()}
+        self._local = local
+        self._built = {}
+        self._stale = {}
+        self._versions = count(1)
+        local.listeners.append(self._changed)
+
+    def declare(self, key, field, kind='hash'):
+        if kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{kind}'")
+        spec = {**(self._declared.get(key) or {}), field: kind}
+        self._declared[key] = spec
+        self._specs.set(key, spec)
+        self._invalidate(key)
+
+    def drop(self, key, field):
+        spec = {k: v for k, v in (self._declared.get(key) or {}).items() if k != field}
+        self._declared[key] = spec
+        self._specs.set(key, spec)
+        self._invalidate(key)
+
+    def export(self, key):
+        inherited = [[[], spec]] if (spec := self.specs(key[:-1])) else []
+        return inherited + [[k[len(key):], spec] for k, spec in self._declared.items() if k[:len(key)] == key and spec]
+
+    def forget(self, key):
+        for k in [k for k, spec in self._declared.items() if k[:len(key)] == key and spec]:
+            self._declared[k] = {}
+            self._specs.set(k, {})
+        self._invalidate(key)
+
+    def specs(self, parent):
+        out = {}
+        for i in range(1, len(parent) + 1):
+            out.update(self._declared.get(parent[:i]) or {})
+        return out
+
+    def candidates(self, parent, children, source, names=None):
+        if (indexes := self._indexes(parent, children)) is None:
+            return None, False
+        for child, version in list(self._stale[parent].items()):
+            self._refresh(parent, indexes, child, version, self._local.get((*parent, child)))
+        return self._lookup(indexes, source, names)
+
+    async def acandidates(self, parent, children, source, names=None):
+        if (indexes := self._indexes(parent, children)) is None:
+            return None, False
+        if stale := list(self._stale[parent].items()):
+            values = await asyncio.gather(*(self._local.aget((*parent, child)) for child, _ in stale))
+            for (child, version), value in zip(stale, values):
+                self._refresh(parent, indexes, child, version, value)
+        return self._lookup(indexes, source, names)
+
+    def _lookup(self, indexes, source, names):
+        predicates, exact = plan(source, names or {})
+        out = None
+        for field, op, value in predicates:
+            if (index := indexes.get(field)) is None or op not in index.ops:
+                exact = False
+                continue
+            matches = index.lookup(op, value)
+            out = matches if out is None else out & matches
+        return out, exact and out is not None
+
+    def _indexes(self, parent, children):
+        if not (specs := self.specs(parent)):
+            return None
+        if (indexes := self._built.get(parent)) is None:
+            indexes = self._built[parent] = {field: INDEX_KINDS[kind]() for field, kind in specs.items()}
+            self._stale[parent] = dict.fromkeys(children, 0)
+        return indexes
+
+    def _changed(self, key, timestamp, changes):
+        if key[:-1] in self._built and any(isinstance(diff, dict) and 'metadata' in diff for _, diff in changes):
+            self._stale[key[:-1]][key[-1]] = next(self._versions)
+        if (indexes := self._built.get(key)) is not None:
+            for mode, diff in changes:
+                if mode == 'um' and 'children' in diff:
+                    self._stale[key].pop(diff['children'], None)
+                    for index in indexes.values():
+                        index.remove(diff['children'])
+
+    def _refresh(self, parent, indexes, child, version, value):
+        if self._built.get(parent) is not indexes or self._stale[parent].get(child) != version:
+            return
+        del self._stale[parent][child]
+        metadata = (value or {}).get('metadata') or {}
+        for field, index in indexes.items():
+            index.remove(child)
+            if field in metadata:
+                index.add(child, metadata[field])
+
+    def _invalidate(self, key):
+        for parent in [p for p in self._built if p[:len(key)] == key]:
+            self._built.pop(parent)
+            self._stale.pop(parent)
+
+COMPARISONS = {ast.Eq: '==', ast.Lt: '<', ast.LtE: '<=', ast.Gt: '>', ast.GtE: '>=', ast.In: 'in'}
+FLIPPED = {'==': '==', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+
+def plan(source, names):
+    node = parse(source).body
+    conjuncts = node.values if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And) else [node]
+    predicates, exact = [], True
+    for conjunct in conjuncts:
+        if (found := _predicates(conjunct, names)) is None:
+            exact = False
+        else:
+            predicates += found
+    return predicates, exact
+
+def _predicates(node, names):
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute) and node.func.attr == 'startswith' \
+            and (field := _field(node.func.value, names)) and len(node.args) == 1 and not node.keywords:
+        value = _constant(node.args[0], names)
+        return [(field, 'prefix', value[0])] if value and isinstance(value[0], str) else None
+    if not isinstance(node, ast.Compare):
+        return None
+    out = []
+    operands = [node.left, *node.comparators]
+    for left, op, right in zip(operands, node.ops, operands[1:]):
+        if (op := COMPARISONS.get(type(op))) is None:
+            return None
+        if (field := _field(left, names)) and (value := _constant(right, names)):
+            out.append((field, op, value[0]))
+        elif op != 'in' and (field := _field(right, names)) and (value := _constant(left, names)):
+            out.append((field, FLIPPED[op], value[0]))
+        else:
+            return None
+        if op == 'in' and not isinstance(out[-1][2], (tuple, list, set, frozenset)):
+            return None
+    return out
+
+def _field(node, names):
+    if isinstance(node, ast.Name) and node.id not in names and node.id != 'math':
+        return node.id
+
+def _constant(node, names):
+    try:
+        if isinstance(node, ast.Name):
+            return (names[node.id],) if node.id in names else None
+        return (ast.literal_eval(node),)
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
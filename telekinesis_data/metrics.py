@@ -0,0 +1,88 @@
+import time
+import functools
+import contextvars
+from collections import Counter, defaultdict
+
+_timing = contextvars.ContextVar('timing', default=False)
+
+class Histogram:
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.buckets = [0] * 40
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        value = value * self.scale
+        self.buckets[min(int(value).bit_length(), 39)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank:
+                return min(2 ** i, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p90': self.quantile(0.9),
+            'p99': self.quantile(0.99),
+            'buckets': {str(2 ** i): n for i, n in enumerate(self.buckets) if n},
+        }
+
+class Metrics:
+    def __init__(self):
+        self.latency = defaultdict(lambda: Histogram(1e6))
+        self.routes = Counter()
+        self.since = time.time()
+
+    def observe(self, name, seconds):
+        self.latency[name].observe(seconds)
+
+    def route(self, owner_id):
+        self.routes[owner_id] += 1
+
+    def requests(self):
+        return sum(h.count for h in self.latency.values())
+
+    def snapshot(self, own_id):
+        local = self.routes.get(own_id, 0)
+        routed = sum(self.routes.values())
+        return {
+            'uptime': time.time() - self.since,
+            'latency_us': {name: h.snapshot() for name, h in self.latency.items()},
+            'routes': {
+                'local': local,
+                'forwarded': {peer_id: n for peer_id, n in self.routes.items() if peer_id != own_id},
+                'local_ratio': local / routed if routed else 1.0,
+            },
+        }
+
+def timed(name):
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(self, *args, **kwargs):
+            if _timing.get():
+                return await fn(self, *args, **kwargs)
+            token = _timing.set(True)
+            t0 = time.perf_counter()
+            try:
+                return await fn(self, *args, **kwargs)
+            finally:
+                self._metrics.observe(name, time.perf_counter() - t0)
+                _timing.reset(token)
+        return wrapper
+    return decorator
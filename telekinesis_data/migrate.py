@@ -0,0 +1,73 @@
+import os
+import sys
+import ujson
+
+from .storage import Stream, FrameStream, FRAME_MAGIC
+
+STREAM_NAMES = ('keys', 'keys1', 'plainkeys')
+
+def stream_paths(path):
+    for root, _, files in os.walk(path):
+        for name in STREAM_NAMES:
+            if name in files:
+                yield os.path.join(root, name)
+
+        if 'keys' in files and 'plainkeys' not in files:
+            for keyenc in {k for k, _ in FrameStream(os.path.join(root, 'keys'))}:
+                offset = 0
+                while os.path.exists(segment := os.path.join(root, keyenc) + (f'_{offset}' if offset else '')):
+                    yield segment
+                    offset += 1
+
+def convert_stream(path):
+    if not os.path.getsize(path) or FrameStream(path)._is_framed(path):
+        return False
+
+    tmp = path + '.migrating'
+    with open(path, 'rb') as src, open(tmp, 'wb') as dst:
+        dst.write(FRAME_MAGIC)
+        for line in src:
+            if line.strip():
+                dst.write(FrameStream.encode_frame(*ujson.loads(line)))
+        dst.flush()
+        os.fsync(dst.fileno())
+    os.replace(tmp, path)
+    FrameStream(path)._remember(path, True)
+    return True
+
+def compact_stream(path):
+    records = {}
+    total = 0
+    for k, v in FrameStream(path):
+        records[k] = v
+        total += 1
+    records = {k: v for k, v in records.items() if v is not False}
+    if len(records) == total:
+        return 0
+
+    size = os.path.getsize(path)
+    stream = FrameStream(path) if FrameStream(path)._is_framed(path) else Stream(path)
+    return size - stream.rewrite(records)
+
+def migrate(path):
+    converted = [p for p in list(stream_paths(path)) if convert_stream(p)]
+    for root in {os.path.dirname(p) for p in converted}:
+        for name in os.listdir(root):
+            if name.endswith('.tidx'):
+                os.remove(os.path.join(root, name))
+    return len(converted)
+
+def compact_keys(path):
+    return sum(
+        compact_stream(p) for p in list(stream_paths(path))
+        if os.path.basename(p) in STREAM_NAMES and os.path.getsize(p)
+    )
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] not in ('frames', 'compact-keys'):
+        print('usage: python -m telekinesis_data.migrate (frames | compact-keys) PATH')
+        sys.exit(1)
+    if sys.argv[1] == 'frames':
+        print('converted', migrate(sys.argv[2]), 'streams to the framed format')
+    else:
+        print('reclaimed', compact_keys(sys.argv[2]), 'bytes from key streams')
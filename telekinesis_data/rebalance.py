@@ -0,0 +1,46 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Rebalancer:
+    def __init__(self, data, interval=60, threshold=2.0, min_rate=1.0):
+        self.data = data
+        self.interval = interval
+        self.threshold = threshold
+        self.min_rate = min_rate
+        self._task = None
+
+    async def run(self):
+        try:
+            loads = await self.data.peer_loads()
+            own = loads.pop(self.data.id, 0)
+            if not loads:
+                return
+            target_id, low = min(loads.items(), key=lambda item: item[1])
+            if own < self.min_rate or own < low * self.threshold:
+                return
+            budget = (own - low) / 2
+            for key, rate in self.data.hot_subtrees():
+                if rate <= budget:
+                    await self.data.migrate(None, key, target_id)
+                    return key, target_id
+        finally:
+            self.data.reset_load()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+        return self._task
+
+    def stop(self):
+        self._task and self._task.cancel()
+        self._task = None
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                logger.exception('Rebalancing failed')
@@ -0,0 +1,73 @@
+from collections import defaultdict
+
+from .storage import SimpleKV
+
+class OwnershipRegistry:
+    def __init__(self, path, stream=None, container=None):
+        self._kv = SimpleKV(path, stream, container)
+        self._branches = {}
+        self._unloaded = None
+        self.lookups = 0
+
+    def get(self, key):
+        self.lookups += 1
+        node = self._branch(key[0])
+        for part in key[1:]:
+            if (node := node[1].get(part)) is None:
+                return None
+        return node[0]
+
+    def match(self, key):
+        self.lookups += 1
+        node = self._branch(key[0])
+        depth, owner = (1, node[0]) if node[0] else (0, None)
+        for i, part in enumerate(key[1:]):
+            if (node := node[1].get(part)) is None:
+                break
+            if node[0]:
+                depth, owner = i + 2, node[0]
+        return (key[:depth], owner) if owner else (None, None)
+
+    def descendants(self, key):
+        node = self._branch(key[0])
+        for part in key[1:]:
+            if (node := node[1].get(part)) is None:
+                return
+        stack = [(tuple(key), node)]
+        while stack:
+            prefix, node = stack.pop()
+            for part, child in node[1].items():
+                if child[0]:
+                    yield (*prefix, part), child[0]
+                stack.append(((*prefix, part), child))
+
+    def set(self, key, value):
+        if value is not None and self.get(key) == value:
+            return
+        self._kv.set(key, value)
+        self._insert(self._branch(key[0]), key, value)
+
+    def keys(self):
+        return self._kv.keys()
+
+    def __contains__(self, key):
+        return key in self._kv
+
+    def _branch(self, branch_id):
+        if (root := self._branches.get(branch_id)) is None:
+            if self._unloaded is None:
+                self._unloaded = defaultdict(list)
+                for key in self._kv.keys():
+                    self._unloaded[key[0]].append(key)
+            root = self._branches[branch_id] = [None, {}]
+            for key in self._unloaded.pop(branch_id, []):
+                self._insert(root, key, self._kv.get(key))
+        return root
+
+    def _insert(self, root, key, value):
+        node = root
+        for part in key[1:]:
+            if (child := node[1].get(part)) is None:
+                child = node[1][part] = [None, {}]
+            node = child
+        node[0] = value
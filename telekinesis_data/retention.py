@@ -0,0 +1,82 @@
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+class RetentionPolicy:
+    def __init__(self, keep_all=30*86400, snapshot_interval=86400, keep_snapshots=None):
+        self.keep_all = keep_all
+        self.snapshot_interval = snapshot_interval
+        self.keep_snapshots = keep_snapshots
+
+    def retain(self, versions, now=None):
+        boundary = (now or time.time()) - self.keep_all
+        old = versions[:bisect_left(versions, boundary)]
+        if not old:
+            return []
+
+        snapshots = {}
+        if self.snapshot_interval:
+            horizon = boundary - self.keep_snapshots if self.keep_snapshots is not None else None
+            for t in old:
+                if horizon is None or t >= horizon:
+                    snapshots[t // self.snapshot_interval] = t
+        retained = sorted(snapshots.values())
+        if not retained or retained[-1] != old[-1]:
+            retained.append(old[-1])
+        return retained
+
+class Compactor:
+    def __init__(self, kv, policies, interval=3600):
+        self.kv = kv
+        self.policies = policies if isinstance(policies, dict) else {(): policies}
+        self.interval = interval
+        self._task = None
+
+    def policy(self, key):
+        for i in range(len(key), -1, -1):
+            if (policy := self.policies.get(tuple(key[:i]))) is not None:
+                return policy
+
+    def run(self, now=None):
+        out = {'keys': 0, 'versions': 0, 'bytes': 0}
+        for key in self.kv.list():
+            if retained := self._plan(key, self.kv.list_versions(key), now, out):
+                out['bytes'] += self.kv.compact(key, retained)
+        return out
+
+    async def arun(self, now=None):
+        out = {'keys': 0, 'versions': 0, 'bytes': 0}
+        for key in self.kv.list():
+            if retained := self._plan(key, await self.kv.alist_versions(key), now, out):
+                out['bytes'] += await self.kv.acompact(key, retained)
+        return out
+
+    def _plan(self, key, versions, now, out):
+        if (policy := self.policy(key)) is None:
+            return
+        retained = policy.retain(versions, now)
+        dropped = len(versions[:bisect_left(versions, retained[-1]) + 1]) - len(retained) if retained else 0
+        if dropped > 0:
+            out['keys'] += 1
+            out['versions'] += dropped
+            return retained
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run_forever())
+        return self._task
+
+    def stop(self):
+        self._task and self._task.cancel()
+        self._task = None
+
+    async def _run_forever(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.arun()
+            except Exception:
+                logger.exception('History compaction failed')
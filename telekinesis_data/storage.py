@@ -3,38 +3,348 @@ import base64
 import hashlib
 import bson
 import os
+import time
+import mmap
+import zlib
+import atexit
+import struct
+import weakref
+import asyncio
+import threading
+import contextvars
+from collections import Counter, OrderedDict
+from contextlib import contextmanager, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from .compression import NONE, DEFAULT_POLICY, decompress
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+_open_writers = weakref.WeakSet()
+
+@atexit.register
+def _close_writers():
+    for writer in list(_open_writers):
+        writer.close()
 
 class SimpleFileContainer:
-    def __init__(self, path):
+    def __init__(self, path, stream=None):
         self._path = path
-        self._keys = Stream(os.path.join(path, 'plainkeys'))
+        self._keys = (stream or Stream)(os.path.join(path, 'plainkeys'))
+        self._writer = self._keys._writer
+        self._index = None
         if not os.path.exists(path):
             os.makedirs(path)
         
     def get(self, key):
-        with open(os.path.join(self._path, key), 'rb') as f:
+        self._writer and self._writer.flush(self._file(key))
+        self._writer and self._writer.opened()
+        with open(self._file(key), 'rb') as f:
             return f.read()
     def set(self, key, value):
-        self._keys.update({key: None})
-        with open(os.path.join(self._path, key), 'wb') as f:
+        if key not in self._load_index():
+            self._keys.update({key: None})
+            self._index[key] = None
+        if self._writer:
+            return self._writer.write(self._file(key, True), value)
+        with open(self._file(key, True), 'wb') as f:
             return f.write(value)
+    def read(self, key, offset, length):
+        self._writer and self._writer.flush(self._file(key))
+        self._writer and self._writer.opened()
+        with open(self._file(key), 'rb') as f:
+            f.seek(offset)
+            return f.read(length)
+    def set_file(self, key, path):
+        if key not in self._load_index():
+            self._keys.update({key: None})
+            self._index[key] = None
+        os.replace(path, self._file(key, True))
+    def remove(self, key):
+        if key in self._load_index():
+            self._keys.update({key: False})
+            del self._index[key]
+            self._writer and self._writer.flush(self._file(key))
+            os.remove(self._file(key))
+    def size(self, key):
+        self._writer and self._writer.flush(self._file(key))
+        return os.path.getsize(self._file(key))
     def keys(self):
-        return list(k for k, _ in self._keys)
+        return list(self._load_index())
     
     def __contains__(self, key):
-        return os.path.exists(os.path.join(self._path, key))
-    
+        return key in self._load_index()
+
+    def _file(self, key, create=False):
+        return os.path.join(self._path, key)
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            for k, v in self._keys:
+                if v is False:
+                    self._index.pop(k, None)
+                else:
+                    self._index[k] = None
+        return self._index
+
+LOG_MAGIC = b'TKB1'
+LOG_HEADER = struct.Struct('<IHIB')
+HINT_ENTRY = struct.Struct('<HQI')
+LOG_PUT = 0
+LOG_DELETE = 1
+
+# Appends go straight to data.log with os.write, outside StreamWriter batches and their undo
+# journal. Records carry a CRC and _open truncates a torn tail; blobs left by a rolled back batch
+# are unreferenced and collected by gc.
+class LogFileContainer:
+    shared = True
+
+    def __init__(self, path, stream=None, compact_ratio=0.5, compact_min=2**20):
+        self._path = path
+        self._compact_ratio = compact_ratio
+        self._compact_min = compact_min
+        self._lock = threading.RLock()
+        self._compaction = None
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._open()
+        _open_writers.add(self)
+
+    def get(self, key):
+        with self._lock:
+            offset, length = self._index[key]
+            return os.pread(self._fd, length, offset)
+
+    def set(self, key, value):
+        with self._lock:
+            self._write(key, value, LOG_PUT)
+        self._maybe_compact()
+        return len(value)
+
+    def read(self, key, offset, length):
+        with self._lock:
+            value_offset, value_length = self._index[key]
+            return os.pread(self._fd, max(0, min(length, value_length - offset)), value_offset + offset)
+
+    def set_file(self, key, path, chunk_size=2**20):
+        value_length = os.path.getsize(path)
+        key_enc = key.encode()
+        header = LOG_HEADER.pack(0, len(key_enc), value_length, LOG_PUT)[4:]
+        with open(path, 'rb') as f:
+            crc = zlib.crc32(header + key_enc)
+            while chunk := f.read(chunk_size):
+                crc = zlib.crc32(chunk, crc)
+            f.seek(0)
+            with self._lock:
+                os.write(self._fd, struct.pack('<I', crc) + header + key_enc)
+                while chunk := f.read(chunk_size):
+                    os.write(self._fd, chunk)
+                if old := self._index.pop(key, None):
+                    self._dead += old[1] + LOG_HEADER.size + len(key_enc)
+                self._index[key] = (self._size + LOG_HEADER.size + len(key_enc), value_length)
+                self._size += LOG_HEADER.size + len(key_enc) + value_length
+        os.remove(path)
+        self._maybe_compact()
+
+    def remove(self, key):
+        with self._lock:
+            if key in self._index:
+                self._write(key, b'', LOG_DELETE)
+        self._maybe_compact()
+
+    def size(self, key):
+        return self._index[key][1]
+
+    def keys(self):
+        return list(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def compact(self, wait=True):
+        with self._lock:
+            if not self._compaction or not self._compaction.is_alive():
+                self._compaction = threading.Thread(target=self._compact, daemon=True)
+                self._compaction.start()
+            compaction = self._compaction
+        wait and compaction.join()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self._compaction and self._compaction is not threading.current_thread():
+            self._compaction.join()
+        with self._lock:
+            if self._fd is not None:
+                self._write_hint()
+                os.close(self._fd)
+                self._fd = None
+
+    def _open(self):
+        data_path = os.path.join(self._path, 'data.log')
+        self._fd = os.open(data_path, os.O_RDWR | os.O_CREAT | os.O_APPEND)
+        self._size = os.fstat(self._fd).st_size
+        if not self._size:
+            os.write(self._fd, LOG_MAGIC + os.urandom(8))
+            self._size = len(LOG_MAGIC) + 8
+        self._file_id = os.pread(self._fd, 8, len(LOG_MAGIC))
+        self._index = {}
+        self._dead = 0
+
+        position = self._read_hint()
+        valid = self._scan(self._fd, position, self._size, self._index)
+        if valid < self._size:
+            os.ftruncate(self._fd, valid)
+            self._size = valid
+
+    def _scan(self, fd, position, end, index, copy_to=None):
+        while position + LOG_HEADER.size <= end:
+            header = os.pread(fd, LOG_HEADER.size, position)
+            crc, key_length, value_length, flags = LOG_HEADER.unpack(header)
+            body = os.pread(fd, key_length + value_length, position + LOG_HEADER.size)
+            if len(body) < key_length + value_length or zlib.crc32(header[4:] + body) != crc:
+                break
+            key = body[:key_length].decode()
+            if old := index.pop(key, None):
+                self._dead += old[1] + LOG_HEADER.size + key_length
+            if flags == LOG_DELETE:
+                self._dead += LOG_HEADER.size + key_length
+            if copy_to is not None:
+                index_offset = copy_to(key, body[key_length:], flags)
+            else:
+                index_offset = position + LOG_HEADER.size + key_length
+            if flags == LOG_PUT:
+                index[key] = (index_offset, value_length)
+            position += LOG_HEADER.size + key_length + value_length
+        return position
+
+    def _record(self, key, value, flags):
+        key = key.encode()
+        header = LOG_HEADER.pack(0, len(key), len(value), flags)[4:]
+        return struct.pack('<I', zlib.crc32(header + key + value)) + header + key + value
+
+    def _write(self, key, value, flags):
+        record = self._record(key, value, flags)
+        os.write(self._fd, record)
+        key_length = len(record) - len(value) - LOG_HEADER.size
+        if old := self._index.pop(key, None):
+            self._dead += old[1] + LOG_HEADER.size + key_length
+        if flags == LOG_PUT:
+            self._index[key] = (self._size + LOG_HEADER.size + key_length, len(value))
+        else:
+            self._dead += len(record)
+        self._size += len(record)
+
+    def _maybe_compact(self):
+        if self._dead > self._compact_min and self._dead > self._size * self._compact_ratio:
+            self.compact(wait=False)
+
+    def _compact(self):
+        compact_path = os.path.join(self._path, 'data.log.compact')
+        fd = os.open(compact_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC | os.O_APPEND)
+        file_id = os.urandom(8)
+        size = os.write(fd, LOG_MAGIC + file_id)
+
+        def copy(key, value, flags):
+            nonlocal size
+            record = self._record(key, value, flags)
+            size += os.write(fd, record)
+            return size - len(value)
+
+        with self._lock:
+            snapshot, end, source = dict(self._index), self._size, self._fd
+        index = {}
+        for key, (offset, length) in snapshot.items():
+            index[key] = (copy(key, os.pread(source, length, offset), LOG_PUT), length)
+
+        with self._lock:
+            self._scan(self._fd, end, self._size, index, copy)
+            os.fsync(fd)
+            os.replace(compact_path, os.path.join(self._path, 'data.log'))
+            os.close(self._fd)
+            self._fd, self._file_id, self._index, self._size, self._dead = fd, file_id, index, size, 0
+            self._write_hint()
+
+    def _read_hint(self):
+        start = len(LOG_MAGIC) + 8
+        hint_path = os.path.join(self._path, 'data.hint')
+        if not os.path.exists(hint_path):
+            return start
+        with open(hint_path, 'rb') as f:
+            hint = f.read()
+        if len(hint) < 32 or hint[:4] != LOG_MAGIC or hint[4:12] != self._file_id \
+                or zlib.crc32(hint[16:]) != struct.unpack_from('<I', hint, 12)[0]:
+            return start
+        covered, self._dead = struct.unpack_from('<QQ', hint, 16)
+        if covered > self._size:
+            return start
+        position = 32
+        while position < len(hint):
+            key_length, offset, length = HINT_ENTRY.unpack_from(hint, position)
+            position += HINT_ENTRY.size
+            self._index[hint[position:position + key_length].decode()] = (offset, length)
+            position += key_length
+        return covered
+
+    def _write_hint(self):
+        entries = []
+        for key, (offset, length) in self._index.items():
+            key = key.encode()
+            entries.append(HINT_ENTRY.pack(len(key), offset, length) + key)
+        body = struct.pack('<QQ', self._size, self._dead) + b''.join(entries)
+        hint_path = os.path.join(self._path, 'data.hint')
+        with open(hint_path + '.tmp', 'wb') as f:
+            f.write(LOG_MAGIC + self._file_id + struct.pack('<I', zlib.crc32(body)) + body)
+        os.replace(hint_path + '.tmp', hint_path)
+
+class ContainerView:
+    def __init__(self, container, prefix):
+        self._container = container
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._container.get(self._prefix + key)
+
+    def set(self, key, value):
+        return self._container.set(self._prefix + key, value)
+
+    def read(self, key, offset, length):
+        return self._container.read(self._prefix + key, offset, length)
+
+    def set_file(self, key, path):
+        return self._container.set_file(self._prefix + key, path)
+
+    def remove(self, key):
+        return self._container.remove(self._prefix + key)
+
+    def size(self, key):
+        return self._container.size(self._prefix + key)
+
+    def keys(self):
+        return [k[len(self._prefix):] for k in self._container.keys() if k.startswith(self._prefix)]
+
+    def __contains__(self, key):
+        return self._prefix + key in self._container
+
 class SimpleKV:
-    def __init__(self, path):
-        self._keyencs = Stream(os.path.join(path, 'keys'))
-        self._data = SimpleFileContainer(path)
+    def __init__(self, path, stream=None, container=None):
+        self._keyencs = (stream or Stream)(os.path.join(path, 'keys'))
+        self._index = None
+        self._data = (container or SimpleFileContainer)(path, stream)
     def set(self, key, value):
         if not isinstance(key, str):
             keyenc = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
         else:
             keyenc = key
         
-        self._keyencs.update({keyenc: key})
+        if keyenc not in self._load_index():
+            self._keyencs.update({keyenc: key})
+            self._index[keyenc] = _as_key(key)
         return self._data.set(keyenc, bson.dumps({'value': value}))
 
     def get(self, key):
@@ -44,18 +354,55 @@ class SimpleKV:
             keyenc = key
         if keyenc in self._data:
             return bson.loads(self._data.get(keyenc))['value']
+
+    def remove(self, key):
+        if not isinstance(key, str):
+            keyenc = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        else:
+            keyenc = key
+        if keyenc in self._load_index():
+            self._keyencs.update({keyenc: False})
+            self._index.pop(keyenc)
+        if keyenc in self._data:
+            self._data.remove(keyenc)
+
+    def size(self, key):
+        if not isinstance(key, str):
+            keyenc = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        else:
+            keyenc = key
+        return self._data.size(keyenc) if keyenc in self._data else 0
     
     def keys(self):
-        return list(set(tuple(v) for _, v in self._keyencs))
+        return list(self._load_index().values())
+
+    def __contains__(self, key):
+        if not isinstance(key, str):
+            key = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        return key in self._load_index()
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {}
+            for k, v in self._keyencs:
+                if v is False:
+                    self._index.pop(k, None)
+                else:
+                    self._index[k] = _as_key(v)
+        return self._index
         
     def _hash(self, data):
         return base64.b64encode(hashlib.blake2s(data).digest(), b'_-')[:-1].decode()
 
 class SimpleKVContainer:
-    def __init__(self, path):
+    def __init__(self, path, stream=None, container=None):
         self._path = path
+        self._stream = stream or Stream
+        self._container = container
+        self._shared = None
         self._data = {}
-        self._keyencs = Stream(os.path.join(path, 'keys1'))
+        self._keyencs = self._stream(os.path.join(path, 'keys1'))
+        self._index = None
         if not os.path.exists(path):
             os.makedirs(path)
 
@@ -68,21 +415,44 @@ class SimpleKVContainer:
         if item := self._data.get(keyenc):
             return item
 
-        item = SimpleKV(os.path.join(self._path, keyenc))
-        self._keyencs.update({keyenc: key})
+        item = SimpleKV(os.path.join(self._path, keyenc), self._stream, self._item_container(keyenc))
+        if keyenc not in self._load_index():
+            self._keyencs.update({keyenc: key})
+            self._index[keyenc] = _as_key(key)
         self._data[keyenc] = item
         return item
     
     def keys(self):
-        return list(tuple(v) for _, v in self._keyencs)
+        return list(self._load_index().values())
+
+    def __contains__(self, key):
+        if not isinstance(key, str):
+            key = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        return key in self._load_index()
+
+    def _item_container(self, keyenc):
+        path = os.path.join(self._path, keyenc)
+        if not getattr(self._container, 'shared', False) or os.path.exists(os.path.join(path, 'data.log')):
+            return self._container
+        if self._shared is None:
+            self._shared = self._container(self._path)
+        os.makedirs(path, exist_ok=True)
+        return lambda path, stream=None: ContainerView(self._shared, keyenc + '/')
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {k: _as_key(v) for k, v in self._keyencs}
+        return self._index
         
     def _hash(self, data):
         return base64.b64encode(hashlib.blake2s(data).digest(), b'_-')[:-1].decode()
+
 class StreamContainer:
-    def __init__(self, path):
+    def __init__(self, path, stream=None):
         self._path = path
-        # self._data = {}
-        self._keyencs = Stream(os.path.join(path, 'keys'))
+        self._stream = stream or Stream
+        self._keyencs = self._stream(os.path.join(path, 'keys'))
+        self._index = None
         if not os.path.exists(path):
             os.makedirs(path)
 
@@ -92,51 +462,561 @@ class StreamContainer:
         else:
             keyenc = key
         
-        # if item := self._data.get(keyenc):
-        #     return item
-        item = Stream(os.path.join(self._path, keyenc), offset)
-        self._keyencs.update({keyenc: key})
-        # self._data[keyenc] = item
+        item = self.peek(keyenc, offset)
+        if keyenc not in self._load_index():
+            self._keyencs.update({keyenc: key})
+            self._index[keyenc] = _as_key(key)
         return item
     
+    def peek(self, key, offset=0):
+        return self._stream(self.path(key), offset)
+
+    def path(self, key):
+        if not isinstance(key, str):
+            key = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        return os.path.join(self._path, key)
+
     def keys(self):
-        return list(v for _, v in self._keyencs)
+        return list(self._load_index().values())
+
+    def __contains__(self, key):
+        if not isinstance(key, str):
+            key = self._hash(ujson.dumps(key, escape_forward_slashes=False).encode())
+        return key in self._load_index()
+
+    def _load_index(self):
+        if self._index is None:
+            self._index = {k: _as_key(v) for k, v in self._keyencs}
+        return self._index
         
     def _hash(self, data):
         return base64.b64encode(hashlib.blake2s(data).digest(), b'_-')[:-1].decode()
 
+def _as_key(key):
+    return tuple(key) if isinstance(key, list) else key
+
+class KeyedExecutor:
+    def __init__(self, workers=4):
+        self._lanes = [ThreadPoolExecutor(1) for _ in range(workers)]
+        self._pending = Counter()
+
+    async def run(self, key, fn, *args):
+        self._pending[key] += 1
+        try:
+            return await asyncio.wrap_future(self._lanes[hash(key) % len(self._lanes)].submit(fn, *args))
+        finally:
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+
+    def submit(self, key, fn, *args):
+        return self._lanes[hash(key) % len(self._lanes)].submit(fn, *args)
+
+    def pending(self, key):
+        return self._pending[key]
+
+    def close(self):
+        for lane in self._lanes:
+            lane.shutdown(wait=True)
+
+class WriteBatch:
+    def __init__(self, writer):
+        self.writer = writer
+        self.closed = False
+
+_current_batch = contextvars.ContextVar('batch', default=None)
+
+class StreamWriter:
+    def __init__(
+        self, max_handles=64, window=0, fsync='never', fsync_interval=1.0, max_pending=2**20, journal=None
+    ):
+        if fsync not in ('never', 'batch', 'interval'):
+            raise ValueError(f"Unknown fsync policy '{fsync}'")
+        self._max_handles = max_handles
+        self._window = window
+        self._fsync = fsync
+        self._fsync_interval = fsync_interval
+        self._max_pending = max_pending
+        self._handles = OrderedDict()
+        self._sizes = {}
+        self._pending = {}
+        self._pending_size = 0
+        self._dirty = set()
+        self._last_fsync = time.time()
+        self._scheduled = None
+        self._lock = threading.RLock()
+        self._replacing = {}
+        self._batch = None
+        self._ended = 0
+        self._turn = None
+        self._settled = None
+        self._commits = 0
+        self._group = None
+        self._undo = {}
+        self._journal = journal
+        self._journal_file = None
+        self._journaled = set()
+        self.file_opens = 0
+        self._opens_lock = threading.Lock()
+        journal and self.recover()
+        _open_writers.add(self)
+
+    def opened(self):
+        with self._opens_lock:
+            self.file_opens += 1
+
+    def append(self, path, content):
+        with self._lock:
+            return self._append(path, content)
+
+    def _append(self, path, content):
+        if path not in self._sizes:
+            self._sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+        self._track(path, 'a')
+        self._pending.setdefault(path, []).append(content)
+        self._pending_size += len(content)
+        self._sizes[path] += len(content)
+
+        if self._pending_size >= self._max_pending or not (self._window or self._batch or self._ended):
+            self.flush()
+        elif self._scheduled is None and not (self._batch or self._ended):
+            try:
+                self._scheduled = asyncio.get_running_loop().call_later(self._window, self.flush)
+            except RuntimeError:
+                self.flush()
+        return self._sizes[path]
+
+    def write(self, path, content):
+        with self._lock:
+            if not (self._batch or self._ended):
+                self._write(path, content)
+                return len(content)
+            self._track(path, 'r')
+            self._pending_size += len(content) - len(self._replacing.get(path, b''))
+            self._replacing[path] = content
+            if self._pending_size >= self._max_pending:
+                self.flush()
+            return len(content)
+
+    def _track(self, path, kind):
+        if self._batch is not None and path not in self._undo:
+            self._undo[path] = ['a', path, self._sizes[path]] if kind == 'a' else ['r', path, os.path.exists(path)]
+
+    @contextmanager
+    def batch(self):
+        with self._lock:
+            if self._batch is not None:
+                yield self._batch
+                return
+            batch = self._begin()
+            try:
+                yield batch
+            finally:
+                self._end(batch)
+                self.commit()
+
+    @asynccontextmanager
+    async def abatch(self, executor):
+        if (batch := _current_batch.get()) is not None and batch.writer is self and not batch.closed:
+            yield batch
+            return
+        if self._turn is None:
+            self._turn, self._settled = asyncio.Lock(), asyncio.Event()
+        try:
+            async with self._turn:
+                batch = self._begin()
+                token = _current_batch.set(batch)
+                try:
+                    yield batch
+                finally:
+                    _current_batch.reset(token)
+                    ended = self._end(batch)
+        finally:
+            if self._window:
+                if self._group is None:
+                    self._group = asyncio.ensure_future(self._commit_later(executor))
+            else:
+                await executor.run(self._journal, self.commit)
+                self._settled.set()
+        while not self._window and self._commits <= ended:
+            self._settled.clear()
+            await self._settled.wait()
+
+    async def _commit_later(self, executor):
+        await asyncio.sleep(self._window)
+        self._group = None
+        await executor.run(self._journal, self.commit)
+
+    def _begin(self):
+        with self._lock:
+            self._batch = WriteBatch(self)
+            return self._batch
+
+    def _end(self, batch):
+        with self._lock:
+            batch.closed = True
+            self._batch = None
+            self._ended += 1
+            return self._commits
+
+    def commit(self):
+        with self._lock:
+            if self._batch is not None:
+                return
+            self._flush(None)
+            if self._journaled:
+                if self._fsync != 'never':
+                    self.sync()
+                self._journal_file.seek(0)
+                self._journal_file.truncate()
+                for path in self._journaled:
+                    if self._undo[path][0] == 'r' and os.path.exists(path + '.undo'):
+                        os.remove(path + '.undo')
+                self._journaled.clear()
+            self._undo.clear()
+            self._ended = 0
+            self._commits += 1
+
+    def recover(self):
+        if not os.path.exists(self._journal):
+            return []
+        with open(self._journal, 'rb') as f:
+            lines = f.read().splitlines()
+        undone = []
+        for line in reversed(lines):
+            try:
+                kind, path, undo = ujson.loads(line)
+            except ValueError:
+                continue
+            if kind == 'a':
+                if os.path.exists(path) and os.path.getsize(path) > undo:
+                    with open(path, 'r+b') as f:
+                        f.truncate(undo)
+            elif os.path.exists(path + '.undo'):
+                os.replace(path + '.undo', path)
+            elif not undo and os.path.exists(path):
+                os.remove(path)
+            undone.append(path)
+        os.remove(self._journal)
+        return undone
+
+    def size(self, path):
+        with self._lock:
+            if path in self._sizes:
+                return self._sizes[path]
+            return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def flush(self, path=None):
+        with self._lock:
+            self._flush(path)
+
+    def _flush(self, path):
+        if path is None:
+            if self._scheduled is not None:
+                self._scheduled.cancel()
+                self._scheduled = None
+            paths = list(self._pending) + list(self._replacing)
+        else:
+            paths = [path] if path in self._pending or path in self._replacing else []
+
+        if self._journal and self._undo:
+            self._record_undo([p for p in paths if p in self._undo and p not in self._journaled])
+
+        for p in paths:
+            if p in self._replacing:
+                content = self._replacing.pop(p)
+                self._pending_size -= len(content)
+                self._write(p, content, p in self._journaled)
+                continue
+            content = b''.join(self._pending.pop(p))
+            self._pending_size -= len(content)
+            f = self._open(p)
+            f.write(content)
+            f.flush()
+            self._dirty.add(p)
+
+        if self._fsync == 'batch' or (
+            self._fsync == 'interval' and time.time() - self._last_fsync >= self._fsync_interval
+        ):
+            self.sync()
+
+    def sync(self):
+        with self._lock:
+            for p in self._dirty:
+                if f := self._handles.get(p):
+                    os.fsync(f.fileno())
+            self._dirty.clear()
+            self._last_fsync = time.time()
+
+    def forget(self, path):
+        with self._lock:
+            self.flush(path)
+            if f := self._handles.pop(path, None):
+                if path in self._dirty and self._fsync != 'never':
+                    os.fsync(f.fileno())
+                f.close()
+            self._dirty.discard(path)
+            self._sizes.pop(path, None)
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.commit()
+            self.flush()
+            for p in list(self._handles):
+                self.forget(p)
+            if self._journal_file:
+                self._journal_file.close()
+                self._journal_file = None
+
+    def _write(self, path, content, shadowed=False):
+        self.opened()
+        target = path + '.tmp' if shadowed else path
+        with open(target, 'wb') as f:
+            f.write(content)
+            if self._fsync != 'never':
+                f.flush()
+                os.fsync(f.fileno())
+        shadowed and os.replace(target, path)
+
+    def _record_undo(self, paths):
+        if not paths:
+            return
+        if self._journal_file is None:
+            self._journal_file = open(self._journal, 'ab')
+        self._journal_file.write(''.join(
+            ujson.dumps(self._undo[p], escape_forward_slashes=False) + '\n' for p in paths).encode())
+        self._journal_file.flush()
+        if self._fsync != 'never':
+            os.fsync(self._journal_file.fileno())
+        for p in paths:
+            if self._undo[p][0] == 'r' and self._undo[p][2] and not os.path.exists(p + '.undo'):
+                os.link(p, p + '.undo')
+        self._journaled.update(paths)
+
+    def _open(self, path):
+        if f := self._handles.get(path):
+            self._handles.move_to_end(path)
+            return f
+        while len(self._handles) >= self._max_handles:
+            p, f = self._handles.popitem(last=False)
+            if p in self._dirty and self._fsync != 'never':
+                os.fsync(f.fileno())
+            self._dirty.discard(p)
+            f.close()
+        self.opened()
+        f = self._handles[path] = open(path, 'ab')
+        return f
+
 class Stream:
-    def __init__(self, path, offset=0):
+    def __init__(self, path, offset=0, writer=None):
         self._path = path
         self._offset = offset
-        # print('', offset)
+        self._position = 0
+        self._writer = writer
 
     def update(self, data):
-        path = self._path + (f'_{self._offset}' if self._offset else '')
-        # print(path)
-        with open(path, 'a') as f:
-            for k, v in data.items():
-                f.write(ujson.dumps([k, v], escape_forward_slashes=False) + '\n')
-        return os.path.getsize(path)
-    
-    def _open_file(self):
-        path = self._path + (f'_{self._offset}' if self._offset else '')
-        self._file = os.path.exists(path) and open(path, 'r')
+        path = self._segment(self._offset)
+        content = ''.join(ujson.dumps([k, v], escape_forward_slashes=False) + '\n' for k, v in data.items()).encode()
+        return self._append(path, content)
+
+    def seek(self, position):
+        self._position = position
         return self
 
+    def size(self):
+        return self._size(self._segment(self._offset))
+
+    def append(self, content):
+        return self._append(self._segment(self._offset), content)
+
+    def remove(self):
+        path = self._segment(self._offset)
+        self._writer and self._writer.forget(path)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def read_bytes(self):
+        path = self._segment(self._offset)
+        self._writer and self._writer.flush(path)
+        if not os.path.exists(path):
+            return b''
+        self._writer and self._writer.opened()
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def rewrite(self, data):
+        path = self._segment(self._offset)
+        self._writer and self._writer.forget(path)
+        tmp = self._sibling(path + '.rewrite')
+        if os.path.exists(tmp._path):
+            os.remove(tmp._path)
+        tmp.append(data) if isinstance(data, bytes) else tmp.update(data)
+        os.replace(tmp._path, path)
+        self._replaced(tmp._path, path)
+        return os.path.getsize(path)
+
     def __iter__(self):
-        self._open_file()
-        return self
+        return (record for _, _, _, record in self.scan())
+
+    def _sibling(self, path):
+        return type(self)(path)
+
+    def scan(self):
+        offset = self._offset
+        while True:
+            path = self._segment(offset)
+            self._writer and self._writer.flush(path)
+            empty = True
+            for position, end, record in self._read(path, self._position if offset == self._offset else 0):
+                empty = False
+                yield offset, position, end, record
+            if empty and offset != self._offset and not os.path.exists(path):
+                return
+            offset += 1
+
+    def _segment(self, offset):
+        return self._path + (f'_{offset}' if offset else '')
+
+    def _size(self, path):
+        if self._writer:
+            return self._writer.size(path)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def _append(self, path, content):
+        if self._writer:
+            return self._writer.append(path, content)
+        with open(path, 'ab') as f:
+            f.write(content)
+        return os.path.getsize(path)
 
-    def __next__(self):
-        if content := self._file and self._file.readline():
-            return tuple(ujson.loads(content))
+    def _replaced(self, old_path, path):
+        pass
+
+    def _read(self, path, position=0):
+        if os.path.exists(path):
+            self._writer and self._writer.opened()
+            with open(path, 'rb') as f:
+                f.seek(position)
+                for line in f:
+                    yield position, position + len(line), tuple(ujson.loads(line))
+                    position += len(line)
+
+FRAME_MAGIC = b'TKF1'
+FRAME_HEADER = struct.Struct('<IIB')
+FRAME_BSON = 0
+FRAME_MSGPACK = 1
+
+class FrameStream(Stream):
+    _framed = OrderedDict()
+    _framed_lock = threading.Lock()
+    max_framed = 4096
+
+    def __init__(self, path, offset=0, writer=None, compression=DEFAULT_POLICY):
+        super().__init__(path, offset, writer)
+        self._compression = compression
+
+    def update(self, data):
+        path = self._segment(self._offset)
+        size = self._size(path)
+        if size and not self._is_framed(path):
+            return super().update(data)
+        content = b''.join(self.encode_frame(k, v, self._compression) for k, v in data.items())
+        if not size:
+            content = FRAME_MAGIC + content
+            self._remember(path, True)
+        return self._append(path, content)
+
+    def remove(self):
+        super().remove()
+        with FrameStream._framed_lock:
+            FrameStream._framed.pop(self._segment(self._offset), None)
+
+    def frames(self):
+        path = self._segment(self._offset)
+        self._writer and self._writer.flush(path)
+        if os.path.exists(path) and self._is_framed(path):
+            yield from self._frames(path, self._position)
+
+    def _frames(self, path, position=0):
+        self._writer and self._writer.opened()
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size <= len(FRAME_MAGIC):
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                position = max(position, len(FRAME_MAGIC))
+                while position + FRAME_HEADER.size <= len(view):
+                    length, crc, flags = FRAME_HEADER.unpack_from(view, position)
+                    start = position + FRAME_HEADER.size
+                    with view[start:start + length] as payload:
+                        if len(payload) < length or zlib.crc32(payload) != crc:
+                            return
+                        yield position, flags, payload
+                    position = start + length
+
+    def _read(self, path, position=0):
+        if not os.path.exists(path):
+            return
+        if not self._is_framed(path):
+            yield from super()._read(path, position)
+            return
+        for position, flags, payload in self._frames(path, position):
+            yield position, position + FRAME_HEADER.size + len(payload), self.decode_frame(flags, payload)
+
+    def _sibling(self, path):
+        return FrameStream(path, compression=self._compression)
+
+    def _replaced(self, old_path, path):
+        with FrameStream._framed_lock:
+            framed = FrameStream._framed.pop(old_path, True)
+        self._remember(path, framed)
+
+    def _is_framed(self, path):
+        with FrameStream._framed_lock:
+            if (framed := FrameStream._framed.get(path)) is not None:
+                FrameStream._framed.move_to_end(path)
+                return framed
+        with open(path, 'rb') as f:
+            framed = f.read(len(FRAME_MAGIC)) == FRAME_MAGIC
+        self._remember(path, framed)
+        return framed
+
+    def _remember(self, path, framed):
+        with FrameStream._framed_lock:
+            FrameStream._framed[path] = framed
+            FrameStream._framed.move_to_end(path)
+            while len(FrameStream._framed) > self.max_framed:
+                FrameStream._framed.popitem(last=False)
+
+    @staticmethod
+    def encode_frame(key, value, compression=DEFAULT_POLICY):
+        if msgpack:
+            flags, payload = FRAME_MSGPACK, msgpack.packb([key, value], use_bin_type=True)
         else:
-            self._file and self._file.close()
-            self._offset += 1
-            self._open_file()
-            if content := self._file and self._file.readline():
-                return tuple(ujson.loads(content))
-            self._offset -= 1
-            raise StopIteration
-        
\ No newline at end of file
+            flags, payload = FRAME_BSON, bson.dumps({'k': key, 'v': value})
+        codec, payload = compression.encode(payload) if compression else (NONE, payload)
+        flags |= codec << 4
+        return FRAME_HEADER.pack(len(payload), zlib.crc32(payload), flags) + payload
+
+    @staticmethod
+    def decode_frame(flags, payload):
+        if flags >> 4:
+            payload = decompress(bytes(payload), flags >> 4)
+        if flags & 0x0f == FRAME_MSGPACK:
+            if not msgpack:
+                raise ImportError('msgpack is required to read this stream')
+            return tuple(msgpack.unpackb(payload, raw=False, strict_map_key=False))
+        record = bson.loads(bytes(payload))
+        return record['k'], record['v']
+
+STREAM_FORMATS = {
+    'jsonl': Stream,
+    'frames': FrameStream,
+}
+
+BACKENDS = {
+    'files': SimpleFileContainer,
+    'log': LogFileContainer,
+}
@@ -0,0 +1,87 @@
+import os
+import base64
+import asyncio
+import inspect
+
+def event_kind(changes):
+    kind = 'update'
+    for _, diff in changes:
+        if isinstance(diff, dict):
+            if 'children' in diff:
+                return 'children'
+            if 'value' in diff:
+                kind = 'set' if diff['value'] is not None else 'remove'
+            elif 'metadata' in diff and kind == 'update':
+                kind = 'metadata'
+    return kind
+
+class Subscription:
+    def __init__(self, sub_id, key, callback, recursive, on_error=None):
+        self.id = sub_id
+        self.key = key
+        self.callback = callback
+        self.recursive = recursive
+        self.forwarded = []
+        self._on_error = on_error
+        self._pending = {}
+        self._task = None
+
+    def push(self, key, timestamp, kind):
+        self._pending[key] = [list(key[1:]), timestamp, kind]
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._deliver())
+
+    async def _deliver(self):
+        try:
+            while self._pending:
+                events, self._pending = list(self._pending.values()), {}
+                out = self.callback(events)
+                if inspect.isawaitable(out):
+                    await out
+        except Exception:
+            self._pending = {}
+            self._on_error and self._on_error(self.id)
+        finally:
+            self._task = None
+
+class Subscriptions:
+    def __init__(self, owner_id, on_error=None):
+        self._owner_id = owner_id
+        self._on_error = on_error or self.remove
+        self._subs = {}
+        self._by_id = {}
+
+    def add(self, key, callback, recursive=True):
+        sub_id = self._owner_id + ':' + base64.b64encode(os.urandom(6), b'_-').decode()
+        sub = Subscription(sub_id, key, callback, recursive, self._on_error)
+        self._subs.setdefault(key, {})[sub_id] = sub
+        self._by_id[sub_id] = sub
+        return sub
+
+    def get(self, sub_id):
+        return self._by_id.get(sub_id)
+
+    def remove(self, sub_id):
+        if (sub := self._by_id.pop(sub_id, None)) is not None:
+            self._subs[sub.key].pop(sub_id)
+            if not self._subs[sub.key]:
+                self._subs.pop(sub.key)
+        return sub
+
+    def covering(self, key):
+        for i in range(len(key), 0, -1):
+            for sub in list(self._subs.get(key[:i], {}).values()):
+                if sub.recursive or i == len(key):
+                    yield sub
+
+    def within(self, key):
+        for sub_key, subs in list(self._subs.items()):
+            if sub_key[:len(key)] == key:
+                yield from list(subs.values())
+
+    def publish(self, key, timestamp, kind):
+        for sub in self.covering(key):
+            sub.push(key, timestamp, kind)
+
+    def __len__(self):
+        return len(self._by_id)
@@ -1,101 +1,536 @@
 import os
+import math
 import time
+import struct
 import ujson
-from .storage import StreamContainer, SimpleKVContainer
+import asyncio
+import logging
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict
+from itertools import islice, chain
+from .storage import Stream, StreamContainer, SimpleKVContainer, KeyedExecutor
+from .checkpoint import SizePolicy
+from .compression import DEFAULT_POLICY, encode_tagged, decode_tagged
+from .metrics import Histogram
+
+logger = logging.getLogger(__name__)
+
+INDEX_ENTRY = struct.Struct('<dqqq')
+
+class TimeIndex:
+    def __init__(self, stream, checkpoints=(), persist_every=64):
+        self._stream = stream
+        self.checkpoints = sorted(checkpoints)
+        self.timestamps = array('d')
+        self.segments = array('q')
+        self.positions = array('q')
+        self.ends = array('q')
+        self.stats = None
+        self.persist_every = persist_every
+        self._persisted = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def load(self):
+        content = self._stream.read_bytes()
+        for entry in INDEX_ENTRY.iter_unpack(content[:len(content) - len(content) % INDEX_ENTRY.size]):
+            self._add(*entry)
+        self._persisted = len(self)
+        return not len(content) % INDEX_ENTRY.size
+
+    def tail(self):
+        if not self.timestamps:
+            return 0, 0
+        if self.positions[-1] >= 0:
+            return self.segments[-1], self.ends[-1]
+        return self.segments[-1] + 1, 0
+
+    def behind(self, size):
+        if not self.timestamps:
+            return not self.checkpoints
+        segment, position = self.tail()
+        return segment < len(self.checkpoints) or segment == len(self.checkpoints) and position <= size
+
+    def catch_up(self, records):
+        for segment, position, end, (t, _) in records:
+            self._add(t, segment, position, end)
+
+    def count(self, timestamp):
+        return bisect_right(self.timestamps, timestamp)
+
+    def append(self, timestamp, segment, position, end):
+        self._add(timestamp, segment, position, end)
+        if len(self) - self._persisted >= self.persist_every:
+            self.persist()
+
+    def persist(self):
+        if self._persisted < len(self):
+            self._stream.append(b''.join(INDEX_ENTRY.pack(
+                self.timestamps[i], self.segments[i], self.positions[i], self.ends[i]
+            ) for i in range(self._persisted, len(self))))
+            self._persisted = len(self)
+
+    def rebuild(self, records, versions=()):
+        entries = [(t, segment, position, end) for segment, position, end, (t, _) in records]
+        logged = {t for t, *_ in entries}
+        entries += [(t, bisect_left(self.checkpoints, t), -1, -1) for t in versions if t not in logged]
+        entries.sort(key=lambda e: e[0])
+        for name in ('timestamps', 'segments', 'positions', 'ends'):
+            del getattr(self, name)[:]
+        for entry in entries:
+            self._add(*entry)
+        self._stream.rewrite(b''.join(INDEX_ENTRY.pack(*e) for e in entries))
+        self._persisted = len(self)
+
+    def _add(self, timestamp, segment, position, end):
+        self.timestamps.append(timestamp)
+        self.segments.append(segment)
+        self.positions.append(position)
+        self.ends.append(end)
 
 class TimetravelerKV:
-    def __init__(self, path):
-        self.checkpoints = SimpleKVContainer(os.path.join(path, 'checkpoints'))
-        self.log = StreamContainer(path)
+    def __init__(
+        self, path, stream=None, container=None, policy=None, max_indexes=4096, cache_bytes=2**26, executor=None,
+        compression=DEFAULT_POLICY
+    ):
+        self.checkpoints = SimpleKVContainer(os.path.join(path, 'checkpoints'), stream, container)
+        self.log = StreamContainer(path, stream)
+        self.policy = policy or SizePolicy()
+        self.max_indexes = max_indexes
+        self.cache_bytes = cache_bytes
+        self._stream = stream or Stream
+        self._indexes = OrderedDict()
+        self._latest = OrderedDict()
+        self._latest_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._scheduled = set()
+        self._executor = executor
+        self._compression = compression
+        self._locks = [threading.RLock() for _ in range(64)]
+        self._guard = threading.Lock()
+        self.replays = Histogram()
+        self.checkpoint_writes = 0
+        self.listeners = []
     
     def list_versions(self, key, timestamp=None):
-        # timestamp = timestamp or time.time()
-        # ignore_fields = ignore_fields or []
-        # return [t for t, i in self.log.get(key) if t < timestamp 
-        #         and not all(['u' in x[0] and all(y in ignore_fields for y in x[1]) for x in i])]
-        timestamp = timestamp or time.time()
-        
-        checkpoints = self.checkpoints.get(key)
-        
-        checkpoints_timestamps_tuples = [t for t in checkpoints.keys() if t[0] <= timestamp]
-        
-        if checkpoints_timestamps_tuples:
-            checkpoint_versions = ujson.loads(checkpoints.get(checkpoints_timestamps_tuples[-1]).decode())[0]
-            offset = len(checkpoints_timestamps_tuples)
-            last_checkpoint_timestamp = checkpoints_timestamps_tuples[-1][0]
-        else:
-            checkpoint_versions = []
-            offset = 0
-            last_checkpoint_timestamp = 0
-        
-        new_versions = [t for t, _ in self.log.get(key, offset) if last_checkpoint_timestamp < t <= timestamp]
-        return checkpoint_versions + new_versions
+        timestamp = timestamp or math.inf
+        with self._locked(key):
+            index = self._index(key)
+            return index.timestamps[:index.count(timestamp)].tolist()
+
+    def last_version(self, key, timestamp=None):
+        with self._locked(key):
+            index = self._index(key)
+            count = index.count(timestamp or math.inf)
+            return index.timestamps[count - 1] if count else None
+
+    def changes_since(self, key, timestamp):
+        with self._locked(key):
+            index = self._index(key)
+            start = index.count(timestamp)
+            logged = [i for i in range(start, len(index)) if index.positions[i] >= 0]
+            records = {}
+            if logged:
+                stream = self.log.peek(key, index.segments[logged[0]]).seek(index.positions[logged[0]])
+                records = dict(islice(stream, len(logged)))
+            return [(t, records.get(t, [])) for t in index.timestamps[start:].tolist()]
+
+    async def aget(self, key, timestamp=None):
+        return await self._run(key, timestamp is None and key in self._latest, self.get, key, timestamp)
+
+    async def aset(self, key, changes):
+        timestamp = await self._run(key, False, self._set, key, changes)
+        self._notify(key, timestamp, changes)
+        return timestamp
+
+    async def alast_version(self, key, timestamp=None):
+        return await self._run(key, key in self._indexes, self.last_version, key, timestamp)
+
+    async def alist_versions(self, key, timestamp=None):
+        return await self._run(key, key in self._indexes, self.list_versions, key, timestamp)
+
+    async def aupdate(self, key, fn):
+        timestamp, changes, value = await self._run(key, False, self._update, key, fn)
+        self._notify(key, timestamp, changes)
+        return value
+
+    async def aiter(self, key, timestamp=0):
+        for t, changes in await self._run(key, False, self.changes_since, key, timestamp):
+            yield t, changes
+
+    async def aexport(self, key):
+        return await self._run(key, False, self.export, key)
+
+    async def arestore(self, key, history):
+        return await self._run(key, False, self.restore, key, history)
+
+    async def adrop(self, key):
+        return await self._run(key, False, self.drop, key)
+
+    async def _run(self, key, cheap, fn, *args):
+        if self._executor is None:
+            self._executor = KeyedExecutor()
+        lock = self._locked(key)
+        if cheap and not self._executor.pending(key) and lock.acquire(blocking=False):
+            try:
+                return fn(*args)
+            finally:
+                lock.release()
+        return await self._executor.run(key, fn, *args)
 
     def list(self):
         return list(self.log.keys())
 
+    def references(self, field='value', horizon=None, pins=()):
+        timelines, pins = {}, list(pins)
+        for key in self.list():
+            with self._locked(key):
+                timeline = timelines[key] = []
+                for t, change in chain(self._snapshots(key, field), self.log.get(key)):
+                    for mode, diff in change:
+                        if not isinstance(diff, dict):
+                            continue
+                        if mode == 'u' and field in diff:
+                            timeline.append((t, diff[field]))
+                        if isinstance(diff.get('branches'), dict):
+                            pins += [
+                                ((b['origin_id'], *b['origin_key']), b['origin_timestamp'])
+                                for b in diff['branches'].values() if isinstance(b, dict) and b.get('origin_id')]
+
+        counts = Counter()
+        for key, timeline in timelines.items():
+            times = [t for t, _ in timeline]
+            start = max(bisect_right(times, horizon) - 1, 0) if horizon else 0
+            counts.update(value for _, value in timeline[start:] if value is not None)
+            for prefix, t in pins:
+                if key[:len(prefix)] == prefix and (i := bisect_right(times, t)) and timeline[i - 1][1] is not None:
+                    counts[timeline[i - 1][1]] += 1
+        return counts
+
     def get(self, key, timestamp=None):
-        timestamp = timestamp or time.time()
-        
-        # if origin_tuple and timestamp <= origin_tuple[0]:
-        #     return origin_tuple[1](timestamp)
+        with self._locked(key):
+            return self._get(key, timestamp)
 
-        checkpoints = self.checkpoints.get(key)
-        # print(time.time()- timestamp)
-        
-        checkpoint_timestamps = sorted([t for t, in checkpoints.keys() if t <= timestamp])
-        # print(time.time()- timestamp)
-
-
-        
-        # if checkpoints or not origin_tuple:
-        # last_checkpoint_timestamp = (sorted(c for c in checkpoints if c <= timestamp) or [0])[-1]
-        # value = last_checkpoint_timestamp and checkpoints[last_checkpoint_timestamp] or None
-        if checkpoint_timestamps:
-            value = ujson.loads(checkpoints.get((checkpoint_timestamps[-1],)).decode())[1]
-            offset = len(checkpoint_timestamps)
-            last_checkpoint_timestamp = checkpoint_timestamps[-1]
-        else:
-            value = None
-            offset = 0
-            last_checkpoint_timestamp = 0
-        # print(time.time()- timestamp)
-        # else:
-        #     last_checkpoint_timestamp = origin_tuple[0]
-        #     value = await origin_tuple[1](last_checkpoint_timestamp)
-        #     checkpoints.update({last_checkpoint_timestamp: value})
-        #     self.checkpoints[key] = checkpoints
-
-
-        changes = self.log.get(key, offset)
-        for t, change in changes:
-            if last_checkpoint_timestamp < t <= timestamp:
-                for mode, diff in change:
-                    value = self._recursive_update(mode, value, diff)
-        # print(time.time()- timestamp)
+    def _get(self, key, timestamp):
+        index = self._index(key)
+        latest = timestamp is None or bool(index.timestamps) and timestamp >= index.timestamps[-1]
+        with self._guard:
+            if cached := latest and self._latest.get(key):
+                self._hits += 1
+                self._latest.move_to_end(key)
+        if cached:
+            return ujson.loads(ujson.dumps(cached[0]))
+
+        timestamp = timestamp or math.inf
+        t0 = time.time()
+
+        _, value, replayed = self._replay(key, timestamp)
+        self.replays.observe(replayed)
+
+        if latest:
+            with self._guard:
+                self._misses += 1
+            stats = self.stats(key)
+            stats['replayed'] = replayed
+            stats['replay_time'] = time.time() - t0
+            stats['replay_total'] += stats['replay_time']
+            if index.timestamps:
+                encoded = ujson.dumps(value)
+                self._cache(key, ujson.loads(encoded), len(encoded))
+            self._consider(key)
         return value
                 
     def set(self, key, changes):
+        timestamp = self._set(key, changes)
+        self._notify(key, timestamp, changes)
+        return timestamp
+
+    def _set(self, key, changes):
+        with self._locked(key):
+            return self._append(key, changes)
+
+    def update(self, key, fn):
+        timestamp, changes, value = self._update(key, fn)
+        self._notify(key, timestamp, changes)
+        return value
+
+    def _update(self, key, fn):
+        with self._locked(key):
+            changes = fn(self._get(key, None))
+            timestamp = self._append(key, changes)
+            return timestamp, changes, self._get(key, None)
+
+    def _notify(self, key, timestamp, changes):
+        for listener in self.listeners:
+            listener(key, timestamp, changes)
+
+    def _append(self, key, changes):
+        index = self._index(key)
+        stats = self.stats(key)
         timestamp = time.time()
+        if index.timestamps and timestamp <= index.timestamps[-1]:
+            timestamp = math.nextafter(index.timestamps[-1], math.inf)
 
-        offset = len(self.checkpoints.get(key).keys()) if key in self.checkpoints.keys() else 0
-        # print(offset)
-        log = self.log.get(key, offset)
+        segment = len(index.checkpoints)
+        log = self.log.get(key, segment)
+        position = log.size()
         size = log.update({timestamp: changes})
+        index.append(timestamp, segment, position, size)
 
-        if size > 1_000_000:
-            checkpoint = self.get(key)
-            self.checkpoints.get(key).set((timestamp,), ujson.dumps([self.list_versions(key), checkpoint]).encode())
+        with self._guard:
+            if (cached := self._latest.pop(key, None)) is not None:
+                self._latest_bytes -= cached[1]
+        if cached is not None:
+            value = cached[0]
+            for mode, diff in ujson.loads(ujson.dumps(changes)):
+                value = self._recursive_update(mode, value, diff)
+            self._cache(key, value, len(ujson.dumps(value)))
 
+        stats['size'] = size
+        stats['records'] += 1
+        self._consider(key)
         return timestamp
-        # self.log[key] = log
-        
-        # checkpoints = self.checkpoints.get(key) or {}
-        # last_checkpoint_timestamp = (sorted(c for c in checkpoints if c <= timestamp) or [0])[-1]
-        
-        # if len([t for t in checkpoints if t > last_checkpoint_timestamp]) > 100:
-        #     checkpoints.update({timestamp: value})
-        #     self.checkpoints[key] = checkpoints
+
+    def checkpoint(self, key):
+        with self._locked(key):
+            self._checkpoint(key)
+
+    def _checkpoint(self, key):
+        self._scheduled.discard(key)
+        t0 = time.time()
+
+        versions, value, replayed = self._replay(key, math.inf, True)
+        if not replayed:
+            return
+        self.checkpoints.get(key).set((versions[-1],), self._dump_checkpoint(versions, value))
+        self.checkpoint_writes += 1
+        index = self._index(key)
+        index.persist()
+        index.checkpoints.append(versions[-1])
+        index.stats = self._new_stats(time.time() - t0)
+
+    def compact(self, key, retained):
+        with self._locked(key):
+            return self._compact(key, retained)
+
+    async def acompact(self, key, retained):
+        return await self._run(key, False, self.compact, key, retained)
+
+    def _compact(self, key, retained):
+        index = self._index(key)
+        cutoff = retained[-1]
+        count = index.count(cutoff)
+        if count <= len(retained):
+            return 0
+
+        checkpoints = self.checkpoints.get(key)
+        before = self._footprint(key, checkpoints, index)
+        kept = [c for c in index.checkpoints if c > cutoff]
+        versions = retained + index.timestamps[count:].tolist()
+        history = {'checkpoints': [
+            [t, retained[:i + 1], self._replay(key, t)[1]] for i, t in enumerate(retained)
+        ] + [
+            [c, versions[:bisect_right(versions, c)], self._load_checkpoint(checkpoints.get((c,)))[1]] for c in kept
+        ], 'records': []}
+        logged = [i for i in range(count, len(index)) if index.positions[i] >= 0]
+        if logged:
+            stream = self.log.peek(key, index.segments[logged[0]]).seek(index.positions[logged[0]])
+            history['records'] = [[t, change] for _, _, _, (t, change) in islice(stream.scan(), len(logged))]
+
+        pending = self.log.path(key) + '.compact'
+        with open(pending + '.tmp', 'wb') as f:
+            f.write(ujson.dumps(history).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pending + '.tmp', pending)
+        self._write_history(key, history)
+        os.remove(pending)
+        return before - self._footprint(key, checkpoints, self._index(key))
+
+    def export(self, key):
+        with self._locked(key):
+            index = self._index(key)
+            checkpoints = index.checkpoints and self.checkpoints.get(key)
+            history = {
+                'checkpoints': [[t, *self._load_checkpoint(checkpoints.get((t,)))] for t in index.checkpoints],
+                'records': [[t, change] for _, _, _, (t, change) in self.log.peek(key).scan()],
+            }
+            values = Counter()
+            for _, change in chain(self._snapshots(key, 'value'), history['records']):
+                for mode, diff in change:
+                    if mode == 'u' and diff.get('value') is not None:
+                        values[diff['value']] += 1
+            history['values'] = dict(values)
+            return history
+
+    def restore(self, key, history):
+        with self._locked(key):
+            self._write_history(key, history)
+            return len(self._index(key))
+
+    def _write_history(self, key, history):
+        self._drop(key)
+        timestamps = [t for t, _, _ in history['checkpoints']]
+        segments = {segment: {} for segment in range(len(timestamps) + 1)}
+        for t, change in history['records']:
+            segments[bisect_left(timestamps, t)][t] = change
+        for t, versions, value in history['checkpoints']:
+            self.checkpoints.get(key).set((t,), self._dump_checkpoint(versions, value))
+            self.checkpoint_writes += 1
+        for segment, records in segments.items():
+            self.log.get(key, segment).rewrite(records)
+
+    def drop(self, key):
+        with self._locked(key):
+            self._drop(key)
+
+    def _drop(self, key):
+        checkpoints = key in self.checkpoints and self.checkpoints.get(key)
+        timestamps = [t for t, in checkpoints.keys()] if checkpoints else []
+        for segment in range(len(timestamps) + 1):
+            self.log.peek(key, segment).remove()
+        for t in timestamps:
+            checkpoints.remove((t,))
+        self._stream(self.log.path(key) + '.tidx').remove()
+        with self._guard:
+            self._indexes.pop(key, None)
+            if (cached := self._latest.pop(key, None)) is not None:
+                self._latest_bytes -= cached[1]
+        self._scheduled.discard(key)
+
+    def cache_info(self):
+        return {'hits': self._hits, 'misses': self._misses, 'entries': len(self._latest), 'bytes': self._latest_bytes}
+
+    def stats(self, key):
+        index = self._index(key)
+        if index.stats is None:
+            segment = len(index.checkpoints)
+            index.stats = self._new_stats()
+            index.stats['records'] = len(index) - bisect_left(index.segments, segment)
+            index.stats['size'] = index.ends[-1] if len(index) and index.segments[-1] == segment else 0
+        return index.stats
+
+    def _new_stats(self, checkpoint_cost=0):
+        return {
+            'size': 0, 'records': 0, 'since': time.time(), 'replayed': 0, 'replay_time': 0,
+            'replay_total': 0, 'checkpoint_cost': checkpoint_cost
+        }
+
+    def _consider(self, key):
+        if key in self._scheduled or not self.policy.should_checkpoint(self.stats(key)):
+            return
+        self._scheduled.add(key)
+        if self._executor is None:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return self.checkpoint(key)
+            self._executor = KeyedExecutor()
+        self._executor.submit(key, self._deferred_checkpoint, key)
+
+    def _deferred_checkpoint(self, key):
+        try:
+            self.checkpoint(key)
+        except Exception:
+            logger.exception('Checkpoint of %s failed', key)
+
+    def _snapshots(self, key, field):
+        index = self._index(key)
+        for i in range(len(index)):
+            if index.positions[i] < 0:
+                t = index.timestamps[i]
+                state = self._load_checkpoint(self.checkpoints.get(key).get((t,)))[1]
+                if isinstance(state, dict) and field in state:
+                    yield t, [('u', {field: state[field]})]
+
+    def _footprint(self, key, checkpoints, index):
+        return (
+            sum(self.log.peek(key, segment).size() for segment in range(len(index.checkpoints) + 1)) +
+            sum(checkpoints.size((c,)) for c in index.checkpoints)
+        )
+
+    def _dump_checkpoint(self, versions, value):
+        return encode_tagged(ujson.dumps([versions, value]).encode(), self._compression)
+
+    def _load_checkpoint(self, data):
+        return ujson.loads(decode_tagged(data))
+
+    def _cache(self, key, value, size):
+        with self._guard:
+            self._latest[key] = (value, size)
+            self._latest_bytes += size
+            while self._latest_bytes > self.cache_bytes and self._latest:
+                self._latest_bytes -= self._latest.popitem(last=False)[1][1]
+
+    def _locked(self, key):
+        return self._locks[hash(key) % len(self._locks)]
+
+    def _index(self, key):
+        with self._guard:
+            if (index := self._indexes.get(key)) is not None:
+                self._indexes.move_to_end(key)
+                return index
+
+        if os.path.exists(pending := self.log.path(key) + '.compact'):
+            with open(pending, 'rb') as f:
+                self._write_history(key, ujson.loads(f.read()))
+            os.remove(pending)
+
+        checkpoints = key in self.checkpoints and self.checkpoints.get(key)
+        index = TimeIndex(self._stream(self.log.path(key) + '.tidx'), (t for t, in checkpoints.keys()) if checkpoints else ())
+        intact = index.load()
+        if intact and index.behind(self.log.peek(key, len(index.checkpoints)).size()):
+            segment, position = index.tail()
+            index.catch_up(self.log.peek(key, segment).seek(position).scan())
+        else:
+            versions = []
+            if index.checkpoints:
+                versions = self._load_checkpoint(checkpoints.get((index.checkpoints[-1],)))[0]
+            index.rebuild(self.log.peek(key).scan(), versions)
+
+        with self._guard:
+            self._indexes[key] = index
+        self._evict(key)
+        return index
+
+    def _evict(self, current):
+        while True:
+            with self._guard:
+                if len(self._indexes) <= self.max_indexes:
+                    return
+                for key in self._indexes:
+                    if key != current and (lock := self._locked(key)).acquire(blocking=False):
+                        break
+                else:
+                    return
+                index = self._indexes.pop(key)
+            try:
+                index.persist()
+            finally:
+                lock.release()
+
+    def _replay(self, key, timestamp, with_versions=False):
+        index = self._index(key)
+        count = index.count(timestamp)
+        segment = bisect_right(index.checkpoints, timestamp)
+
+        value = None
+        if segment:
+            _, value = self._load_checkpoint(self.checkpoints.get(key).get((index.checkpoints[segment - 1],)))
+
+        start = bisect_left(index.segments, segment, 0, count)
+        logged = [i for i in range(start, count) if index.positions[i] >= 0]
+        if logged:
+            for _, change in islice(self.log.peek(key, segment).seek(index.positions[logged[0]]), len(logged)):
+                for mode, diff in change:
+                    value = self._recursive_update(mode, value, diff)
+
+        versions = index.timestamps[:count].tolist() if with_versions else None
+        return versions, value, len(logged)
     
     def _recursive_update(self, mode, old_value, diff):
         if mode[0] == 'u':
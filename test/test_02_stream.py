@@ -0,0 +1,120 @@
+import asyncio
+import gc
+import os
+import weakref
+import pytest
+import ujson
+
+from telekinesis_data import storage
+from telekinesis_data.storage import Stream, StreamWriter, FrameStream
+from telekinesis_data.timetravel import TimetravelerKV
+from telekinesis_data.migrate import migrate, compact_keys
+
+
+def test_stream_writer(tmp_path):
+    writer = StreamWriter(max_handles=2, fsync='batch')
+    streams = [Stream(str(tmp_path / f's{i}'), writer=writer) for i in range(3)]
+
+    for i, stream in enumerate(streams):
+        size = stream.update({'a': i, 'b': [i]})
+        assert size == os.path.getsize(str(tmp_path / f's{i}'))
+
+    assert len(writer._handles) == 2
+    assert list(streams[1]) == [('a', 1), ('b', [1])]
+
+    streams[0].update({'c': 0})
+    assert list(streams[0]) == [('a', 0), ('b', [0]), ('c', 0)]
+    writer.close()
+    assert not writer._handles
+
+    writer = StreamWriter(window=1)
+    Stream(str(tmp_path / 'released'), writer=writer).update({'a': 1})
+    ref = weakref.ref(writer)
+    del writer
+    gc.collect()
+    assert ref() is None
+    assert list(Stream(str(tmp_path / 'released'))) == [('a', 1)]
+
+
+@pytest.mark.asyncio
+async def test_stream_writer_group_commit(tmp_path):
+    path = str(tmp_path / 's')
+    writer = StreamWriter(window=0.05)
+    stream = Stream(path, writer=writer)
+
+    sizes = [stream.update({str(i): i}) for i in range(10)]
+
+    assert not os.path.exists(path)
+    assert sizes == sorted(sizes) and writer.size(path) == sizes[-1]
+
+    await asyncio.sleep(0.1)
+    assert os.path.getsize(path) == sizes[-1]
+
+    stream.update({'x': None})
+    assert list(stream)[-1] == ('x', None)
+    writer.close()
+
+
+@pytest.mark.parametrize('use_msgpack', [True, False])
+def test_frame_stream(tmp_path, monkeypatch, use_msgpack):
+    if not use_msgpack:
+        monkeypatch.setattr(storage, 'msgpack', None)
+    path = str(tmp_path / 's')
+    stream = FrameStream(path, writer=StreamWriter())
+
+    stream.update({1.5: [['u', {'metadata': {'a': 1}}]], 2.5: None})
+    FrameStream(path, 1).update({3.5: 'x'})
+
+    assert list(stream) == [(1.5, [['u', {'metadata': {'a': 1}}]]), (2.5, None), (3.5, 'x')]
+
+    positions = [p for p, _, _ in stream.frames()]
+    assert list(FrameStream(path).seek(positions[1])) == [(2.5, None), (3.5, 'x')]
+
+    with open(path, 'ab') as f:
+        f.write(b'\x10\x00\x00')
+    assert len(list(FrameStream(path))) == 3
+
+    monkeypatch.setattr(FrameStream, 'max_framed', 2)
+    for i in range(4):
+        FrameStream(str(tmp_path / f'f{i}')).update({'a': i})
+    assert len(FrameStream._framed) == 2
+    FrameStream(str(tmp_path / 'f3')).remove()
+    assert str(tmp_path / 'f3') not in FrameStream._framed
+
+
+def test_migrate(tmp_path):
+    path = str(tmp_path / 'meta')
+    kv = TimetravelerKV(path)
+    for i in range(3):
+        kv.set(('b', 'x'), [('u', {'value': i})])
+    versions = kv.list_versions(('b', 'x'))
+    kv.checkpoints.get(('b', 'x')).set((versions[-1],), ujson.dumps([versions, kv.get(('b', 'x'))]).encode())
+
+    assert migrate(str(tmp_path)) == 5
+    assert migrate(str(tmp_path)) == 0
+
+    framed = TimetravelerKV(path, FrameStream)
+    assert framed.get(('b', 'x')) == {'value': 2}
+    framed.set(('b', 'x'), [('u', {'value': 3})])
+    assert framed.get(('b', 'x')) == {'value': 3}
+    assert len(framed.list_versions(('b', 'x'))) == 4
+
+
+def test_key_indexes(tmp_path):
+    path = str(tmp_path / 'meta')
+    for _ in range(2):
+        kv = TimetravelerKV(path)
+        for i in range(3):
+            kv.set(('b', 'x'), [('u', {'value': i})])
+            kv.get(('b', 'x'))
+            assert ('b', 'x') in kv.log and ('b', 'y') not in kv.log
+            assert kv.list() == [('b', 'x')]
+
+    assert len(list(Stream(os.path.join(path, 'keys')))) == 1
+    assert not os.path.exists(os.path.join(path, 'checkpoints', 'keys1'))
+
+    with open(os.path.join(path, 'keys'), 'a') as f:
+        f.write(ujson.dumps([kv.log._hash(b'["b","x"]'), ['b', 'x']]) + '\n')
+    assert compact_keys(str(tmp_path)) > 0
+    assert compact_keys(str(tmp_path)) == 0
+    assert TimetravelerKV(path).list() == [('b', 'x')]
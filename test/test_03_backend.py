@@ -0,0 +1,86 @@
+import asyncio
+import os
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+from telekinesis_data.storage import LogFileContainer, SimpleKV
+
+BROKER_PORT = 8803
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+def test_log_container(tmp_path):
+    path = str(tmp_path / 'log')
+    c = LogFileContainer(path)
+    c.set('a', b'1')
+    c.set('b', b'22')
+    c.set('a', b'333')
+    c.remove('b')
+
+    assert c.get('a') == b'333' and 'b' not in c and c.keys() == ['a']
+    c.close()
+
+    with open(os.path.join(path, 'data.log'), 'ab') as f:
+        f.write(b'\x01\x02\x03')
+    os.remove(os.path.join(path, 'data.hint'))
+
+    c = LogFileContainer(path)
+    assert c.get('a') == b'333' and c.keys() == ['a']
+    c.set('c', b'4')
+    size = os.path.getsize(os.path.join(path, 'data.log'))
+    c.compact()
+    assert os.path.getsize(os.path.join(path, 'data.log')) < size
+    assert c.get('a') == b'333' and c.get('c') == b'4'
+    c.set('a', b'5')
+    c.close()
+
+    c = LogFileContainer(path)
+    assert sorted(c.keys()) == ['a', 'c'] and c.get('a') == b'5'
+
+
+def test_log_simple_kv(tmp_path):
+    kv = SimpleKV(str(tmp_path / 'kv'), container=LogFileContainer)
+    kv.set(('x', 'y'), 'owner')
+    assert kv.get(('x', 'y')) == 'owner' and kv.get(('x',)) is None
+    assert sorted(os.listdir(str(tmp_path / 'kv'))) == ['data.log', 'keys']
+
+
+@pytest.mark.asyncio
+async def test_log_backend(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    d0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/', backend='log').client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    await d0.set(('x', 'y'), 'a')
+    await d0.set(('x', 'y'), b'b')
+
+    assert await d0.get(('x', 'y')) == b'b'
+    assert await d0.list(('x',)) == ['y']
+    assert len(await d0.list_versions(('x', 'y'))) == 2
+
+
+def test_log_checkpoints_share_container(tmp_path):
+    from telekinesis_data.timetravel import TimetravelerKV
+
+    path = str(tmp_path / 'meta')
+    kv = TimetravelerKV(path, container=LogFileContainer)
+    for key in (('a',), ('b',), ('c',)):
+        kv.set(key, [('u', {'value': key[0]})])
+        kv.checkpoint(key)
+    kv.checkpoints._shared.close()
+
+    checkpoints = os.path.join(path, 'checkpoints')
+    logs = [root for root, _, files in os.walk(checkpoints) if 'data.log' in files]
+    assert logs == [checkpoints]
+    kv = TimetravelerKV(path, container=LogFileContainer)
+    assert [kv.get(key) for key in (('a',), ('b',), ('c',))] == [{'value': 'a'}, {'value': 'b'}, {'value': 'c'}]
@@ -0,0 +1,64 @@
+import os
+import time
+
+from telekinesis_data.blobs import BlobStore
+from telekinesis_data.storage import Stream
+from telekinesis_data.timetravel import TimetravelerKV
+
+
+def test_blob_store_gc(tmp_path):
+    path = str(tmp_path / 'data')
+    os.makedirs(path)
+    with open(os.path.join(path, 'A' * 43), 'wb') as f:
+        f.write(b'legacy')
+    Stream(os.path.join(path, 'plainkeys')).update({'A' * 43: None})
+
+    meta = TimetravelerKV(str(tmp_path / 'meta'))
+    blobs = BlobStore(path)
+    assert blobs.get('A' * 43) == b'legacy'
+
+    for value in [b'old', b'new']:
+        h = ('B' if value == b'old' else 'C') * 43
+        meta.set(('b', 'x'), [('u', {'value': h})])
+        blobs.set(h, value)
+    assert os.path.exists(os.path.join(path, 'BB', 'BB', 'B' * 43))
+
+    assert blobs.collect(meta.references(), dry_run=True) == {'blobs': 1, 'bytes': 6}
+    assert blobs.collect(meta.references()) == {'blobs': 1, 'bytes': 6}
+    assert 'A' * 43 not in blobs and blobs.get('B' * 43) == b'old'
+
+    time.sleep(0.01)
+    assert blobs.collect(meta.references(horizon=time.time())) == {'blobs': 1, 'bytes': 3}
+    assert blobs.get('C' * 43) == b'new' and blobs.get('B' * 43) is None
+
+    blobs = BlobStore(path, grace=60)
+    blobs.set('D' * 43, b'fresh')
+    assert blobs.collect(meta.references()) == {'blobs': 0, 'bytes': 0} and blobs.get('D' * 43) == b'fresh'
+
+
+def test_blob_store_threads(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+
+    blobs = BlobStore(str(tmp_path / 'data'), grace=60)
+    keys = [f'{i:043d}' for i in range(200)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda k: blobs.set(k, k.encode() * 100), keys))
+        fresh = [pool.submit(blobs._fresh) for _ in range(20)]
+    assert all(f.result() <= set(keys) for f in fresh)
+    assert blobs.collect({}) == {'blobs': 0, 'bytes': 0}
+    assert BlobStore(str(tmp_path / 'data')).get(keys[7]) == keys[7].encode() * 100
+
+
+def test_references_keep_branch_origins(tmp_path):
+    meta = TimetravelerKV(str(tmp_path / 'meta'))
+    meta.set(('b', 'x'), [('u', {'value': 'h1'})])
+    origin = time.time()
+    time.sleep(0.01)
+    meta.set(('b', 'x'), [('u', {'value': 'h2'})])
+    horizon = time.time()
+    assert set(meta.references(horizon=horizon)) == {'h2'}
+
+    branch = {'branch_id': 'c', 'origin_id': 'b', 'origin_timestamp': origin, 'origin_key': []}
+    meta.set(('b',), [('uu', {'branches': {'old': branch}})])
+    assert set(meta.references(horizon=horizon)) == {'h1', 'h2'}
+    assert set(meta.references(horizon=horizon, pins=[(('b', 'x'), origin)])) == {'h1', 'h2'}
@@ -0,0 +1,123 @@
+import asyncio
+import os
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+from telekinesis_data.blobs import BlobStore, CHUNK_SIZE
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8805
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_resume_transfer(tmp_path):
+    source = BlobStore(str(tmp_path / 'source'))
+    value = os.urandom(3 * CHUNK_SIZE + 10)
+    value_hash = '0' + td.TelekinesisData._hash(None, value)
+    source.set(value_hash, value)
+
+    class Reader:
+        def __init__(self):
+            self.calls = []
+        async def read(self, index):
+            self.calls.append(index)
+            return await source.reader(value_hash).read(index)
+
+    target = BlobStore(str(tmp_path / 'target'))
+    os.makedirs(target._partial)
+    with open(os.path.join(target._partial, value_hash), 'wb') as f:
+        f.write(value[:CHUNK_SIZE + 5])
+
+    reader = Reader()
+    await target.receive(value_hash, reader, window=2)
+    assert target.get(value_hash) == value
+    assert min(reader.calls) == 1 and not os.listdir(target._partial)
+
+    with pytest.raises(ValueError):
+        await BlobStore(str(tmp_path / 'other')).receive('0' + 'A' * 43, source.reader(value_hash))
+
+
+async def test_compressed_transfer(tmp_path):
+    source = BlobStore(str(tmp_path / 'source'))
+    value = ' '.join(str(i * 7919 % 100003) for i in range(200000)).encode()
+    value_hash = '0' + td.TelekinesisData._hash(None, value)
+    source.set(value_hash, value)
+    assert source.codec(value_hash) and source.size(value_hash) < len(value) // 2
+    assert source.get(value_hash) == value
+
+    target = BlobStore(str(tmp_path / 'target'))
+    reader = source.reader(value_hash)
+    await target.receive(value_hash, reader)
+    assert target.codec(value_hash) == reader.codec and target.size(value_hash) == source.size(value_hash)
+    assert BlobStore(str(tmp_path / 'target')).get(value_hash) == value
+
+    plain = BlobStore(str(tmp_path / 'plain'), compression=None)
+    plain.set(value_hash, value)
+    assert not plain.codec(value_hash) and plain.size(value_hash) == len(value)
+
+
+async def test_chunked_transfer(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u0._session.instance_id = 'aaaaAAAA'
+
+    u1 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u1._session.instance_id = 'BBBBbbbb'
+
+    data0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/')
+    d0 = data0.client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    d1 = td.TelekinesisData(u1._session, str(tmp_path)+'data_1/').client
+
+    await u0.update({'d0': d0})
+    td0 = await u1.get('d0')
+
+    await td0.add_peer(d1)
+
+    big = os.urandom(2**20 + 7)
+    await d1.set(('x',), b'small')
+    await d0.set(('x',), big)
+
+    assert await d1.get(('x',)) == big
+    assert await d0.get(('x',)) == big
+
+    await d1.set(('y',), big[::-1])
+    assert await d0.get(('y',)) == big[::-1]
+
+    text = ' '.join(str(i * 7919 % 100003) for i in range(400000)).encode()
+    await d1.set(('z',), text)
+    assert await d0.get(('z',)) == text
+    assert await d0.get(('z',)) == text
+    await d1.set(('w',), b'w' * 1000)
+    assert await d0.get_many([('w',), ('z',), ('w',)]) == [b'w' * 1000, text, b'w' * 1000]
+    assert data0._cache.cache_info()['hits'] == 3 and '0' + data0._hash(b'w' * 1000) in data0._cache
+    transferred = (await d0.stats())['getter_bytes']
+    assert transferred['sent'] >= len(big) and transferred['received'] > 0
+
+
+async def test_blob_cache(tmp_path):
+    from telekinesis_data.blobs import BlobCache
+
+    cache = BlobCache(str(tmp_path / 'cache'), compression=None, max_bytes=2500)
+    values = [bytes([i]) * 1000 for i in range(3)]
+    hashes = ['0' + td.TelekinesisData._hash(None, v) for v in values]
+
+    assert cache.put(hashes[0], values[0]) == values[0]
+    cache.put(hashes[1], values[1])
+    assert cache.get(hashes[0]) == values[0]
+    cache.put(hashes[2], values[2])
+    assert cache.get(hashes[0]) and cache.get(hashes[1]) is None and hashes[1] not in cache
+    assert cache.cache_info() == {'hits': 2, 'misses': 1, 'entries': 2, 'bytes': 2000}
+
+    with pytest.raises(ValueError):
+        cache.put(hashes[1], values[0])
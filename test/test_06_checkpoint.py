@@ -0,0 +1,182 @@
+import asyncio
+import os
+import ujson
+import time
+import pytest
+
+from telekinesis_data.checkpoint import RecordCountPolicy, ReplayCostPolicy, AdaptivePolicy
+from telekinesis_data.storage import FrameStream
+from telekinesis_data.timetravel import TimetravelerKV
+
+
+def test_record_count_policy(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(3))
+    for i in range(7):
+        kv.set(('b', 'x'), [('ua', {'children': str(i)})])
+
+    assert len(kv.checkpoints.get(('b', 'x')).keys()) == 2
+    assert kv.get(('b', 'x')) == {'children': [str(i) for i in range(7)]}
+    versions = kv.list_versions(('b', 'x'))
+    assert len(versions) == 7
+    assert kv.get(('b', 'x'), versions[3]) == {'children': ['0', '1', '2', '3']}
+
+
+def test_stats_follow_index(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(3), max_indexes=1)
+    for i in range(2):
+        kv.set(('b', 'x'), [('+', 1)])
+    kv.set(('b', 'y'), [('+', 1)])
+    assert list(kv._indexes) == [('b', 'y')]
+
+    kv.set(('b', 'x'), [('+', 1)])
+    assert ('b', 'x') in kv.checkpoints and kv.get(('b', 'x')) == 3
+
+
+def test_checkpoint_after_clock(tmp_path, monkeypatch):
+    import telekinesis_data.timetravel as timetravel
+
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(3))
+    monkeypatch.setattr(timetravel.time, 'time', lambda: 1000.0)
+    for i in range(7):
+        kv.set(('b', 'x'), [('+', 1)])
+    monkeypatch.undo()
+
+    assert kv.list_versions(('b', 'x'))[-1] > 1000.0
+    assert TimetravelerKV(str(tmp_path)).get(('b', 'x')) == 7
+
+
+@pytest.mark.asyncio
+async def test_deferred_checkpoint(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), policy=ReplayCostPolicy(max_records=5, max_seconds=None))
+    for i in range(10):
+        kv.set(('b', 'x'), [('+', 1)])
+
+    assert kv.get(('b', 'x')) == 10
+    assert ('b', 'x') not in kv.checkpoints
+    await kv._executor.run(('b', 'x'), lambda: None)
+
+    assert len(kv.checkpoints.get(('b', 'x')).keys()) == 1
+    assert kv.get(('b', 'x')) == 10 and kv.stats(('b', 'x'))['replayed'] == 0
+
+
+def test_adaptive_policy(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), policy=AdaptivePolicy(min_records=4, default_cost=0))
+    for i in range(3):
+        kv.set(('b', 'x'), [('+', 1)])
+        kv.get(('b', 'x'))
+    assert ('b', 'x') not in kv.checkpoints
+
+    kv.set(('b', 'x'), [('+', 1)])
+    kv.get(('b', 'x'))
+    assert ('b', 'x') in kv.checkpoints and kv.get(('b', 'x')) == 4
+
+
+@pytest.mark.parametrize('log_format', ['jsonl', 'frames'])
+def test_time_index(tmp_path, log_format):
+    stream = FrameStream if log_format == 'frames' else None
+    kv = TimetravelerKV(str(tmp_path), stream, policy=RecordCountPolicy(4))
+    for i in range(10):
+        kv.set(('b', 'x'), [('+', 1)])
+    versions = kv.list_versions(('b', 'x'))
+
+    assert versions == sorted(versions) and len(versions) == 10
+    assert [kv.get(('b', 'x'), t) for t in versions] == list(range(1, 11))
+    assert kv.list_versions(('b', 'x'), versions[5]) == versions[:6]
+
+    os.remove(kv.log.path(('b', 'x')) + '.tidx')
+    kv = TimetravelerKV(str(tmp_path), stream, policy=RecordCountPolicy(4))
+    assert kv.list_versions(('b', 'x')) == versions
+    assert kv.get(('b', 'x'), versions[6]) == 7
+
+    kv.log.get(('b', 'x'), 2).update({time.time(): [('+', 1)]})
+    kv = TimetravelerKV(str(tmp_path), stream, policy=RecordCountPolicy(4))
+    assert len(kv.list_versions(('b', 'x'))) == 11 and kv.get(('b', 'x')) == 11
+
+    tidx = kv.log.path(('b', 'y')) + '.tidx'
+    for i in range(3):
+        kv.set(('b', 'y'), [('+', 1)])
+    assert not os.path.exists(tidx)
+    kv = TimetravelerKV(str(tmp_path), stream, policy=RecordCountPolicy(4))
+    assert len(kv.list_versions(('b', 'y'))) == 3 and kv.get(('b', 'y')) == 3
+
+
+def test_latest_cache(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), cache_bytes=200)
+    kv.set(('b', 'x'), [('u', {'value': 'a'}), ('ua', {'children': 'c0'})])
+    assert kv.get(('b', 'x')) == {'value': 'a', 'children': ['c0']}
+
+    for i in range(1, 4):
+        kv.set(('b', 'x'), [('ua', {'children': f'c{i}'})])
+    value = kv.get(('b', 'x'))
+    assert value == {'value': 'a', 'children': ['c0', 'c1', 'c2', 'c3']}
+    value['children'].clear()
+    assert kv.get(('b', 'x'), kv.list_versions(('b', 'x'))[-1])['children'] == ['c0', 'c1', 'c2', 'c3']
+    assert kv.cache_info()['hits'] == 2 and kv.cache_info()['misses'] == 1
+
+    kv.set(('b', 'y'), [('r', 'y' * 180)])
+    kv.get(('b', 'y'))
+    assert kv.cache_info()['entries'] == 1 and kv.cache_info()['bytes'] <= 200
+    assert TimetravelerKV(str(tmp_path)).get(('b', 'x')) == kv.get(('b', 'x'))
+
+    kv = TimetravelerKV(str(tmp_path / 'sized'))
+    kv.set(('b', 'z'), [('u', {'value': 'a' * 50, 'n': 1})])
+    kv.get(('b', 'z'))
+    kv.set(('b', 'z'), [('p', ['value'])])
+    assert kv.cache_info()['bytes'] == len(ujson.dumps(kv.get(('b', 'z')))) == len('{"n":1}')
+
+
+@pytest.mark.asyncio
+async def test_async_interface(tmp_path):
+    from telekinesis_data.storage import KeyedExecutor
+
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(8), executor=KeyedExecutor(3))
+    seen = []
+    kv.listeners.append(lambda key, t, changes: seen.append(key))
+
+    keys = [('b', str(i % 4)) for i in range(40)]
+    timestamps = await asyncio.gather(*(kv.aset(key, [('a', i)]) for i, key in enumerate(keys)))
+    assert sorted(seen) == sorted(keys)
+
+    for j in range(4):
+        assert await kv.aget(('b', str(j))) == list(range(j, 40, 4))
+        assert kv.get(('b', str(j))) == list(range(j, 40, 4))
+        assert await kv.alist_versions(('b', str(j))) == timestamps[j::4]
+    assert await kv.aget(('b', '1'), timestamps[5]) == [1, 5]
+    assert [t async for t, _ in kv.aiter(('b', '2'), timestamps[30])] == timestamps[34::4]
+
+
+@pytest.mark.asyncio
+async def test_atomic_update(tmp_path):
+    from concurrent.futures import ThreadPoolExecutor
+    from telekinesis_data.storage import KeyedExecutor
+
+    kv = TimetravelerKV(str(tmp_path), executor=KeyedExecutor(3))
+    increment = lambda value: [('r', (value or 0) + 1)]
+    with ThreadPoolExecutor(4) as pool:
+        threaded = [pool.submit(kv.update, ('b', 'n'), increment) for _ in range(50)]
+        await asyncio.gather(*(kv.aupdate(('b', 'n'), increment) for _ in range(50)))
+    assert sorted(f.result() for f in threaded)[-1] <= 100 and kv.get(('b', 'n')) == 100
+
+    kv.set(('b', 'y'), [('r', 1)])
+    other = next(('b', str(i)) for i in range(100) if kv._locked(('b', str(i))) is not kv._locked(('b', 'y')))
+    with kv._locked(('b', 'y')):
+        assert await asyncio.wait_for(asyncio.to_thread(kv.get, other), 1) is None
+
+def test_compressed_frames_and_checkpoints(tmp_path):
+    from functools import partial
+
+    kv = TimetravelerKV(str(tmp_path), partial(FrameStream), policy=RecordCountPolicy(3))
+    for i in range(7):
+        kv.set(('b', 'x'), [('u', {'text': 'hello world ' * 200, 'i': i})])
+
+    kv = TimetravelerKV(str(tmp_path), partial(FrameStream))
+    assert kv.get(('b', 'x')) == {'text': 'hello world ' * 200, 'i': 6}
+    assert kv.get(('b', 'x'), kv.list_versions(('b', 'x'))[1])['i'] == 1
+    sizes = [os.path.getsize(os.path.join(r, f)) for r, _, files in os.walk(tmp_path) for f in files]
+    assert max(sizes) < 1000
+
+    plain = TimetravelerKV(str(tmp_path / 'plain'), partial(FrameStream, compression=None), compression=None)
+    plain.set(('b', 'x'), [('u', {'text': 'hello world ' * 200})])
+    assert all(flags >> 4 == 0 for _, flags, _ in plain.log.peek(('b', 'x')).frames())
+    plain.log.get(('b', 'y')).rewrite({1.0: [('u', {'text': 'hello world ' * 200})]})
+    assert all(flags >> 4 == 0 for _, flags, _ in plain.log.peek(('b', 'y')).frames())
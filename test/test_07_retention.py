@@ -0,0 +1,68 @@
+import os
+import types
+import pytest
+
+from telekinesis_data import timetravel
+from telekinesis_data.checkpoint import RecordCountPolicy
+from telekinesis_data.storage import FrameStream
+from telekinesis_data.retention import RetentionPolicy, Compactor
+from telekinesis_data.timetravel import TimetravelerKV
+
+
+@pytest.mark.parametrize('stream', [None, FrameStream])
+def test_retention(tmp_path, monkeypatch, stream):
+    clock = [1000]
+    monkeypatch.setattr(timetravel, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+    kv = TimetravelerKV(str(tmp_path), stream, policy=RecordCountPolicy(16))
+    for i in range(100):
+        clock[0] = 1000 + i
+        kv.set(('b', 'x'), [('u', {'value': f'h{i}'})])
+    clock[0] = 1100
+
+    compactor = Compactor(kv, {('b',): RetentionPolicy(keep_all=20, snapshot_interval=10, keep_snapshots=40)})
+    out = compactor.run(now=1100)
+    assert out['keys'] == 1 and out['versions'] == 76 and out['bytes'] > 0
+    assert compactor.run(now=1100)['versions'] == 0
+
+    retained = [1049, 1059, 1069, 1079, *range(1080, 1100)]
+    for kv in [kv, TimetravelerKV(str(tmp_path), stream)]:
+        assert kv.list_versions(('b', 'x')) == retained
+        assert kv.get(('b', 'x'), 1030) is None
+        assert kv.get(('b', 'x'), 1055) == {'value': 'h49'}
+        assert kv.get(('b', 'x'), 1085) == {'value': 'h85'}
+        assert kv.get(('b', 'x')) == {'value': 'h99'}
+    assert set(kv.references()) == {f'h{t - 1000}' for t in retained}
+
+    os.remove(kv.log.path(('b', 'x')) + '.tidx')
+    assert TimetravelerKV(str(tmp_path), stream).list_versions(('b', 'x')) == retained
+
+def test_compaction_recovers(tmp_path, monkeypatch):
+    clock = [1000]
+    monkeypatch.setattr(timetravel, 'time', types.SimpleNamespace(time=lambda: clock[0]))
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(16))
+    for i in range(50):
+        clock[0] = 1000 + i
+        kv.set(('b', 'x'), [('u', {'value': f'h{i}'})])
+
+    def crash(key, history):
+        raise OSError
+    monkeypatch.setattr(kv, '_write_history', crash)
+    with pytest.raises(OSError):
+        kv.compact(('b', 'x'), [1039, 1040])
+    assert os.path.exists(kv.log.path(('b', 'x')) + '.compact')
+
+    kv = TimetravelerKV(str(tmp_path))
+    assert kv.list_versions(('b', 'x')) == list(range(1039, 1050))
+    assert kv.get(('b', 'x'), 1039) == {'value': 'h39'} and kv.get(('b', 'x')) == {'value': 'h49'}
+    assert not os.path.exists(kv.log.path(('b', 'x')) + '.compact')
+
+@pytest.mark.asyncio
+async def test_compactor_async(tmp_path):
+    kv = TimetravelerKV(str(tmp_path), policy=RecordCountPolicy(16))
+    for i in range(40):
+        kv.set(('b', 'x'), [('u', {'value': i})])
+    versions = kv.list_versions(('b', 'x'))
+    compactor = Compactor(kv, {(): RetentionPolicy(keep_all=0, snapshot_interval=1e9)})
+    out = await compactor.arun(now=versions[-1] + 1)
+    assert out['keys'] == 1 and await kv.alist_versions(('b', 'x')) == versions[-1:]
+    assert kv.get(('b', 'x')) == {'value': 39}
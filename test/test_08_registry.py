@@ -0,0 +1,27 @@
+from telekinesis_data.registry import OwnershipRegistry
+from telekinesis_data.storage import SimpleKV
+
+
+def test_ownership_registry(tmp_path, monkeypatch):
+    registry = OwnershipRegistry(str(tmp_path))
+    registry.set(('b',), 'p0')
+    registry.set(('b', 'x'), 'p1')
+    registry.set(('b', 'x', 'y', 'z'), 'p2')
+    registry.set(('c', 'x'), 'p3')
+    registry.set(('b', 'x'), None)
+
+    registry = OwnershipRegistry(str(tmp_path))
+    reads = []
+    get = SimpleKV.get
+    monkeypatch.setattr(SimpleKV, 'get', lambda self, key: reads.append(key) or get(self, key))
+
+    assert registry.get(('b', 'x', 'y', 'z')) == 'p2'
+    assert registry.get(('b', 'x')) is None and registry.get(('b', 'x', 'y')) is None
+    assert registry.match(('b', 'x', 'y', 'z', 'w')) == (('b', 'x', 'y', 'z'), 'p2')
+    assert registry.match(('b', 'x', 'q')) == (('b',), 'p0')
+    assert registry.match(('d', 'x')) == (None, None)
+    assert len(reads) == 3
+
+    registry.set(('b', 'x', 'q'), 'p4')
+    assert registry.match(('b', 'x', 'q', 'r')) == (('b', 'x', 'q'), 'p4')
+    assert registry.get(('c', 'x')) == 'p3' and len(reads) == 4
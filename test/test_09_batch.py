@@ -0,0 +1,153 @@
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8809
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_get_set_many(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u0._session.instance_id = 'aaaaAAAA'
+
+    u1 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u1._session.instance_id = 'BBBBbbbb'
+
+    data_0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/')
+    d0 = data_0.client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    data_1 = td.TelekinesisData(u1._session, str(tmp_path)+'data_1/')
+    d1 = data_1.client
+
+    await u0.update({'d0': d0})
+    td0 = await u1.get('d0')
+
+    await td0.add_peer(d1)
+
+    big = b'x' * (2**18 + 10)
+    timestamps = await d1.set_many([(('a',), 1), (('b',), 'two', {'m': 1}), (('a', 'c'), big)])
+    assert len(timestamps) == 3 and all(isinstance(t, float) for t in timestamps)
+
+    assert await d0.get_many([('a',), ('b',), ('a', 'c'), ('z',)]) == [1, 'two', big, None]
+    assert await d0.get_many([('b',)], metadata=True) == [{'m': 1}]
+
+    await d0.set_many([(('a',), 5), (('b',), 6), (('d',), 7)])
+    assert await d1.get_many([('d',), ('b',), ('a',)]) == [7, 6, 5]
+    assert await d0.get(('a', 'c')) == big
+
+    class Spy:
+        def __init__(self, peer):
+            self.peer, self.calls = peer, []
+        def __getattr__(self, name):
+            self.calls.append(name)
+            return getattr(self.peer, name)
+
+    assert data_0._registry.get(('AAAAaaaaAAAAcccc', 'a')) == data_1.id
+    spy = data_0._peers[data_1.id] = Spy(data_0._peers[data_1.id])
+    new = [(('a', f'n{i}'), i) for i in range(4)] + [(('a', 'n0', 'm'), big), (('e',), 8)]
+    out = await d0.set_many(new)
+    assert all(isinstance(t, float) for t in out) and spy.calls == ['set_many']
+    assert await d1.get_many([key for key, _ in new]) == [value for _, value in new]
+    assert data_0._registry.get(('AAAAaaaaAAAAcccc', 'a', 'n1')) == data_0.id
+
+    batches = []
+    begin = data_0._writer._begin
+    data_0._writer._begin = lambda: batches.append(1) or begin()
+    out = await d0.set_many([(('a', 'p0'), None, None, True), (('a', 'p1'), 'p1')])
+    assert all(isinstance(t, float) for t in out) and len(batches) == 1
+    assert await d1.get_many([('a', 'p0'), ('a', 'p1')]) == [None, 'p1']
+
+async def test_write_batch_journal(tmp_path):
+    from telekinesis_data.storage import StreamWriter, Stream, SimpleFileContainer
+    from functools import partial
+
+    writer = StreamWriter(journal=str(tmp_path / 'journal'))
+    container = SimpleFileContainer(str(tmp_path / 'files'), partial(Stream, writer=writer))
+    log = Stream(str(tmp_path / 'log'), writer=writer)
+
+    with writer.batch():
+        log.update({'a': 1})
+        container.set('x', b'old')
+    assert (tmp_path / 'journal').read_bytes() == b''
+
+    batch = writer.batch()
+    batch.__enter__()
+    log.update({'b': 2})
+    container.set('x', b'new')
+    container.set('y', b'y')
+    assert container.get('x') == b'new' and list(log) == [('a', 1), ('b', 2)]
+    assert (tmp_path / 'files' / 'x.undo').read_bytes() == b'old'
+    writer.flush()
+
+    recovered = StreamWriter(journal=str(tmp_path / 'journal'))
+    assert not (tmp_path / 'journal').exists()
+    container = SimpleFileContainer(str(tmp_path / 'files'), partial(Stream, writer=recovered))
+    assert list(Stream(str(tmp_path / 'log'))) == [('a', 1)]
+    assert container.get('x') == b'old' and container.keys() == ['x']
+    assert not (tmp_path / 'files' / 'y').exists() and not (tmp_path / 'files' / 'x.undo').exists()
+
+async def test_write_batch_commits_under_load(tmp_path):
+    from telekinesis_data.storage import StreamWriter, Stream, KeyedExecutor
+
+    writer = StreamWriter(window=0.01, journal=str(tmp_path / 'journal'))
+    log = Stream(str(tmp_path / 'log'), writer=writer)
+    executor = KeyedExecutor()
+    running = True
+
+    async def request(n):
+        i = 0
+        while running:
+            async with writer.abatch(executor):
+                log.update({f'{n}.{i}': i})
+                await asyncio.sleep(0.001)
+            i += 1
+
+    tasks = [asyncio.ensure_future(request(n)) for n in range(4)]
+    await asyncio.sleep(0.2)
+    assert len(list(Stream(str(tmp_path / 'log')))) > 10
+    running = False
+    await asyncio.gather(*tasks)
+    await asyncio.sleep(0.05)
+    assert len(list(Stream(str(tmp_path / 'log')))) == len(list(log))
+    assert (tmp_path / 'journal').read_bytes() == b''
+    executor.close()
+
+async def test_write_batch_commits_outside_turn(tmp_path):
+    from telekinesis_data.storage import StreamWriter, Stream, KeyedExecutor
+    import time
+
+    writer = StreamWriter(journal=str(tmp_path / 'journal'))
+    log = Stream(str(tmp_path / 'log'), writer=writer)
+    executor = KeyedExecutor()
+    events = []
+    commit = writer.commit
+
+    def slow_commit():
+        time.sleep(0.05)
+        commit()
+    writer.commit = slow_commit
+
+    async def request(n):
+        async with writer.abatch(executor):
+            events.append(f'body {n}')
+            log.update({str(n): n})
+        events.append(f'done {n}')
+        assert len(list(Stream(str(tmp_path / 'log')))) > n
+
+    await asyncio.gather(request(0), request(1))
+    assert events.index('body 1') < events.index('done 0')
+    assert list(Stream(str(tmp_path / 'log'))) == [('0', 0), ('1', 1)]
+    executor.close()
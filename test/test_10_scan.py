@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8810
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_scan(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u0._session.instance_id = 'aaaaAAAA'
+
+    u1 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u1._session.instance_id = 'BBBBbbbb'
+
+    data0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/')
+    d0 = data0.client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    d1 = td.TelekinesisData(u1._session, str(tmp_path)+'data_1/').client
+
+    await u0.update({'d0': d0})
+    td0 = await u1.get('d0')
+
+    await td0.add_peer(d1)
+
+    for key in [('a', 'x'), ('a', 'y', 'z'), ('a', 'w'), ('b',)]:
+        await d0.set(key, 1)
+    for key in [('a', 'r'), ('a', 'r', 's'), ('a', 'r', 's', 't')]:
+        await d1.set(key, 2)
+
+    keys = [k async for k, _ in data0.scan(('a',), page_size=2)]
+    assert sorted(keys) == sorted([
+        ('a',), ('a', 'x'), ('a', 'y'), ('a', 'y', 'z'), ('a', 'w'), ('a', 'r'), ('a', 'r', 's'), ('a', 'r', 's', 't')])
+    assert len(set(keys)) == len(keys)
+
+    tree = await data0.tree(None, ('a',), depth=1)
+    assert sorted(tree) == [('a',), ('a', 'r'), ('a', 'w'), ('a', 'x'), ('a', 'y')]
+    assert all(isinstance(v, float) for v in tree.values())
+    assert sorted(await data0.tree(None, ('a',), prefix='r', depth=2)) == [('a',), ('a', 'r'), ('a', 'r', 's')]
+    assert len(await data0.tree(None, (), limit=3)) == 3
+
+    for c in '350142':
+        await d0.set(('c', c), 3)
+    entries, _, cursor = await data0.scan_page(None, ('c',), None, 3)
+    assert [tuple(k) for k, _ in entries] == [('c',), ('c', '0'), ('c', '1')]
+    await d0.remove(('c', '1'))
+    entries, _, cursor = await data0.scan_page(None, ('c',), cursor, 10)
+    assert [tuple(k) for k, _ in entries] == [('c', '2'), ('c', '3'), ('c', '4'), ('c', '5')] and cursor is None
+
+    threads = []
+    walk = data0._walk
+    data0._walk = lambda *args: threads.append(threading.current_thread()) or walk(*args)
+    entries, _, _ = await data0.scan_page(None, ('c',), None, 10)
+    assert len(entries) == 6 and threads and threading.main_thread() not in threads
@@ -0,0 +1,80 @@
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+from telekinesis_data.indexes import MetadataIndexes, plan
+from telekinesis_data.timetravel import TimetravelerKV
+
+BROKER_PORT = 8811
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+def test_plan():
+    assert plan("kind == 'a' and 1 < size <= n", {'n': 5}) == (
+        [('kind', '==', 'a'), ('size', '>', 1), ('size', '<=', 5)], True)
+    assert plan("name.startswith('x') or size > 1", {}) == ([], False)
+    assert plan("kind in ('a', 'b') and math.floor(size) == 1", {}) == ([('kind', 'in', ('a', 'b'))], False)
+
+
+def test_metadata_indexes(tmp_path):
+    local = TimetravelerKV(str(tmp_path / 'meta'))
+    indexes = MetadataIndexes(str(tmp_path / 'indexes'), local)
+    indexes.declare(('b',), 'kind')
+    indexes.declare(('b',), 'size', 'sorted')
+    indexes.declare(('b',), 'name', 'sorted')
+
+    children = [f'c{i}' for i in range(10)]
+    for i, c in enumerate(children):
+        local.set(('b', 'p', c), [('uu', {'metadata': {'kind': 'ab'[i % 2], 'size': i, 'name': f'n{i}'}})])
+
+    assert indexes.candidates(('b', 'p'), children, "kind == 'a' and size >= 6") == ({'c6', 'c8'}, True)
+    assert indexes.candidates(('b', 'p'), children, "name.startswith('n1')") == ({'c1'}, True)
+
+    local.set(('b', 'p', 'c6'), [('uu', {'metadata': {'size': 0}})])
+    local.set(('b', 'p'), [('um', {'children': 'c8'})])
+    assert indexes.candidates(('b', 'p'), children, "kind == 'a' and size >= 6") == (set(), True)
+    assert indexes.candidates(('b', 'p'), children, "size < 2 and other") == ({'c0', 'c1', 'c6'}, False)
+
+    assert MetadataIndexes(str(tmp_path / 'indexes'), local).specs(('b', 'p')) == {
+        'kind': 'hash', 'size': 'sorted', 'name': 'sorted'}
+
+
+@pytest.mark.asyncio
+async def test_list_query(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u0._session.instance_id = 'aaaaAAAA'
+
+    u1 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u1._session.instance_id = 'BBBBbbbb'
+
+    d0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/').client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    data1 = td.TelekinesisData(u1._session, str(tmp_path)+'data_1/')
+    d1 = data1.client
+
+    await u0.update({'d0': d0})
+    td0 = await u1.get('d0')
+
+    await td0.add_peer(d1)
+
+    await d0.create_index(('p',), 'size', 'sorted')
+    for i in range(6):
+        await (d0 if i % 2 else d1).set(('p', f'c{i}'), i, {'size': i})
+    await d0.set(('p', 'c2'), 2, {'size': 20})
+
+    assert await d0.list(('p',), 'size >= 3') == ['c2', 'c3', 'c4', 'c5']
+    assert await d1.list(('p',), ['size < n', {'n': 2}]) == ['c0', 'c1']
+    assert data1._registry.get(('AAAAaaaaAAAAcccc', 'p')) == data1.id
+    assert data1._indexes.specs(('AAAAaaaaAAAAcccc', 'p')) == {'size': 'sorted'}
+    assert ('AAAAaaaaAAAAcccc', 'p') in data1._indexes._built
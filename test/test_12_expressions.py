@@ -0,0 +1,31 @@
+import pytest
+
+from telekinesis_data.expressions import compile_expression, evaluate, select
+
+
+def test_evaluate():
+    assert evaluate('size * 2 + n', {'size': 3}, {'n': 1}) == 7
+    assert evaluate('math.floor(x) == 1 and len(tags) == 2', {'x': 1.5, 'tags': ['a', 'b']})
+    assert evaluate('size', {'size': 1}, {'size': 2}) == 2
+    assert compile_expression('size > 1') is compile_expression('size > 1')
+    assert evaluate('2 ** 10 * x', {'x': 1.5}) == 1536 and evaluate("'ab' * 2", {}) == 'abab'
+    assert evaluate('time.time() > 0', {}) and evaluate('math.factorial(5) + math.comb(10 ** 9, 2)', {}) > 120
+    assert evaluate("x.zfill(4) + x.replace('1', 'ab')", {'x': '12'}) == '0012ab2'
+
+
+@pytest.mark.parametrize('source', [
+    "().__class__.__bases__", "__import__('os')", "open('x')", "[x for x in y]", "(lambda: 1)()", "(x := 1)",
+    "time.sleep(10)", "'{0.__class__}'.format(x)", "str.format_map('{x}', {})", "__pow(2, 2)",
+    "9 ** 9 ** 9", "'x' * 10 ** 9", "[0] * 2 ** 40", "(2 ** 4000) * (2 ** 4000)",
+    "'a'.ljust(10 ** 8)", "'a'.zfill(10 ** 8)", "str.center('a', 10 ** 8)", "[math.factorial][0](10 ** 6)",
+    "math.comb(10 ** 6, 5 * 10 ** 5)", "math.perm(10 ** 6)", "'\\t'.expandtabs(10 ** 8)",
+    "('a' * 60000).replace('a', 'a' * 60000)",
+])
+def test_rejects_unsafe(source):
+    with pytest.raises((ValueError, NameError, AttributeError)):
+        evaluate(source, {'x': 1, 'y': []})
+
+
+def test_select():
+    rows = [{'size': i, 'kind': 'ab'[i % 2]} for i in range(5)] + [None, {'kind': 'a'}]
+    assert select("kind == 'a' and size >= n", rows, {'n': 2}) == [False, False, True, False, True, False, False]
@@ -0,0 +1,104 @@
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+from telekinesis_data.subscriptions import Subscriptions, event_kind
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8813
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_coalesce():
+    received = []
+    subs = Subscriptions('owner')
+    sub = subs.add(('b', 'a'), received.append)
+    subs.add(('b', 'a', 'x'), received.append, recursive=False)
+
+    for i in range(5):
+        subs.publish(('b', 'a', 'x'), float(i), 'set')
+    subs.publish(('b', 'c'), 5., 'set')
+    await asyncio.sleep(0.01)
+
+    assert received == [[[['a', 'x'], 4., 'set']], [[['a', 'x'], 4., 'set']]]
+
+    assert sub.id.startswith('owner:') and len(subs) == 2
+    subs.remove(sub.id)
+    assert len(subs) == 1 and list(subs.covering(('b', 'a', 'y'))) == []
+
+    assert event_kind([['um', {'children': 'x'}]]) == 'children'
+    assert event_kind([['u', {'value': 1, 'metadata': {}}]]) == 'set'
+    assert event_kind([['u', {'metadata': {}}]]) == 'metadata'
+    assert event_kind([['u', {'metadata': {}, 'value': None}]]) == 'remove'
+
+async def test_subscribe(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u0._session.instance_id = 'aaaaAAAA'
+
+    u1 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    u1._session.instance_id = 'BBBBbbbb'
+
+    data0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/')
+    d0 = data0.client
+    await d0.begin('AAAAaaaaAAAAcccc')
+
+    data1 = td.TelekinesisData(u1._session, str(tmp_path)+'data_1/')
+    d1 = data1.client
+
+    await u0.update({'d0': d0})
+    td0 = await u1.get('d0')
+
+    await td0.add_peer(d1)
+
+    await d0.set(('a', 'x'), 0)
+    since = await d0.set(('a', 'x'), 1)
+    await d1.set(('a', 'r'), 2)
+
+    events = []
+    sub_id = await d1.subscribe(('a',), events.extend)
+    await d0.set(('a', 'x'), 3)
+    await d1.set(('a', 'r', 's'), 4)
+    await d0.set(('b',), 5)
+    await asyncio.sleep(0.3)
+
+    keys = [tuple(key) for key, _, _ in events]
+    assert ('a', 'x') in keys and ('a', 'r', 's') in keys and ('b',) not in keys
+    assert all(isinstance(t, float) and kind in ('set', 'children', 'update', 'metadata') for _, t, kind in events)
+
+    replayed = []
+    await d0.subscribe(('a', 'x'), replayed.extend, False, since)
+    await asyncio.sleep(0.3)
+    assert [tuple(k) for k, _, _ in replayed] == [('a', 'x')]
+    assert replayed[0][1] > since
+
+    assert await d0.unsubscribe(sub_id)
+    events.clear()
+    await d0.set(('a', 'x'), 6)
+    await d1.set(('a', 'r', 's'), 7)
+    await asyncio.sleep(0.3)
+    assert events == []
+    assert not await d1.unsubscribe(sub_id)
+
+    removed = []
+    await d0.subscribe(('a', 'x'), removed.extend, False)
+    await d0.remove(('a', 'x'))
+    await asyncio.sleep(0.3)
+    assert [kind for _, _, kind in removed] == ['remove']
+
+    def fail(events):
+        raise RuntimeError
+    await d0.subscribe(('a',), fail)
+    assert len(data0._subscriptions) == 3 and len(data1._subscriptions) == 1
+    await d0.set(('a', 'y'), 8)
+    await asyncio.sleep(0.3)
+    assert len(data0._subscriptions) == 2 and len(data1._subscriptions) == 0
@@ -0,0 +1,65 @@
+import os
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8814
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_file_sync(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    u0 = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+    data0 = td.TelekinesisData(u0._session, str(tmp_path)+'/data_0/')
+    d0 = data0.client
+    await d0.begin()
+
+    for d in ['dir_0/a/b', 'dir_1']:
+        os.makedirs(tmp_path / d)
+    (tmp_path / 'dir_0/x.txt').write_bytes(b'x')
+    (tmp_path / 'dir_0/a/b/big').write_bytes(os.urandom(2**19 + 7))
+
+    fs0 = td.FileSync(d0, str(tmp_path / 'dir_0'), str(tmp_path / 'support_0'), interval=0.1)
+    await asyncio.sleep(0.5)
+    assert await d0.get(('x.txt',)) == b'x'
+    assert await d0.get(('a', 'b', 'big')) == (tmp_path / 'dir_0/a/b/big').read_bytes()
+
+    fs1 = td.FileSync(d0, str(tmp_path / 'dir_1'), str(tmp_path / 'support_1'), interval=0.1)
+    await asyncio.sleep(0.5)
+    assert (tmp_path / 'dir_1/x.txt').read_bytes() == b'x'
+    assert (tmp_path / 'dir_1/a/b/big').read_bytes() == (tmp_path / 'dir_0/a/b/big').read_bytes()
+
+    versions = len(await d0.list_versions(('x.txt',)))
+    os.utime(tmp_path / 'dir_0/x.txt')
+    (tmp_path / 'dir_0/y.txt').write_bytes(b'y')
+    await asyncio.sleep(0.5)
+    assert len(await d0.list_versions(('x.txt',))) == versions
+    assert (tmp_path / 'dir_1/y.txt').read_bytes() == b'y'
+
+    os.remove(tmp_path / 'dir_1/x.txt')
+    await asyncio.sleep(0.5)
+    assert await d0.get(('x.txt',)) is None
+    assert not (tmp_path / 'dir_0/x.txt').exists()
+
+    text = ' '.join(str(i) for i in range(200000))
+    await d0.set(('a', 'text'), text)
+    await asyncio.sleep(0.5)
+    assert (tmp_path / 'dir_1/a/text').read_text() == text
+    assert not os.listdir(tmp_path / 'support_1/partial')
+
+    assert len(data0._subscriptions) == 2
+    fs0.stop()
+    fs1.stop()
+    await asyncio.sleep(0.1)
+    assert len(data0._subscriptions) == 0
@@ -0,0 +1,101 @@
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+
+pytestmark = pytest.mark.asyncio
+BROKER_PORT = 8815
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_migrate(tmp_path):
+    class Registry(dict): pass
+
+    broker = await tk.Broker().serve(port=BROKER_PORT)
+    URL = f"ws://localhost:{BROKER_PORT}"
+    broker.entrypoint, _ = await tk.create_entrypoint(Registry(), URL)
+
+    sessions = []
+    for instance_id in ('aaaaAAAA', 'BBBBbbbb', 'CCCCcccc'):
+        u = await tk.Entrypoint(URL, str(tmp_path)+'/session_0.pem')
+        u._session.instance_id = instance_id
+        sessions.append(u)
+    u0, u1, u2 = sessions
+
+    data = [td.TelekinesisData(u._session, str(tmp_path)+f'/data_{i}/') for i, u in enumerate(sessions)]
+    d0, d1, d2 = [d.client for d in data]
+    await d0.begin('AAAAaaaaAAAAcccc')
+    branch_id = 'AAAAaaaaAAAAcccc'
+
+    await u0.update({'d0': d0})
+    await (await u1.get('d0')).add_peer(d1)
+    await (await u2.get('d0')).add_peer(d2)
+
+    large = b'large value ' * 1000
+    await d0.set(('a', 'x'), large)
+    await d0.set(('a', 'x'), large + b'!', {'tag': 1})
+    await d0.set(('a', 'y'), 'small')
+    await d1.set(('a', 'r'), 3)
+    await d0.create_index(('a',), 'tag')
+    data[0]._local.checkpoint((branch_id, 'a', 'x'))
+
+    assert await d1.migrate(('a',), data[2].id) == 3
+    assert data[0]._registry.get((branch_id, 'a')) == data[2].id
+    assert data[2]._registry.get((branch_id, 'a', 'r')) == data[1].id
+    assert data[0]._local.last_version((branch_id, 'a', 'x')) is None
+    assert data[2]._local.get((branch_id, 'a', 'x'))['metadata'] == {'tag': 1}
+
+    for d in (d0, d1, d2):
+        assert await d.get(('a', 'x')) == large + b'!'
+        assert await d.get(('a', 'y')) == 'small'
+        assert await d.get(('a', 'r')) == 3
+        assert len(await d.list_versions(('a', 'x'))) == 2
+    assert await d0.list(('a',), 'tag == 1') == ['x']
+
+    out = await asyncio.gather(
+        d0.migrate(('a',), data[1].id)._execute(),
+        d2.set(('a', 'w'), 7)._execute(),
+        d0.set(('a', 'x', 'deep'), 8)._execute())
+    assert 3 <= out[0] <= 5
+    assert data[1]._registry.get((branch_id, 'a')) == data[1].id
+    for d in (d0, d1, d2):
+        assert await d.get(('a', 'w')) == 7
+        assert await d.get(('a', 'x', 'deep')) == 8
+    assert set(await d0.list(('a',))) == {'x', 'y', 'r', 'w'}
+
+    await d1.set(('c',), 1)
+    for d in data:
+        d.reset_load()
+    for _ in range(30):
+        await d1.get(('a', 'y'))
+    for _ in range(10):
+        await d1.get(('c',))
+    key, target_id = await data[1].rebalance()
+    assert tuple(key) == ('c',) and target_id in (data[0].id, data[2].id)
+    assert await d1.get(('c',)) == 1 and await d0.get(('c',)) == 1
+
+    stats = await d1.stats(True)
+    assert set(stats) == {d.id for d in data}
+    assert stats[data[1].id]['latency_us']['get']['count'] >= 40
+    assert sum(stats[data[0].id]['routes']['forwarded'].values()) > 0
+
+    await d0.create_branch((('a',), 'br'))
+    first = (await data[1]._overhead(None, (('a',), 'br')))[1]
+    await d2.create_branch((('a',), 'br'))
+    second = (await data[1]._overhead(None, (('a',), 'br')))[1]
+    assert first != second and second == data[1]._local.get((branch_id, 'a'))['branches']['br']['branch_id']
+
+async def test_load_tracking(tmp_path):
+    data = td.TelekinesisData(tk.Session(), str(tmp_path / 'data'), rebalance_interval=3600)
+    assert not data._idle and data._rebalancer._task is not None
+    data.begin()
+    data.max_tracked = 4
+    for i in range(10):
+        await data.set(None, ('a', str(i)), i)
+        await data.get(None, ('a', str(i)))
+    assert 0 < len(data._requests) <= 4
+    data._rebalancer.stop()
@@ -0,0 +1,53 @@
+import asyncio
+import pytest
+
+import telekinesis as tk
+import telekinesis_data as td
+from telekinesis_data.metrics import Histogram
+
+pytestmark = pytest.mark.asyncio
+
+@pytest.fixture
+def event_loop():  # This avoids 'Task was destroyed but it is pending!' message
+    yield asyncio.get_event_loop()
+
+
+async def test_histogram():
+    h = Histogram()
+    for value in [0, 1, 3, 5, 100, 1000]:
+        h.observe(value)
+    snapshot = h.snapshot()
+    assert snapshot['count'] == 6 and snapshot['max'] == 1000
+    assert snapshot['p50'] == 4 and snapshot['p99'] == 1000
+    assert snapshot['buckets'] == {'1': 1, '2': 1, '4': 1, '8': 1, '128': 1, '1024': 1}
+    assert Histogram().snapshot()['p50'] == 0
+
+async def test_stats(tmp_path):
+    data = td.TelekinesisData(tk.Session(), str(tmp_path / 'data'))
+    data.begin()
+    for i in range(5):
+        await data.set(None, ('a', str(i)), i)
+    await data.get(None, ('a', '0'))
+    await data.get(None, ('a', '1'), timestamp=(await data.list_versions(None, ('a', '1')))[0])
+    assert len(await data.list(('a',))) == 5
+    assert await data.get_many(None, [('a', '2'), ('a', '3')]) == [2, 3]
+
+    stats = await data.stats(None)
+    assert stats['id'] == data.id
+    assert stats['latency_us']['set']['count'] == 5 and stats['latency_us']['list']['count'] == 1
+    assert stats['latency_us']['get_many']['count'] == 1 and stats['latency_us']['get']['count'] == 2
+    assert stats['routes']['local'] > 0 and stats['routes']['local_ratio'] == 1.0
+    assert stats['registry_lookups']['per_timed_call'] > 0 and stats['file_opens']['total'] > 0
+    assert stats['replay_length']['count'] >= 1
+    assert list(await data.stats(None, True)) == [data.id]
+
+async def test_stats_count_external_calls(tmp_path):
+    data = td.TelekinesisData(tk.Session(), str(tmp_path / 'data'))
+    other = td.TelekinesisData(tk.Session(), str(tmp_path / 'other'))
+    data.begin()
+    await data.set_many(None, [(('a',), 1), (('a', 'b'), 2), (('a', 'b', 'c'), 3)])
+    await data.remove(None, ('a',))
+
+    latency = (await data.stats(None))['latency_us']
+    assert 'set' not in latency and latency['remove']['count'] == 1
+    assert data._writer.file_opens > 0 and other._writer.file_opens < data._writer.file_opens